@@ -0,0 +1,265 @@
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from src.data.fetch_crypto_data import BinanceFetcher, EXCHANGE_INFO_WEIGHT, klines_request_weight
+from src.data.intervals import floor_open_time, interval_to_ms
+from src.utils.profiling import instrumented
+
+def synthetic_klines(symbol: str, interval: str, open_times: np.ndarray) -> List[List]:
+    """
+    Deterministic candles of `symbol` opening at `open_times` (epoch ms)
+
+    Prices are a smooth function of the open time, so any page can be
+    generated on its own and every request for it returns the same candles.
+    Each symbol gets its own price level and phase.
+    """
+    seed = zlib.crc32(symbol.encode())
+    base = 10.0 ** (seed % 6 - 1) * (1 + seed % 97 / 100)
+    t = open_times / 3.6e6
+    mid = base * np.exp(0.05 * np.sin(t / 97 + seed % 13) + 0.02 * np.sin(t / 11 + seed % 7))
+    swing = mid * (0.002 + 0.001 * np.abs(np.sin(t / 5)))
+    opens = mid - swing / 3
+    closes = mid + swing / 3 * np.sin(t)
+    highs = np.maximum(opens, closes) + swing
+    lows = np.minimum(opens, closes) - swing
+    volumes = 1000 * (1.5 + np.sin(t / 3 + seed % 5)) / base
+    step = interval_to_ms(interval)
+    return [
+        [int(ts), f"{o:.8f}", f"{h:.8f}", f"{l:.8f}", f"{c:.8f}", f"{v:.8f}",
+         int(ts) + step - 1, f"{v * c:.8f}", 100, f"{v / 2:.8f}", f"{v * c / 2:.8f}", "0"]
+        for ts, o, h, l, c, v in zip(open_times, opens, highs, lows, closes, volumes)
+    ]
+
+class BinanceStub:
+    """
+    Local stand-in for Binance's /api/v3/klines and /api/v3/exchangeInfo
+
+    Serves synthetic candles (see synthetic_klines) from `history_start` up
+    to the current candle, or the candles of a recording (see
+    record_klines), with an added latency per request. Requests are charged
+    the real endpoint weights against `weight_limit` per `window` seconds;
+    over the limit the stub answers 429 with Retry-After like Binance does,
+    so BinanceFetcher's backoff is exercised too.
+
+    Usage:
+        with BinanceStub(symbols=100) as stub:
+            fetcher = BinanceFetcher(stub.rest_url)
+    """
+
+    def __init__(self, symbols=10, history_start: Optional[int] = None,
+                 recording: Optional[str] = None, host: str = '127.0.0.1', port: int = 0,
+                 latency: float = 0.0, jitter: float = 0.0,
+                 weight_limit: Optional[int] = None, window: float = 60.0):
+        """
+        Args:
+            symbols: Synthetic symbol count, or a list of symbol names
+            history_start: Epoch ms of the first synthetic candle, defaults
+                to 1000 days ago
+            recording: JSON recording to serve instead of synthetic candles
+            host: Interface to listen on
+            port: Port to listen on, 0 picks a free one
+            latency: Seconds added to every response
+            jitter: Up to this many further seconds, drawn at random
+            weight_limit: Request weight allowed per window, None for no limit
+            window: Rate limit window in seconds
+        """
+        self.recording = None
+        if recording:
+            with open(recording) as f:
+                self.recording = json.load(f)
+            symbols = sorted(self.recording)
+        elif isinstance(symbols, int):
+            symbols = [f"SYM{i:04d}USDT" for i in range(symbols)]
+        self.symbols = list(symbols)
+        self.history_start = (history_start if history_start is not None
+                              else int(time.time() * 1000) - 1000 * 86400 * 1000)
+        self.latency = latency
+        self.jitter = jitter
+        self.weight_limit = weight_limit
+        self.window = window
+
+        self.requests = 0
+        self.throttled = 0
+        self._used_weight = 0
+        self._window_start = time.monotonic()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def rest_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/api/v3"
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                stub._respond(self, url.path, query)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _charge(self, weight: int) -> Optional[float]:
+        """Count a request, returning the seconds to wait when over the limit"""
+        with self._lock:
+            self.requests += 1
+            now = time.monotonic()
+            if now - self._window_start >= self.window:
+                self._window_start = now
+                self._used_weight = 0
+            self._used_weight += weight
+            if self.weight_limit is not None and self._used_weight > self.weight_limit:
+                self.throttled += 1
+                return self.window - (now - self._window_start)
+            return None
+
+    def _respond(self, handler: BaseHTTPRequestHandler, path: str, query: Dict) -> None:
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+
+        if path == '/api/v3/klines':
+            limit = min(int(query.get('limit', 500)), 1000)
+            weight = klines_request_weight(limit)
+        elif path == '/api/v3/exchangeInfo':
+            weight = EXCHANGE_INFO_WEIGHT
+        else:
+            return self._send(handler, 404, {'code': -1, 'msg': 'Unknown path'})
+
+        retry_after = self._charge(weight)
+        if retry_after is not None:
+            return self._send(handler, 429, {'code': -1003, 'msg': 'Too many requests'},
+                              {'Retry-After': f"{retry_after:.3f}"})
+        headers = {'X-MBX-USED-WEIGHT-1M': str(self._used_weight)}
+
+        if path == '/api/v3/exchangeInfo':
+            symbols = [{'symbol': symbol, 'status': 'TRADING', 'quoteAsset': 'USDT'}
+                       for symbol in self.symbols]
+            return self._send(handler, 200, {'symbols': symbols}, headers)
+
+        symbol = query.get('symbol')
+        if symbol not in self.symbols:
+            return self._send(handler, 400, {'code': -1121, 'msg': 'Invalid symbol.'})
+        interval = query.get('interval', '1d')
+        start = int(query['startTime']) if 'startTime' in query else None
+        end = int(query['endTime']) if 'endTime' in query else None
+        self._send(handler, 200, self.klines(symbol, interval, limit, start, end), headers)
+
+    def klines(self, symbol: str, interval: str, limit: int = 500,
+               start: Optional[int] = None, end: Optional[int] = None) -> List[List]:
+        """Candles as /klines returns them: from `start`, else the latest ones"""
+        if self.recording is not None:
+            klines = self.recording[symbol].get(interval, [])
+            if start is not None:
+                klines = [k for k in klines if k[0] >= start]
+            if end is not None:
+                klines = [k for k in klines if k[0] <= end]
+            return klines[:limit] if start is not None else klines[-limit:]
+
+        step = interval_to_ms(interval)
+        first = floor_open_time(self.history_start, interval)
+        last = floor_open_time(int(time.time() * 1000), interval)
+        if end is not None:
+            last = min(last, floor_open_time(end, interval))
+        if start is not None:
+            first = max(first, floor_open_time(start + step - 1, interval))
+            last = min(last, first + (limit - 1) * step)
+        else:
+            first = max(first, last - (limit - 1) * step)
+        if first > last:
+            return []
+        return synthetic_klines(symbol, interval, np.arange(first, last + 1, step))
+
+    def _send(self, handler: BaseHTTPRequestHandler, status: int, body,
+              headers: Optional[Dict] = None) -> None:
+        payload = json.dumps(body).encode()
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(payload)
+
+    def start(self) -> 'BinanceStub':
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> 'BinanceStub':
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+def record_klines(path: str, symbols: List[str], intervals: List[str], limit: int = 1000,
+                  fetcher: Optional[BinanceFetcher] = None) -> None:
+    """Save the latest `limit` live candles of each symbol as a stub recording"""
+    fetcher = fetcher or BinanceFetcher()
+    recording = {symbol: {interval: fetcher.get_klines(symbol, interval, limit)
+                          for interval in intervals}
+                 for symbol in symbols}
+    with open(path, 'w') as f:
+        json.dump(recording, f)
+    print(f"Recorded {len(symbols)} symbols to {path}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Binance REST API")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    record = subparsers.add_parser('record', help="Record live candles to a JSON file")
+    record.add_argument('path')
+    record.add_argument('--symbols', nargs='+', required=True)
+    record.add_argument('--intervals', nargs='+', default=['1d'])
+    record.add_argument('--limit', type=int, default=1000)
+
+    serve = subparsers.add_parser('serve', help="Serve synthetic or recorded candles")
+    serve.add_argument('--symbols', type=int, default=10, help="Synthetic symbol count")
+    serve.add_argument('--recording', help="Serve this recording instead")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8766)
+    serve.add_argument('--latency', type=float, default=0.0, help="Seconds per response")
+    serve.add_argument('--jitter', type=float, default=0.0)
+    serve.add_argument('--weight-limit', type=int, help="Request weight per window")
+    serve.add_argument('--window', type=float, default=60.0)
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        record_klines(args.path, args.symbols, args.intervals, args.limit)
+        return
+
+    stub = BinanceStub(args.symbols, recording=args.recording, host=args.host, port=args.port,
+                       latency=args.latency, jitter=args.jitter,
+                       weight_limit=args.weight_limit, window=args.window)
+    print(f"Serving {len(stub.symbols)} symbols on {stub.rest_url}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stub.server.server_close()
+
+if __name__ == "__main__":
+    with instrumented():
+        main()
@@ -0,0 +1,328 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+import pytz
+
+from src.benchmarks.binance_stub import BinanceStub
+from src.config import DB_CONFIG
+from src.data.fetch_crypto_data import (BinanceFetcher, DatabaseHandler, RequestWeightLimiter,
+                                        klines_to_frame)
+from src.data.intervals import from_ms, interval_to_ms
+from src.database.connection import Database
+from src.database.create_crypto_database import OHLC_TABLE_QUERY
+from src.database.symbol_stats import SYMBOL_STATS_TABLE_QUERY
+from src.database.watermarks import WATERMARK_TABLE_QUERY
+from src.utils.export_crypto_data import CryptoDataExporter
+from src.utils.profiling import instrumented
+from src.utils.view_crypto_data import CryptoDataViewer
+
+# Every run writes to this scratch schema, never to the real tables
+BENCH_SCHEMA = 'bench_e2e'
+DEFAULT_SCALES = [10, 100, 1000]
+# Client weight budget when the stub enforces none, never reached in a run
+UNLIMITED_WEIGHT = 10 ** 12
+STAGES = ['fetch', 'store', 'query', 'export']
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # Peak rather than current outside Linux (kilobytes there, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if platform.system() == 'Darwin' else peak * 1024
+
+class RssSampler:
+    """Samples the RSS in the background, keeping the peak seen"""
+
+    def __init__(self, interval: float = 0.02):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> 'RssSampler':
+        self.peak = current_rss()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+class StageRecorder:
+    """Latencies and item counts of the operations of one stage"""
+
+    def __init__(self):
+        self.latencies = []
+        self.items = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def time(self, operation: Callable, count: Callable = len):
+        """Run `operation`, recording its latency and count(result) items"""
+        start = time.perf_counter()
+        try:
+            result = operation()
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            print(f"Benchmark operation failed: {e}")
+            return None
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.latencies.append(elapsed)
+            self.items += count(result)
+        return result
+
+    def summary(self, seconds: float, peak_rss: int) -> Dict:
+        latencies = np.array(self.latencies) * 1000
+        return {
+            'operations': len(self.latencies),
+            'items': self.items,
+            'errors': self.errors,
+            'seconds': round(seconds, 3),
+            'items_per_second': round(self.items / seconds, 1) if seconds else 0.0,
+            'p50_ms': round(float(np.percentile(latencies, 50)), 3) if len(latencies) else None,
+            'p99_ms': round(float(np.percentile(latencies, 99)), 3) if len(latencies) else None,
+            'peak_rss_mb': round(peak_rss / 2**20, 1),
+        }
+
+class EndToEndBenchmark:
+    """
+    fetch -> store -> query -> export at increasing symbol counts
+
+    Candles come from a local BinanceStub and go to a scratch schema of the
+    configured Postgres database, so runs need no network access and leave
+    the real tables alone. Stages run one after the other, each through the
+    code the application uses (BinanceFetcher, DatabaseHandler.store_data,
+    CryptoDataViewer, CryptoDataExporter), and each reports its throughput,
+    p50/p99 latency per operation and peak RSS.
+
+    Usage:
+        results = EndToEndBenchmark(candles=500).run([10, 100])
+    """
+
+    def __init__(self, interval: str = '1d', candles: int = 1000, fetch_workers: int = 8,
+                 latency: float = 0.0, jitter: float = 0.0,
+                 weight_limit: Optional[int] = None, recording: Optional[str] = None,
+                 conn_params: Optional[Dict] = None):
+        """
+        Args:
+            interval: Candle interval fetched
+            candles: Candles of history per symbol
+            fetch_workers: Concurrent /klines requests
+            latency: Stub seconds per response
+            jitter: Stub random extra seconds per response
+            weight_limit: Stub request weight per minute, None for unlimited
+            recording: Serve this stub recording instead of synthetic candles
+            conn_params: Database connection, defaults to DB_CONFIG
+        """
+        self.interval = interval
+        self.candles = candles
+        self.fetch_workers = fetch_workers
+        self.stub_options = {'latency': latency, 'jitter': jitter,
+                             'weight_limit': weight_limit, 'recording': recording}
+        self.conn_params = {**(conn_params or DB_CONFIG),
+                            'options': f"-c search_path={BENCH_SCHEMA}"}
+
+    @contextmanager
+    def _scratch_database(self):
+        db = Database(self.conn_params)
+        try:
+            with db.cursor() as cur:
+                cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+                cur.execute(f"CREATE SCHEMA {BENCH_SCHEMA}")
+                cur.execute(OHLC_TABLE_QUERY)
+                cur.execute(WATERMARK_TABLE_QUERY)
+                cur.execute(SYMBOL_STATS_TABLE_QUERY)
+            yield db
+        finally:
+            with db.cursor() as cur:
+                cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+            db.close()
+
+    @staticmethod
+    def _stage(name: str, results: Dict, body: Callable[[StageRecorder], None]) -> None:
+        recorder = StageRecorder()
+        with RssSampler() as rss:
+            start = time.perf_counter()
+            body(recorder)
+            seconds = time.perf_counter() - start
+        results[name] = recorder.summary(seconds, rss.peak)
+        print(f"  {name:<7} {results[name]['items_per_second']:>12.1f} items/s  "
+              f"p50 {results[name]['p50_ms']} ms  p99 {results[name]['p99_ms']} ms  "
+              f"peak {results[name]['peak_rss_mb']} MB")
+
+    def run_scale(self, symbol_count: int) -> Dict:
+        """Run every stage for `symbol_count` symbols"""
+        step = interval_to_ms(self.interval)
+        now_ms = int(time.time() * 1000)
+        history_start = now_ms - self.candles * step
+        results = {}
+
+        with BinanceStub(symbol_count, history_start=history_start,
+                         **self.stub_options) as stub, self._scratch_database() as db:
+            # Each scale gets its own budget, matching what the stub enforces,
+            # so scales don't drain each other's and the fetch stage measures
+            # the stub rather than client-side waits for Binance's budget
+            weight_limit = self.stub_options['weight_limit'] or UNLIMITED_WEIGHT
+            fetcher = BinanceFetcher(stub.rest_url,
+                                     RequestWeightLimiter(weight_limit, stub.window))
+            handler = DatabaseHandler(db)
+            symbols = fetcher.get_exchange_info()[:symbol_count]
+            since = from_ms(history_start)
+            frames = {}
+
+            def fetch(recorder):
+                def fetch_symbol(symbol):
+                    pages = []
+                    page_iter = fetcher.iter_klines_since(symbol, since, self.interval)
+                    while True:
+                        page = recorder.time(lambda: next(page_iter, None),
+                                             lambda data: len(data or []))
+                        if not page:
+                            break
+                        pages.append(klines_to_frame(symbol, page, self.interval))
+                    if pages:
+                        frames[symbol] = pd.concat(pages, ignore_index=True)
+
+                with ThreadPoolExecutor(self.fetch_workers) as pool:
+                    list(pool.map(fetch_symbol, symbols))
+
+            def store(recorder):
+                for symbol in symbols:
+                    if symbol in frames:
+                        recorder.time(lambda: handler.store_data(frames[symbol]),
+                                      lambda changes: sum(change.rows for change in changes))
+
+            def query(recorder):
+                viewer = CryptoDataViewer(db, cache=False)
+                start, end = since, datetime.now(pytz.UTC)
+                for symbol in symbols:
+                    recorder.time(lambda: viewer.view_recent_data(symbol, 100, self.interval))
+                    recorder.time(lambda: viewer.get_date_range(symbol, self.interval),
+                                  lambda row: 1)
+                    recorder.time(lambda: viewer.get_data_by_daterange(symbol, start, end,
+                                                                       self.interval))
+
+            def export(recorder):
+                with tempfile.TemporaryDirectory() as export_dir:
+                    exporter = CryptoDataExporter(db, export_dir=export_dir)
+                    for symbol in symbols:
+                        rows = len(frames.get(symbol, []))
+                        recorder.time(lambda: exporter.export_single_symbol(
+                            symbol, interval=self.interval), lambda filename: rows)
+
+            print(f"{symbol_count} symbols, {self.candles} {self.interval} candles each")
+            for name, body in zip(STAGES, (fetch, store, query, export)):
+                self._stage(name, results, body)
+            frames.clear()
+            results['stub'] = {'requests': stub.requests, 'throttled': stub.throttled}
+        return results
+
+    def run(self, scales: Iterable[int] = DEFAULT_SCALES) -> Dict:
+        """
+        Returns:
+            The configuration and, per symbol count, the stage results
+        """
+        return {
+            'started_at': datetime.now(pytz.UTC).isoformat(),
+            'commit': git_commit(),
+            'config': {
+                'interval': self.interval,
+                'candles': self.candles,
+                'fetch_workers': self.fetch_workers,
+                **self.stub_options,
+            },
+            'scales': {str(count): self.run_scale(count) for count in scales},
+        }
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(baseline: Dict, current: Dict, tolerance: float = 0.1) -> List[str]:
+    """
+    Regressions of `current` against `baseline` beyond `tolerance`
+
+    Throughput is compared for a drop, p99 latency and peak RSS for a rise,
+    per scale and stage present in both runs.
+    """
+    regressions = []
+    for scale, stages in current['scales'].items():
+        for stage in STAGES:
+            before = baseline['scales'].get(scale, {}).get(stage)
+            after = stages.get(stage)
+            if not before or not after:
+                continue
+            checks = [('items_per_second', -1), ('p99_ms', 1), ('peak_rss_mb', 1)]
+            for metric, direction in checks:
+                old, new = before.get(metric), after.get(metric)
+                if not old or new is None:
+                    continue
+                change = (new - old) / old
+                if change * direction > tolerance:
+                    regressions.append(f"{scale} symbols {stage} {metric}: "
+                                       f"{old} -> {new} ({change:+.0%})")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end fetch/store/query/export benchmark")
+    parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES,
+                        help="Symbol counts to run")
+    parser.add_argument('--interval', default='1d')
+    parser.add_argument('--candles', type=int, default=1000, help="Candles per symbol")
+    parser.add_argument('--fetch-workers', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.0, help="Stub seconds per response")
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--weight-limit', type=int, help="Stub request weight per minute")
+    parser.add_argument('--recording', help="Stub recording to serve, see binance_stub record")
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help="Earlier results to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args()
+
+    benchmark = EndToEndBenchmark(args.interval, args.candles, args.fetch_workers, args.latency,
+                                  args.jitter, args.weight_limit, args.recording)
+    results = benchmark.run(args.scales)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(json.load(f), results, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            raise SystemExit(1)
+        print("No regressions")
+
+if __name__ == "__main__":
+    with instrumented():
+        main()
@@ -0,0 +1,38 @@
+import os
+
+# Database connection settings, overridable through the environment
+DB_CONFIG = {
+    'dbname': os.getenv('DB_NAME', 'crypto_market_data'),
+    'user': os.getenv('DB_USER', 'username'),
+    'password': os.getenv('DB_PASSWORD', 'password'),
+    'host': os.getenv('DB_HOST', 'localhost'),
+    'port': os.getenv('DB_PORT', '5432')
+}
+
+# Storage backend: 'postgres' (the default, configured by DB_CONFIG), or an
+# embedded engine, 'duckdb' or 'sqlite', storing everything in DB_PATH
+DB_BACKEND = os.getenv('DB_BACKEND', 'postgres')
+DB_PATH = os.getenv('DB_PATH', 'crypto_market_data.db')
+
+# Connection pool shared by the fetcher, viewer and exporter
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '10'))
+
+# Viewer query cache: entries kept in memory, and an optional directory for
+# the on-disk tier
+QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', '256'))
+QUERY_CACHE_DIR = os.getenv('QUERY_CACHE_DIR') or None
+
+# Intervals fetched directly from Binance. Rollups never write these, so
+# REST candles are not overwritten by ones derived from another interval
+FETCHED_INTERVALS = os.getenv('FETCHED_INTERVALS', '1m,1d').split(',')
+
+# Memory-mapped cross-symbol panels kept by src.data.panel.PanelStore
+PANEL_DIR = os.getenv('PANEL_DIR', 'panels')
+
+# Observability, off unless set: METRICS_PORT serves Prometheus metrics on
+# http://127.0.0.1:<port>/metrics, PROFILE ('cprofile' or 'sample') profiles
+# the run into PROFILE_OUTPUT
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0')) or None
+PROFILE = os.getenv('PROFILE') or None
+PROFILE_OUTPUT = os.getenv('PROFILE_OUTPUT') or None
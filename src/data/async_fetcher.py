@@ -0,0 +1,254 @@
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from src.data.fetch_crypto_data import (BINANCE_API_URL, DEFAULT_WEIGHT_LIMIT,
+                                        EXCHANGE_INFO_WEIGHT, DatabaseHandler,
+                                        klines_request_weight, klines_to_frame,
+                                        klines_to_records, used_weight_from_headers)
+from src.utils.metrics import (BINANCE_REQUEST_SECONDS, BINANCE_REQUESTS, BINANCE_RETRIES,
+                               BINANCE_USED_WEIGHT)
+from src.utils.profiling import instrumented
+
+try:
+    import aiohttp
+except ImportError:  # optional dependency, only needed for the async mode
+    aiohttp = None
+
+class WeightRateLimiter:
+    """
+    Token bucket shared by every request made against the Binance weight budget
+
+    Tokens refill continuously at capacity / window per second. Each response
+    re-synchronises the bucket with the weight the exchange says we used, and a
+    429/418 response blocks all callers until its Retry-After has passed.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_WEIGHT_LIMIT, window: float = 60.0,
+                 safety_margin: float = 0.05):
+        """
+        Args:
+            capacity: Weight allowed per window by the exchange
+            window: Window length in seconds
+            safety_margin: Fraction of the capacity kept in reserve
+        """
+        self.capacity = capacity * (1 - safety_margin)
+        self.rate = self.capacity / window
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self.updated
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated = now
+
+    async def acquire(self, weight: int = 1) -> None:
+        """Wait until `weight` tokens are available and take them"""
+        while True:
+            async with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    if self.tokens >= weight:
+                        self.tokens -= weight
+                        return
+                    wait = (weight - self.tokens) / self.rate
+            await asyncio.sleep(wait)
+
+    def update_from_headers(self, headers) -> None:
+        """Align the bucket with the used weight reported by the exchange"""
+        used = used_weight_from_headers(headers)
+        if used is None:
+            return
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, self.capacity - used)
+
+    def backoff(self, retry_after: float) -> None:
+        """Stop all requests for `retry_after` seconds"""
+        now = time.monotonic()
+        self.blocked_until = max(self.blocked_until, now + retry_after)
+        self.tokens = 0
+        self.updated = now
+
+class AsyncBinanceFetcher:
+    """
+    Concurrent counterpart of BinanceFetcher built on aiohttp
+
+    Usage:
+        async with AsyncBinanceFetcher(max_concurrency=20) as fetcher:
+            results = await fetcher.fetch_many(symbols)
+    """
+
+    def __init__(self, base_url: str = BINANCE_API_URL, max_concurrency: int = 10,
+                 limiter: Optional[WeightRateLimiter] = None, max_retries: int = 5):
+        if aiohttp is None:
+            raise ImportError("aiohttp is required for async fetching: pip install aiohttp")
+        self.base_url = base_url
+        self.limiter = limiter or WeightRateLimiter()
+        self.max_retries = max_retries
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.session = None
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.session.close()
+        self.session = None
+
+    async def _get(self, path: str, params: Optional[Dict] = None, weight: int = 1):
+        """
+        GET a Binance endpoint, honouring the shared weight budget
+
+        Latency, status, retries and the weight used are recorded like
+        BinanceFetcher._request does.
+        """
+        url = f"{self.base_url}/{path}"
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire(weight)
+            async with self.semaphore:
+                start = time.perf_counter()
+                try:
+                    async with self.session.get(url, params=params) as response:
+                        BINANCE_REQUESTS.inc(endpoint=path, status=response.status)
+                        used_weight = used_weight_from_headers(response.headers)
+                        if used_weight is not None:
+                            BINANCE_USED_WEIGHT.set(used_weight)
+                        self.limiter.update_from_headers(response.headers)
+                        if response.status in (418, 429):
+                            default_wait = 60 if response.status == 418 else 1
+                            retry_after = float(response.headers.get('Retry-After', default_wait))
+                            print(f"Rate limited ({response.status}) on {path}, "
+                                  f"backing off {retry_after:.0f}s")
+                            self.limiter.backoff(retry_after)
+                            if attempt < self.max_retries:
+                                BINANCE_RETRIES.inc(status=response.status)
+                            continue
+                        response.raise_for_status()
+                        return await response.json()
+                except aiohttp.ClientResponseError:
+                    raise
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    BINANCE_REQUESTS.inc(endpoint=path, status='error')
+                    raise
+                finally:
+                    BINANCE_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=path)
+        raise aiohttp.ClientError(f"Giving up on {path} after {self.max_retries} retries")
+
+    async def fetch_klines_data(self, symbol: str, interval: str = '1d',
+                                limit: int = 1000) -> List[Dict]:
+        """
+        Fetch OHLCV data from Binance
+
+        Args:
+            symbol: Trading pair (e.g., 'BTCUSDT', 'ETHUSDT')
+            interval: Timeframe ('1d' for daily, '1h' for hourly, etc.)
+            limit: Number of candles to fetch (max 1000)
+        """
+        params = {
+            'symbol': symbol,
+            'interval': interval,
+            'limit': str(limit)
+        }
+
+        try:
+            data = await self._get('klines', params, klines_request_weight(limit))
+            ohlc_data = klines_to_records(symbol, data, interval)
+            print(f"Fetched {len(ohlc_data)} records for {symbol}")
+            return ohlc_data
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Error fetching data for {symbol}: {e}")
+            return []
+
+    async def fetch_klines_frame(self, symbol: str, interval: str = '1d',
+                                 limit: int = 1000) -> pd.DataFrame:
+        """
+        Columnar variant of fetch_klines_data, see klines_to_frame
+        """
+        params = {
+            'symbol': symbol,
+            'interval': interval,
+            'limit': str(limit)
+        }
+
+        try:
+            data = await self._get('klines', params, klines_request_weight(limit))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Error fetching data for {symbol}: {e}")
+            data = []
+
+        df = klines_to_frame(symbol, data, interval)
+        print(f"Fetched {len(df)} records for {symbol}")
+        return df
+
+    async def get_exchange_info(self) -> List[str]:
+        """
+        Get list of all available USDT trading pairs
+        """
+        try:
+            data = await self._get('exchangeInfo', weight=EXCHANGE_INFO_WEIGHT)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Error fetching exchange info: {e}")
+            return []
+
+        return [symbol['symbol'] for symbol in data['symbols']
+                if symbol['symbol'].endswith('USDT')
+                and symbol['status'] == 'TRADING']
+
+    async def fetch_many(self, symbols: List[str], interval: str = '1d',
+                         limit: int = 1000) -> Dict[str, List[Dict]]:
+        """
+        Fetch klines for many symbols concurrently
+
+        Returns:
+            Mapping of symbol to its records
+        """
+        results = await asyncio.gather(
+            *(self.fetch_klines_data(symbol, interval, limit) for symbol in symbols)
+        )
+        return dict(zip(symbols, results))
+
+async def fetch_and_store(symbols: Optional[List[str]] = None, interval: str = '1d',
+                          limit: int = 1000, max_concurrency: int = 10) -> None:
+    """
+    Fetch all symbols concurrently and store each one as soon as it arrives
+
+    Args:
+        symbols: Trading pairs to fetch, defaults to every USDT pair
+        interval: Timeframe to fetch
+        limit: Number of candles per symbol
+        max_concurrency: Maximum number of requests in flight
+    """
+    db_handler = DatabaseHandler()
+    loop = asyncio.get_running_loop()
+
+    async with AsyncBinanceFetcher(max_concurrency=max_concurrency) as fetcher:
+        if symbols is None:
+            symbols = await fetcher.get_exchange_info()
+
+        start = time.monotonic()
+        tasks = [fetcher.fetch_klines_frame(symbol, interval, limit) for symbol in symbols]
+        for task in asyncio.as_completed(tasks):
+            data = await task
+            if data.empty:
+                continue
+            try:
+                # Keep the event loop free for fetching while the DB write runs
+                await loop.run_in_executor(None, db_handler.store_data, data)
+            except Exception as e:
+                print(f"Error processing {data['symbol'].iloc[0]}: {e}")
+
+        print(f"\nProcessed {len(symbols)} symbols in {time.monotonic() - start:.1f}s")
+
+def main():
+    asyncio.run(fetch_and_store())
+
+if __name__ == "__main__":
+    with instrumented():
+        main()
@@ -0,0 +1,229 @@
+import argparse
+import time
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+import pytz
+import requests
+
+from src.data.fetch_crypto_data import BinanceFetcher, DatabaseHandler, klines_to_frame
+from src.data.intervals import ceil_open_time, floor_open_time, from_ms, interval_to_ms, to_ms
+from src.utils.profiling import instrumented
+
+MAX_KLINES_PER_REQUEST = 1000
+
+CHECKPOINT_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+    symbol VARCHAR(20) NOT NULL,
+    interval VARCHAR(4) NOT NULL,
+    start_ms BIGINT NOT NULL,      -- First candle open time requested
+    end_ms BIGINT NOT NULL,        -- Last candle open time requested
+    next_start_ms BIGINT NOT NULL, -- Where a resumed run picks up
+    completed BOOLEAN NOT NULL DEFAULT FALSE,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (symbol, interval)
+);
+"""
+
+class BackfillPlanner:
+    """
+    Splits a historical range into the /klines requests needed to cover it
+
+    Candle open times are aligned to the interval grid, so the number of
+    candles in a range, and therefore the number of requests, is known
+    before anything is fetched.
+    """
+
+    def __init__(self, limit: int = MAX_KLINES_PER_REQUEST):
+        self.limit = limit
+
+    def count_candles(self, interval: str, start_ms: int, end_ms: int) -> int:
+        """Number of candle open times in [start_ms, end_ms]"""
+        first = ceil_open_time(start_ms, interval)
+        last = floor_open_time(end_ms, interval)
+        if last < first:
+            return 0
+        return (last - first) // interval_to_ms(interval) + 1
+
+    def count_requests(self, interval: str, start_ms: int, end_ms: int) -> int:
+        """Number of requests needed to fetch [start_ms, end_ms]"""
+        return -(-self.count_candles(interval, start_ms, end_ms) // self.limit)
+
+    def plan(self, interval: str, start_ms: int, end_ms: int) -> List[Tuple[int, int]]:
+        """
+        Request windows covering [start_ms, end_ms]
+
+        Returns:
+            List of (startTime, endTime) pairs in epoch ms, each holding at
+            most `limit` candles
+        """
+        step = interval_to_ms(interval)
+        span = step * self.limit
+        first = ceil_open_time(start_ms, interval)
+        last = floor_open_time(end_ms, interval)
+
+        windows = []
+        window_start = first
+        while window_start <= last:
+            window_end = min(window_start + span - step, last)
+            windows.append((window_start, window_end))
+            window_start = window_end + step
+        return windows
+
+class BackfillEngine:
+    """
+    Walks historical windows per symbol and interval, recording progress in
+    the backfill_checkpoints table so an interrupted run resumes where it
+    stopped
+    """
+
+    def __init__(self, fetcher: Optional[BinanceFetcher] = None,
+                 db_handler: Optional[DatabaseHandler] = None,
+                 limit: int = MAX_KLINES_PER_REQUEST, max_attempts: int = 3):
+        self.fetcher = fetcher or BinanceFetcher()
+        self.db_handler = db_handler or DatabaseHandler()
+        self.planner = BackfillPlanner(limit)
+        self.limit = limit
+        self.max_attempts = max_attempts
+        self.ensure_checkpoint_table()
+
+    def ensure_checkpoint_table(self) -> None:
+        with self.db_handler.db.cursor() as cur:
+            cur.execute(CHECKPOINT_TABLE_QUERY)
+
+    def load_checkpoint(self, symbol: str, interval: str) -> Optional[Tuple]:
+        """Return (start_ms, end_ms, next_start_ms, completed) or None"""
+        query = """
+        SELECT start_ms, end_ms, next_start_ms, completed
+        FROM backfill_checkpoints
+        WHERE symbol = %s AND interval = %s;
+        """
+        with self.db_handler.db.cursor() as cur:
+            cur.execute(query, (symbol, interval))
+            return cur.fetchone()
+
+    def save_checkpoint(self, symbol: str, interval: str, start_ms: int,
+                        end_ms: int, next_start_ms: int) -> None:
+        query = """
+        INSERT INTO backfill_checkpoints
+            (symbol, interval, start_ms, end_ms, next_start_ms, completed, updated_at)
+        VALUES (%s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+        ON CONFLICT (symbol, interval)
+        DO UPDATE SET
+            start_ms = EXCLUDED.start_ms,
+            end_ms = EXCLUDED.end_ms,
+            next_start_ms = EXCLUDED.next_start_ms,
+            completed = EXCLUDED.completed,
+            updated_at = EXCLUDED.updated_at;
+        """
+        # The current candle is still open, whatever was stored of it is
+        # partial: never checkpoint past it, so the next run fetches it again
+        open_candle_ms = floor_open_time(int(time.time() * 1000), interval)
+        next_start_ms = min(next_start_ms, open_candle_ms)
+        completed = next_start_ms > end_ms
+        with self.db_handler.db.cursor() as cur:
+            cur.execute(query, (symbol, interval, start_ms, end_ms,
+                                next_start_ms, completed))
+
+    def resume_point(self, symbol: str, interval: str, start_ms: int) -> int:
+        """
+        Where to continue for a range starting at `start_ms`
+
+        A checkpoint for the same start is resumed, even if the end has moved
+        forward since. A different start restarts the range.
+        """
+        checkpoint = self.load_checkpoint(symbol, interval)
+        if checkpoint is None:
+            return start_ms
+        saved_start, _, next_start_ms, _ = checkpoint
+        if saved_start != start_ms:
+            return start_ms
+        return next_start_ms
+
+    def _fetch_window(self, symbol: str, interval: str, window_start: int,
+                      window_end: int) -> List[List]:
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return self.fetcher.get_klines(symbol, interval, self.limit,
+                                               start_time=window_start,
+                                               end_time=window_end)
+            except requests.exceptions.RequestException as e:
+                if attempt == self.max_attempts:
+                    raise
+                print(f"Error fetching {symbol} {interval} window, retrying: {e}")
+                time.sleep(2 ** attempt)
+
+    def backfill_symbol(self, symbol: str, interval: str, start_ms: int,
+                        end_ms: int) -> int:
+        """
+        Backfill one symbol and interval, returning the number of candles stored
+        """
+        resume_ms = self.resume_point(symbol, interval, start_ms)
+        windows = self.planner.plan(interval, resume_ms, end_ms)
+        if not windows:
+            print(f"{symbol} {interval}: already backfilled")
+            self.save_checkpoint(symbol, interval, start_ms, end_ms, end_ms + 1)
+            return 0
+
+        if resume_ms != start_ms:
+            print(f"{symbol} {interval}: resuming from {from_ms(resume_ms)}")
+        print(f"{symbol} {interval}: {len(windows)} requests to go")
+
+        step = interval_to_ms(interval)
+        stored = 0
+        for window_start, window_end in windows:
+            data = self._fetch_window(symbol, interval, window_start, window_end)
+            frame = klines_to_frame(symbol, data, interval)
+            if len(frame):
+                self.db_handler.store_data(frame)
+                stored += len(frame)
+            # Only advance once the window is safely stored
+            self.save_checkpoint(symbol, interval, start_ms, end_ms, window_end + step)
+
+        print(f"{symbol} {interval}: backfilled {stored} candles")
+        return stored
+
+    def run(self, symbols: List[str], interval: str, start, end=None) -> None:
+        """
+        Backfill every symbol over [start, end]
+
+        Args:
+            symbols: Trading pairs to backfill
+            interval: Timeframe to backfill
+            start: Range start as datetime, 'YYYY-MM-DD' or epoch ms
+            end: Range end, defaults to now
+        """
+        start_ms = ceil_open_time(to_ms(start), interval)
+        end_ms = to_ms(end if end is not None else datetime.now(pytz.UTC))
+
+        for symbol in symbols:
+            try:
+                self.backfill_symbol(symbol, interval, start_ms, end_ms)
+            except Exception as e:
+                print(f"Error backfilling {symbol}: {e}")
+                continue
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill historical klines from Binance")
+    parser.add_argument('--symbols', nargs='+', required=True)
+    parser.add_argument('--interval', default='1d')
+    parser.add_argument('--start', required=True, help="YYYY-MM-DD")
+    parser.add_argument('--end', help="YYYY-MM-DD, defaults to now")
+    parser.add_argument('--plan-only', action='store_true',
+                        help="Print the number of requests without fetching")
+    args = parser.parse_args()
+
+    if args.plan_only:
+        planner = BackfillPlanner()
+        start_ms = to_ms(args.start)
+        end_ms = to_ms(args.end) if args.end else to_ms(datetime.now(pytz.UTC))
+        per_symbol = planner.count_requests(args.interval, start_ms, end_ms)
+        print(f"{per_symbol} requests per symbol, "
+              f"{per_symbol * len(args.symbols)} in total")
+        return
+
+    BackfillEngine().run(args.symbols, args.interval, args.start, args.end)
+
+if __name__ == "__main__":
+    with instrumented():
+        main()
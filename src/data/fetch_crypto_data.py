@@ -1,52 +1,276 @@
+import io
 import requests
 import pandas as pd
 from datetime import datetime, timedelta
-import psycopg2
+import threading
 import time
-from typing import List, Dict
+from typing import Iterator, List, Dict, NamedTuple, Optional, Union
 import pytz
 
+from src.data.intervals import floor_open_time, interval_to_ms
+from src.database.connection import StorageBackend, get_database
+from src.database.fixed_point import MERGE_STAGING_FIXED_QUERY, is_fixed_layout, register_symbols
+from src.database.partitions import ensure_partitions, is_partitioned
+from src.database.symbol_stats import APPLY_STATS_CHANGES_CTE, ensure_symbol_stats_table
+from src.database.watermarks import bump_watermarks, ensure_watermark_table, log_changes
+from src.utils.metrics import (BINANCE_REQUEST_SECONDS, BINANCE_REQUESTS, BINANCE_RETRIES,
+                               BINANCE_USED_WEIGHT, STORE_BATCHES, record_store)
+from src.utils.profiling import instrumented
+
+BINANCE_API_URL = "https://api.binance.com/api/v3"
+
+# Binance REQUEST_WEIGHT limit per IP and minute
+DEFAULT_WEIGHT_LIMIT = 6000
+EXCHANGE_INFO_WEIGHT = 20
+
+def klines_request_weight(limit: int) -> int:
+    """
+    Request weight Binance charges for a /klines call
+    
+    Args:
+        limit: Number of candles requested
+    """
+    if limit < 100:
+        return 1
+    if limit < 500:
+        return 2
+    if limit <= 1000:
+        return 5
+    return 10
+
+def used_weight_from_headers(headers) -> Optional[int]:
+    """
+    Read the weight already used in the current window from response headers
+
+    Binance reports it as X-MBX-USED-WEIGHT and, per window, as
+    X-MBX-USED-WEIGHT-1M. The per-minute value is preferred when present.
+    """
+    for name in ('X-MBX-USED-WEIGHT-1M', 'X-MBX-USED-WEIGHT'):
+        value = headers.get(name)
+        if value is not None:
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+def klines_to_records(symbol: str, data: List[List], interval: str = '1d') -> List[Dict]:
+    """
+    Convert raw Binance kline arrays to our record format
+    
+    Args:
+        symbol: Trading pair the klines belong to
+        data: JSON payload returned by the /klines endpoint
+        interval: Interval the klines were requested with
+    """
+    ohlc_data = []
+    for entry in data:
+        timestamp = datetime.fromtimestamp(entry[0]/1000, tz=pytz.UTC)
+        
+        ohlc_data.append({
+            'symbol': symbol,
+            'interval': interval,
+            'timestamp': timestamp,
+            'open': float(entry[1]),
+            'high': float(entry[2]),
+            'low': float(entry[3]),
+            'close': float(entry[4]),
+            'volume': float(entry[5])
+        })
+    return ohlc_data
+
+OHLC_COLUMNS = ['symbol', 'interval', 'timestamp', 'open', 'high', 'low', 'close', 'volume']
+
+def klines_to_frame(symbol: str, data: List[List], interval: str = '1d') -> pd.DataFrame:
+    """
+    Decode raw Binance kline arrays into a typed, columnar DataFrame
+    
+    Open times are converted from epoch ms in one vectorized step and the
+    price/volume strings are parsed column-wise, instead of building a dict
+    per candle.
+    
+    Args:
+        symbol: Trading pair the klines belong to
+        data: JSON payload returned by the /klines endpoint
+        interval: Interval the klines were requested with
+    """
+    if not data:
+        return pd.DataFrame(columns=OHLC_COLUMNS)
+    
+    raw = pd.DataFrame(data).iloc[:, :6]
+    raw.columns = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+    
+    df = raw[['open', 'high', 'low', 'close', 'volume']].astype('float64')
+    df.insert(0, 'timestamp', pd.to_datetime(raw['timestamp'].astype('int64'), unit='ms', utc=True))
+    df.insert(0, 'interval', interval)
+    df.insert(0, 'symbol', symbol)
+    return df
+
+class RequestWeightLimiter:
+    """
+    Thread-safe token bucket over the Binance request weight budget
+    
+    Threaded counterpart of async_fetcher.WeightRateLimiter: tokens refill
+    continuously at capacity / window per second, every response
+    re-synchronises the bucket with the weight the exchange reports as used,
+    and a 429/418 response blocks every thread until its Retry-After has
+    passed, not just the one that received it.
+    """
+    
+    def __init__(self, capacity: int = DEFAULT_WEIGHT_LIMIT, window: float = 60.0,
+                 safety_margin: float = 0.05):
+        """
+        Args:
+            capacity: Weight allowed per window by the exchange
+            window: Window length in seconds
+            safety_margin: Fraction of the capacity kept in reserve
+        """
+        self.capacity = capacity * (1 - safety_margin)
+        self.rate = self.capacity / window
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+    
+    def _refill(self, now: float) -> None:
+        elapsed = now - self.updated
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated = now
+    
+    def acquire(self, weight: int = 1) -> None:
+        """Block until `weight` tokens are available and take them"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    if self.tokens >= weight:
+                        self.tokens -= weight
+                        return
+                    wait = (weight - self.tokens) / self.rate
+            time.sleep(wait)
+    
+    def update_from_headers(self, headers) -> None:
+        """Align the bucket with the used weight reported by the exchange"""
+        used = used_weight_from_headers(headers)
+        if used is None:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, self.capacity - used)
+    
+    def backoff(self, retry_after: float) -> None:
+        """Stop all requests for `retry_after` seconds"""
+        with self._lock:
+            now = time.monotonic()
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+            self.tokens = 0
+            self.updated = now
+
+_shared_limiter = None
+_shared_limiter_lock = threading.Lock()
+
+def shared_weight_limiter() -> RequestWeightLimiter:
+    """The limiter of this process, Binance's budget is per IP"""
+    global _shared_limiter
+    with _shared_limiter_lock:
+        if _shared_limiter is None:
+            _shared_limiter = RequestWeightLimiter()
+        return _shared_limiter
+
 class BinanceFetcher:
-    def __init__(self):
-        self.base_url = "https://api.binance.com/api/v3"
+    def __init__(self, base_url: str = BINANCE_API_URL,
+                 limiter: Optional[RequestWeightLimiter] = None):
+        """
+        Args:
+            base_url: REST API root
+            limiter: Weight budget shared by every thread using this fetcher,
+                defaults to the one shared by the whole process
+        """
+        self.base_url = base_url
+        self.limiter = limiter or shared_weight_limiter()
     
-    def fetch_klines_data(self, symbol: str, interval: str = '1d', 
-                         limit: int = 1000) -> List[Dict]:
+    def _request(self, endpoint: str, params: Optional[Dict] = None,
+                 weight: int = 1) -> requests.Response:
         """
-        Fetch OHLCV data from Binance
+        GET an endpoint within the weight budget, recording its latency,
+        status and the weight used
+        
+        A 429/418 response pauses every request sharing the limiter until
+        its Retry-After has passed.
+        """
+        self.limiter.acquire(weight)
+        start = time.perf_counter()
+        try:
+            response = requests.get(f"{self.base_url}/{endpoint}", params=params)
+        except requests.exceptions.RequestException:
+            BINANCE_REQUESTS.inc(endpoint=endpoint, status='error')
+            raise
+        finally:
+            BINANCE_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+        BINANCE_REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+        used_weight = used_weight_from_headers(response.headers)
+        if used_weight is not None:
+            BINANCE_USED_WEIGHT.set(used_weight)
+        self.limiter.update_from_headers(response.headers)
+        if response.status_code in (418, 429):
+            self.limiter.backoff(float(response.headers.get('Retry-After', 60)))
+        return response
+    
+    def get_klines(self, symbol: str, interval: str = '1d', limit: int = 1000,
+                   start_time: Optional[int] = None, end_time: Optional[int] = None,
+                   max_retries: int = 3) -> List[List]:
+        """
+        Request raw klines from Binance, raising on failure
         
         Args:
             symbol: Trading pair (e.g., 'BTCUSDT', 'ETHUSDT')
             interval: Timeframe ('1d' for daily, '1h' for hourly, etc.)
             limit: Number of candles to fetch (max 1000)
+            start_time: Earliest candle open time in epoch ms
+            end_time: Latest candle open time in epoch ms
+            max_retries: Retries after a 429/418 rate limit response
         """
-        endpoint = f"{self.base_url}/klines"
-        
         params = {
             'symbol': symbol,
             'interval': interval,
             'limit': limit
         }
+        if start_time is not None:
+            params['startTime'] = start_time
+        if end_time is not None:
+            params['endTime'] = end_time
         
-        try:
-            response = requests.get(endpoint, params=params)
+        for attempt in range(max_retries + 1):
+            response = self._request('klines', params, klines_request_weight(limit))
+            if response.status_code in (418, 429) and attempt < max_retries:
+                # The limiter now holds back every thread until Retry-After
+                BINANCE_RETRIES.inc(status=response.status_code)
+                retry_after = float(response.headers.get('Retry-After', 60))
+                print(f"Rate limited ({response.status_code}), waiting {retry_after:.0f}s")
+                continue
             response.raise_for_status()
-            data = response.json()
+            return response.json()
+    
+    def fetch_klines_data(self, symbol: str, interval: str = '1d', 
+                         limit: int = 1000, start_time: Optional[int] = None,
+                         end_time: Optional[int] = None) -> List[Dict]:
+        """
+        Fetch OHLCV data from Binance
+        
+        Args:
+            symbol: Trading pair (e.g., 'BTCUSDT', 'ETHUSDT')
+            interval: Timeframe ('1d' for daily, '1h' for hourly, etc.)
+            limit: Number of candles to fetch (max 1000)
+            start_time: Earliest candle open time in epoch ms
+            end_time: Latest candle open time in epoch ms
+        """
+        try:
+            data = self.get_klines(symbol, interval, limit, start_time, end_time)
             
             # Convert Binance data to our format
-            ohlc_data = []
-            for entry in data:
-                timestamp = datetime.fromtimestamp(entry[0]/1000, tz=pytz.UTC)
-                
-                ohlc_data.append({
-                    'symbol': symbol,
-                    'timestamp': timestamp,
-                    'open': float(entry[1]),
-                    'high': float(entry[2]),
-                    'low': float(entry[3]),
-                    'close': float(entry[4]),
-                    'volume': float(entry[5])
-                })
+            ohlc_data = klines_to_records(symbol, data, interval)
             
             print(f"Fetched {len(ohlc_data)} records for {symbol}")
             return ohlc_data
@@ -55,14 +279,86 @@ class BinanceFetcher:
             print(f"Error fetching data for {symbol}: {e}")
             return []
     
+    def fetch_klines_frame(self, symbol: str, interval: str = '1d',
+                           limit: int = 1000, start_time: Optional[int] = None,
+                           end_time: Optional[int] = None) -> pd.DataFrame:
+        """
+        Columnar variant of fetch_klines_data, see klines_to_frame
+        """
+        try:
+            data = self.get_klines(symbol, interval, limit, start_time, end_time)
+        except requests.exceptions.RequestException as e:
+            print(f"Error fetching data for {symbol}: {e}")
+            data = []
+        
+        df = klines_to_frame(symbol, data, interval)
+        print(f"Fetched {len(df)} records for {symbol}")
+        return df
+    
+    def iter_klines_since(self, symbol: str, since: Optional[datetime],
+                          interval: str = '1d', limit: int = 1000) -> Iterator[List[List]]:
+        """
+        Raw /klines pages from the candle opening at `since` up to now
+        
+        Without `since`, a single page with the latest `limit` candles is
+        returned. Request errors are raised to the caller.
+        
+        Args:
+            symbol: Trading pair (e.g., 'BTCUSDT', 'ETHUSDT')
+            since: Open time of the latest stored candle, or None
+            interval: Timeframe ('1d' for daily, '1h' for hourly, etc.)
+            limit: Most candles per request
+        """
+        if since is None:
+            yield self.get_klines(symbol, interval, limit)
+            return
+        
+        step = interval_to_ms(interval)
+        start_ms = int(since.timestamp() * 1000)
+        now_ms = int(time.time() * 1000)
+        while start_ms <= now_ms:
+            # Ask for exactly the candles that can exist, the weight of a
+            # request grows with its limit
+            expected = (floor_open_time(now_ms, interval) - start_ms) // step + 1
+            page_limit = max(1, min(expected, limit))
+            data = self.get_klines(symbol, interval, page_limit, start_time=start_ms)
+            yield data
+            if len(data) < page_limit:
+                break
+            start_ms = data[-1][0] + step
+    
+    def fetch_klines_since(self, symbol: str, since: datetime,
+                           interval: str = '1d') -> pd.DataFrame:
+        """
+        Fetch the candle opening at `since` and every candle after it
+        
+        The candle at `since` is the latest one already stored and may have
+        been incomplete when it was written, so it is fetched again.
+        
+        Args:
+            symbol: Trading pair (e.g., 'BTCUSDT', 'ETHUSDT')
+            since: Open time of the latest stored candle
+            interval: Timeframe ('1d' for daily, '1h' for hourly, etc.)
+        """
+        frames = []
+        try:
+            for data in self.iter_klines_since(symbol, since, interval):
+                frames.append(klines_to_frame(symbol, data, interval))
+        except requests.exceptions.RequestException as e:
+            print(f"Error fetching data for {symbol}: {e}")
+        
+        if not frames:
+            return klines_to_frame(symbol, [], interval)
+        ohlc_data = pd.concat(frames, ignore_index=True)
+        print(f"Fetched {len(ohlc_data)} new records for {symbol}")
+        return ohlc_data
+    
     def get_exchange_info(self) -> List[str]:
         """
         Get list of all available trading pairs
         """
-        endpoint = f"{self.base_url}/exchangeInfo"
-        
         try:
-            response = requests.get(endpoint)
+            response = self._request('exchangeInfo', weight=EXCHANGE_INFO_WEIGHT)
             response.raise_for_status()
             data = response.json()
             
@@ -77,54 +373,240 @@ class BinanceFetcher:
             print(f"Error fetching exchange info: {e}")
             return []
 
+STAGING_TABLE_QUERY = """
+CREATE TEMP TABLE IF NOT EXISTS ohlc_staging (
+    symbol VARCHAR(20) NOT NULL,
+    interval VARCHAR(4) NOT NULL,
+    timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+    open DECIMAL(18,8) NOT NULL,
+    high DECIMAL(18,8) NOT NULL,
+    low DECIMAL(18,8) NOT NULL,
+    close DECIMAL(18,8) NOT NULL,
+    volume DECIMAL(24,8)
+) ON COMMIT DELETE ROWS;
+"""
+
+COPY_STAGING_QUERY = """
+COPY ohlc_staging (symbol, interval, timestamp, open, high, low, close, volume)
+FROM STDIN WITH (FORMAT csv)
+"""
+
+# DISTINCT ON keeps a batch with repeated candles from hitting the same row
+# twice, and the WHERE clause skips updates that would not change anything.
+# In the same statement, symbol_stats is adjusted by the rows actually
+# written: `previous` still sees the volumes being replaced, and xmax = 0
+# tells inserted rows from updated ones (exact because merge_staged holds
+# the symbols' merge locks, see MERGE_LOCK_QUERY). The written ranges are
+# returned per symbol and interval.
+MERGE_STAGING_QUERY = """
+WITH previous AS (
+    SELECT o.symbol, o.interval, o.timestamp, o.volume
+    FROM ohlc_data o
+    JOIN (SELECT DISTINCT symbol, interval, timestamp FROM ohlc_staging) s
+    USING (symbol, interval, timestamp)
+),
+merged AS (
+    INSERT INTO ohlc_data AS t (symbol, interval, timestamp, open, high, low, close, volume)
+    SELECT DISTINCT ON (symbol, interval, timestamp)
+        symbol, interval, timestamp, open, high, low, close, volume
+    FROM ohlc_staging
+    ORDER BY symbol, interval, timestamp
+    ON CONFLICT (symbol, interval, timestamp) 
+    DO UPDATE SET
+        open = EXCLUDED.open,
+        high = EXCLUDED.high,
+        low = EXCLUDED.low,
+        close = EXCLUDED.close,
+        volume = EXCLUDED.volume
+    WHERE (t.open, t.high, t.low, t.close, t.volume)
+        IS DISTINCT FROM
+        (EXCLUDED.open, EXCLUDED.high, EXCLUDED.low, EXCLUDED.close, EXCLUDED.volume)
+    RETURNING t.symbol, t.interval, t.timestamp, t.volume, (t.xmax = 0) AS inserted
+),
+changes AS (
+    SELECT
+        m.symbol,
+        m.interval,
+        MIN(m.timestamp) AS first_timestamp,
+        MAX(m.timestamp) AS last_timestamp,
+        COUNT(*) AS changed_rows,
+        COUNT(*) FILTER (WHERE m.inserted) AS new_rows,
+        SUM(COALESCE(m.volume, 0) - COALESCE(p.volume, 0)) AS volume_delta
+    FROM merged m
+    LEFT JOIN previous p USING (symbol, interval, timestamp)
+    GROUP BY m.symbol, m.interval
+),
+""" + APPLY_STATS_CHANGES_CTE + """
+SELECT symbol, interval, first_timestamp, last_timestamp, changed_rows, new_rows
+FROM changes;
+"""
+
+# Merges of the same symbol run one at a time: `previous` reads the
+# statement's snapshot, not the rows ON CONFLICT waits for, so a merge
+# overlapping another uncommitted one would compute its symbol_stats deltas
+# from stale volumes. Two-key locks keep clear of the single-key ones used
+# for partitions and symbol_stats.
+MERGE_LOCK_QUERY = "SELECT pg_advisory_xact_lock(hashtext('ohlc_merge'), hashtext(%s))"
+
+def lock_staged_symbols(cur) -> None:
+    """Take the merge lock of every staged symbol, in a fixed order"""
+    cur.execute("SELECT DISTINCT symbol FROM ohlc_staging")
+    for symbol in sorted(row[0] for row in cur.fetchall()):
+        cur.execute(MERGE_LOCK_QUERY, (symbol,))
+
+class ChangedRange(NamedTuple):
+    """Candles of one symbol and interval written by a store_data call"""
+    symbol: str
+    interval: str
+    first: datetime
+    last: datetime
+    rows: int
+    inserted: int = 0   # Of `rows`, those that were new
+
 class DatabaseHandler:
-    def __init__(self):
-        self.conn_params = {
-            'dbname': 'crypto_market_data',
-            'user': 'username',
-            'password': 'password',
-            'host': 'localhost',
-            'port': '5432'
-        }
+    def __init__(self, db: Optional[StorageBackend] = None):
+        self.db = db or get_database()
+        self._partitioned = None
+        self._fixed = None
+        self._known_months = set()
+        self._summaries_ready = False
     
-    def store_data(self, data: List[Dict]) -> None:
+    def get_latest_timestamps(self, symbols: List[str],
+                              interval: str = '1d') -> Dict[str, datetime]:
         """
-        Store OHLC data in PostgreSQL database
+        Latest stored candle open time per symbol, in one grouped query
+        
+        Symbols without any stored data are left out of the result.
         """
-        if not data:
+        with self.db.cursor() as cur:
+            self.db.execute_prepared(cur, 'latest_timestamps', [list(symbols), interval])
+            return dict(cur.fetchall())
+    
+    def get_symbols(self, interval: str = '1d') -> List[str]:
+        """Symbols with stored candles for `interval`"""
+        with self.db.cursor() as cur:
+            cur.execute("SELECT DISTINCT symbol FROM ohlc_data WHERE interval = %s ORDER BY symbol",
+                        (interval,))
+            return [row[0] for row in cur.fetchall()]
+    
+    def _ensure_summary_tables(self, cur) -> None:
+        """Create the tables the merge maintains alongside ohlc_data, once"""
+        if self._summaries_ready:
             return
-            
-        insert_query = """
-        INSERT INTO ohlc_data (symbol, timestamp, open, high, low, close, volume)
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT (symbol, timestamp) 
-        DO UPDATE SET
-            open = EXCLUDED.open,
-            high = EXCLUDED.high,
-            low = EXCLUDED.low,
-            close = EXCLUDED.close,
-            volume = EXCLUDED.volume;
+        ensure_watermark_table(cur)
+        ensure_symbol_stats_table(cur)
+        self._summaries_ready = True
+    
+    def merge_staged(self, cur) -> List[ChangedRange]:
+        """
+        Merge the rows staged in ohlc_staging into ohlc_data, or into
+        ohlc_fixed when the database uses the fixed-point layout
+        
+        symbol_stats, the ingest watermarks and the change log are updated in
+        the same transaction, so every writer that stages its rows keeps them
+        exact. Concurrent merges of the same symbols (e.g. stream ingest and
+        the REST pipeline) are serialized by per-symbol advisory locks, taken
+        before the merge statement so it sees the other merge's commit.
+        
+        Returns:
+            The inserted or changed candle range per symbol and interval
+        """
+        self._ensure_summary_tables(cur)
+        lock_staged_symbols(cur)
+        if self._fixed is None:
+            self._fixed = is_fixed_layout(cur)
+        if self._fixed:
+            register_symbols(cur)
+            cur.execute(MERGE_STAGING_FIXED_QUERY)
+        else:
+            cur.execute(MERGE_STAGING_QUERY)
+        changes = [ChangedRange(*row) for row in cur.fetchall()]
+        # Invalidate readers' cached results for the symbols just written
+        bump_watermarks(cur, [change.symbol for change in changes])
+        log_changes(cur, changes)
+        return changes
+    
+    def _ensure_partitions(self, cur, timestamps: pd.Series) -> None:
+        """Create any monthly partitions the batch needs, when partitioned"""
+        if self._partitioned is None:
+            self._partitioned = is_partitioned(cur)
+        if not self._partitioned:
+            return
+        
+        months = set((timestamps.dt.year * 12 + timestamps.dt.month - 1).unique().tolist())
+        missing = months - self._known_months
+        if missing:
+            ensure_partitions(cur, missing)
+            self._known_months |= missing
+    
+    def store_data(self, data: Union[List[Dict], pd.DataFrame]) -> List[ChangedRange]:
+        """
+        Store OHLC data in the database
+        
+        On Postgres the batch is streamed into a temporary staging table with
+        COPY and merged into ohlc_data with a single upsert. Rows whose values did not
+        change are left untouched so they don't produce dead tuples. Embedded
+        backends do the same through their upsert_frame.
+        
+        Args:
+            data: Columnar batch from klines_to_frame, or a list of record dicts.
+                Rows without an interval are stored as '1d'.
+        
+        Returns:
+            The inserted or changed candle range per symbol and interval
         """
+        if data is None or len(data) == 0:
+            return []
         
+        df = data if isinstance(data, pd.DataFrame) else pd.DataFrame(data)
+        if 'interval' not in df.columns:
+            df = df.assign(interval='1d')
+        start = time.perf_counter()
         try:
-            with psycopg2.connect(**self.conn_params) as conn:
-                with conn.cursor() as cur:
-                    for row in data:
-                        cur.execute(insert_query, (
-                            row['symbol'],
-                            row['timestamp'],
-                            row['open'],
-                            row['high'],
-                            row['low'],
-                            row['close'],
-                            row['volume']
-                        ))
-                    print(f"Successfully stored {len(data)} records")
+            if self.db.embedded:
+                changes = [ChangedRange(*change) for change in self.db.upsert_frame(df)]
+            else:
+                changes = self._copy_and_merge(df)
         except Exception as e:
+            # A rolled back transaction also drops tables created in it
+            self._known_months.clear()
+            self._summaries_ready = False
+            STORE_BATCHES.inc(outcome='error')
             print(f"Error storing data: {e}")
             raise
+        
+        changed = sum(change.rows for change in changes)
+        record_store(len(df), time.perf_counter() - start,
+                     sum(change.inserted for change in changes), changed)
+        print(f"Successfully stored {len(df)} records ({changed} new or changed)")
+        return changes
+    
+    def _copy_and_merge(self, df: pd.DataFrame) -> List[ChangedRange]:
+        """COPY a batch into the staging table and merge it, in one transaction"""
+        buffer = io.StringIO()
+        df.to_csv(buffer, columns=OHLC_COLUMNS, header=False, index=False)
+        buffer.seek(0)
+        
+        with self.db.cursor() as cur:
+            self._ensure_partitions(cur, pd.to_datetime(df['timestamp'], utc=True))
+            cur.execute(STAGING_TABLE_QUERY)
+            cur.copy_expert(COPY_STAGING_QUERY, buffer)
+            return self.merge_staged(cur)
 
-def main():
+def main(incremental: bool = True):
+    """
+    Fetch and store the configured symbols
+    
+    Fetching, decoding and writing run as overlapped stages, see
+    src.data.pipeline.
+    
+    Args:
+        incremental: Only fetch candles newer than what is already stored.
+            Symbols without stored data always get the full 1000 candles.
+    """
+    # Imported here, the pipeline module builds on this one
+    from src.data.pipeline import FetchStorePipeline, print_metrics
+    
     # Initialize classes
     fetcher = BinanceFetcher()
     db_handler = DatabaseHandler()
@@ -141,24 +623,12 @@ def main():
     # Alternatively, fetch all available USDT pairs
     # symbols = fetcher.get_exchange_info()
     
-    # Fetch and store data for each symbol
-    for symbol in symbols:
-        print(f"\nProcessing {symbol}...")
-        
-        try:
-            # Fetch data (default: last 1000 daily candles)
-            data = fetcher.fetch_klines_data(symbol)
-            
-            # Store data
-            if data:
-                db_handler.store_data(data)
-            
-            # Sleep to respect rate limits
-            time.sleep(1)  # Binance allows 1200 requests per minute
-            
-        except Exception as e:
-            print(f"Error processing {symbol}: {e}")
-            continue
+    watermarks = db_handler.get_latest_timestamps(symbols) if incremental else {}
+    
+    # The fetch threads share the fetcher's weight limiter, requests that
+    # hit the rate limit anyway are retried by get_klines
+    pipeline = FetchStorePipeline(fetcher, db_handler)
+    print_metrics(pipeline.run(symbols, '1d', watermarks))
 
 def list_available_pairs():
     """
@@ -176,4 +646,5 @@ if __name__ == "__main__":
     # Uncomment to see available trading pairs
     # list_available_pairs()
     
-    main()
\ No newline at end of file
+    with instrumented():
+        main()
\ No newline at end of file
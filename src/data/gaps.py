@@ -0,0 +1,281 @@
+import argparse
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pytz
+import requests
+
+from src.data.backfill import MAX_KLINES_PER_REQUEST
+from src.data.fetch_crypto_data import BinanceFetcher, DatabaseHandler, klines_to_frame
+from src.data.intervals import floor_open_time, from_ms, interval_to_ms, to_ms
+from src.utils.profiling import instrumented
+
+# Ranges the exchange itself has no candles for (e.g. trading halts). They
+# are recorded after a repair comes back empty so they aren't refetched.
+CONFIRMED_GAPS_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS confirmed_gaps (
+    symbol VARCHAR(20) NOT NULL,
+    interval VARCHAR(4) NOT NULL,
+    start_ms BIGINT NOT NULL,
+    end_ms BIGINT NOT NULL,
+    checked_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (symbol, interval, start_ms)
+);
+"""
+
+# One pass over the (symbol, interval, timestamp) index: every candle is
+# compared with the previous one of its series, and only pairs further apart
+# than one interval come back
+GAP_QUERY = """
+SELECT symbol, prev_ms + %(step)s AS start_ms, ts_ms - %(step)s AS end_ms
+FROM (
+    SELECT
+        symbol,
+        (EXTRACT(EPOCH FROM timestamp) * 1000)::BIGINT AS ts_ms,
+        (EXTRACT(EPOCH FROM LAG(timestamp) OVER (
+            PARTITION BY symbol ORDER BY timestamp
+        )) * 1000)::BIGINT AS prev_ms
+    FROM ohlc_data
+    WHERE interval = %(interval)s
+    {filters}
+) candles
+WHERE ts_ms - prev_ms > %(step)s
+ORDER BY symbol, start_ms;
+"""
+
+class Gap(NamedTuple):
+    symbol: str
+    interval: str
+    start_ms: int   # First missing open time
+    end_ms: int     # Last missing open time
+
+    def missing(self) -> int:
+        return (self.end_ms - self.start_ms) // interval_to_ms(self.interval) + 1
+
+def find_gaps_in_frame(df: pd.DataFrame, interval: str,
+                       until: Optional[int] = None) -> List[Gap]:
+    """
+    Vectorized gap search over a frame of candles
+
+    Args:
+        df: Frame with symbol and timestamp columns, e.g. from
+            ParquetReader.load
+        interval: Interval of the candles
+        until: Also report missing candles after each symbol's latest one
+            up to this open time (epoch ms)
+    """
+    step = interval_to_ms(interval)
+    gaps = []
+    for symbol, group in df.groupby('symbol', sort=True):
+        ts = np.unique(pd.to_datetime(group['timestamp'], utc=True).astype('int64') // 10**6)
+        if until is not None:
+            ts = np.append(ts, floor_open_time(until, interval) + step)
+        holes = np.flatnonzero(np.diff(ts) > step)
+        gaps.extend(Gap(symbol, interval, int(ts[i]) + step, int(ts[i + 1]) - step)
+                    for i in holes)
+    return gaps
+
+def plan_repairs(gaps: List[Gap], limit: int = MAX_KLINES_PER_REQUEST) -> List[Gap]:
+    """
+    Fewest /klines requests covering every missing candle
+
+    Each request returns up to `limit` consecutive candles, so a request
+    opened at the first uncovered missing candle also takes in any further
+    gaps within reach. Greedily starting each request there is optimal.
+
+    Returns:
+        One window per request, from its first to last missing open time
+    """
+    windows = []
+    by_series = {}
+    for gap in sorted(gaps):
+        by_series.setdefault((gap.symbol, gap.interval), []).append(gap)
+
+    for (symbol, interval), series in by_series.items():
+        span = interval_to_ms(interval) * (limit - 1)
+        window_start = window_end = None
+        for gap in series:
+            start = gap.start_ms
+            while start <= gap.end_ms:
+                if window_start is None or start > window_start + span:
+                    if window_start is not None:
+                        windows.append(Gap(symbol, interval, window_start, window_end))
+                    window_start = start
+                window_end = min(gap.end_ms, window_start + span)
+                start = window_end + interval_to_ms(interval)
+        if window_start is not None:
+            windows.append(Gap(symbol, interval, window_start, window_end))
+    return windows
+
+class GapScanner:
+    """
+    Finds missing candles per symbol and interval and refetches only those
+
+    Scanning runs as a single window function query per interval (or, with
+    engine='pandas', as a vectorized diff over the timestamps), so checking
+    millions of candles costs one index scan. Repairs are merged into as few
+    /klines requests as possible, see plan_repairs.
+
+    Usage:
+        scanner = GapScanner()
+        gaps = scanner.scan('1h')
+        scanner.repair(gaps)
+    """
+
+    def __init__(self, fetcher: Optional[BinanceFetcher] = None,
+                 db_handler: Optional[DatabaseHandler] = None, engine: str = 'sql'):
+        if engine not in ('sql', 'pandas'):
+            raise ValueError("engine must be 'sql' or 'pandas'")
+        self.fetcher = fetcher or BinanceFetcher()
+        self.db_handler = db_handler or DatabaseHandler()
+        self.db = self.db_handler.db
+        self.engine = engine
+        with self.db.cursor() as cur:
+            cur.execute(CONFIRMED_GAPS_TABLE_QUERY)
+
+    def _confirmed(self, interval: str) -> Dict[str, List[Tuple[int, int]]]:
+        with self.db.cursor() as cur:
+            cur.execute("SELECT symbol, start_ms, end_ms FROM confirmed_gaps WHERE interval = %s",
+                        (interval,))
+            confirmed = {}
+            for symbol, start_ms, end_ms in cur.fetchall():
+                confirmed.setdefault(symbol, []).append((start_ms, end_ms))
+            return confirmed
+
+    def _scan_sql(self, interval: str, symbols: Optional[List[str]]) -> List[Gap]:
+        params = {'interval': interval, 'step': interval_to_ms(interval)}
+        filters = ''
+        if symbols:
+            filters = 'AND symbol = ANY(%(symbols)s)'
+            params['symbols'] = list(symbols)
+        with self.db.cursor() as cur:
+            cur.execute(GAP_QUERY.format(filters=filters), params)
+            return [Gap(symbol, interval, start_ms, end_ms)
+                    for symbol, start_ms, end_ms in cur.fetchall()]
+
+    def _scan_pandas(self, interval: str, symbols: Optional[List[str]]) -> List[Gap]:
+        query = "SELECT symbol, timestamp FROM ohlc_data WHERE interval = %s"
+        params = [interval]
+        if symbols:
+            query += " AND symbol = ANY(%s)"
+            params.append(list(symbols))
+        return find_gaps_in_frame(self.db.read_sql(query, params), interval)
+
+    def _trailing_gaps(self, interval: str, symbols: Optional[List[str]],
+                       until: int) -> List[Gap]:
+        """Candles missing between each symbol's latest one and `until`"""
+        step = interval_to_ms(interval)
+        last_open = floor_open_time(until, interval)
+        if symbols is None:
+            symbols = self.db_handler.get_symbols(interval)
+        latest = self.db_handler.get_latest_timestamps(symbols, interval)
+        gaps = []
+        for symbol, timestamp in sorted(latest.items()):
+            start_ms = to_ms(timestamp) + step
+            if start_ms <= last_open:
+                gaps.append(Gap(symbol, interval, start_ms, last_open))
+        return gaps
+
+    def scan(self, interval: str, symbols: Optional[List[str]] = None,
+             until=None) -> List[Gap]:
+        """
+        Missing candles of `interval` between each symbol's first and last one
+
+        Args:
+            interval: Interval to check
+            symbols: Symbols to check, defaults to all
+            until: Also report candles missing after each symbol's latest
+                one, up to this time (datetime, 'YYYY-MM-DD' or epoch ms)
+
+        Returns:
+            Gaps not already confirmed to be missing on the exchange
+        """
+        if self.engine == 'sql':
+            gaps = self._scan_sql(interval, symbols)
+        else:
+            gaps = self._scan_pandas(interval, symbols)
+        if until is not None:
+            gaps.extend(self._trailing_gaps(interval, symbols, to_ms(until)))
+
+        confirmed = self._confirmed(interval)
+        return [gap for gap in gaps
+                if not any(start <= gap.start_ms and gap.end_ms <= end
+                           for start, end in confirmed.get(gap.symbol, []))]
+
+    def _confirm(self, window: Gap, data: List[List]) -> None:
+        """Record the parts of `window` the exchange returned nothing for"""
+        step = interval_to_ms(window.interval)
+        returned = sorted(entry[0] for entry in data)
+        bounds = [window.start_ms - step] + returned + [window.end_ms + step]
+        empty = [(prev + step, nxt - step) for prev, nxt in zip(bounds, bounds[1:])
+                 if nxt - prev > step]
+        if not empty:
+            return
+        with self.db.cursor() as cur:
+            for start_ms, end_ms in empty:
+                cur.execute("""
+                    INSERT INTO confirmed_gaps (symbol, interval, start_ms, end_ms)
+                    VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (symbol, interval, start_ms)
+                    DO UPDATE SET end_ms = EXCLUDED.end_ms, checked_at = CURRENT_TIMESTAMP
+                """, (window.symbol, window.interval, start_ms, end_ms))
+
+    def repair(self, gaps: List[Gap], limit: int = MAX_KLINES_PER_REQUEST) -> Dict[str, int]:
+        """
+        Refetch the missing candles with the fewest requests
+
+        Returns:
+            Requests made, candles stored, and requests that failed
+        """
+        result = {'requests': 0, 'stored': 0, 'failed': 0}
+        now_ms = to_ms(datetime.now(pytz.UTC))
+        for window in plan_repairs(gaps, limit):
+            try:
+                data = self.fetcher.get_klines(window.symbol, window.interval, window.missing(),
+                                               start_time=window.start_ms,
+                                               end_time=window.end_ms)
+            except requests.exceptions.RequestException as e:
+                print(f"Error repairing {window.symbol} {window.interval}: {e}")
+                result['failed'] += 1
+                continue
+            result['requests'] += 1
+
+            frame = klines_to_frame(window.symbol, data, window.interval)
+            if len(frame):
+                self.db_handler.store_data(frame)
+                result['stored'] += len(frame)
+            # Candles that may simply not have closed yet aren't confirmed
+            if window.end_ms + interval_to_ms(window.interval) <= now_ms:
+                self._confirm(window, data)
+        return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Find and repair missing candles")
+    parser.add_argument('--intervals', nargs='+', default=['1d'])
+    parser.add_argument('--symbols', nargs='+', help="Defaults to every stored symbol")
+    parser.add_argument('--engine', choices=['sql', 'pandas'], default='sql')
+    parser.add_argument('--until-now', action='store_true',
+                        help="Also count candles missing after the latest stored one")
+    parser.add_argument('--repair', action='store_true', help="Refetch what is missing")
+    args = parser.parse_args()
+
+    scanner = GapScanner(engine=args.engine)
+    until = datetime.now(pytz.UTC) if args.until_now else None
+    for interval in args.intervals:
+        gaps = scanner.scan(interval, args.symbols, until)
+        missing = sum(gap.missing() for gap in gaps)
+        print(f"{interval}: {len(gaps)} gaps, {missing} missing candles, "
+              f"{len(plan_repairs(gaps))} requests to repair")
+        for gap in gaps[:20]:
+            print(f"  {gap.symbol}: {from_ms(gap.start_ms)} - {from_ms(gap.end_ms)} "
+                  f"({gap.missing()} candles)")
+        if args.repair and gaps:
+            result = scanner.repair(gaps)
+            print(f"{interval}: stored {result['stored']} candles with "
+                  f"{result['requests']} requests ({result['failed']} failed)")
+
+if __name__ == "__main__":
+    with instrumented():
+        main()
@@ -0,0 +1,430 @@
+import argparse
+import io
+import json
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.data.fetch_crypto_data import ChangedRange, DatabaseHandler
+from src.data.intervals import DAY_MS, interval_to_ms
+from src.database.connection import rows_to_frame
+from src.utils.profiling import instrumented
+
+DEFAULT_INDICATORS = ['sma:20', 'ema:12', 'ema:26', 'rsi:14', 'atr:14', 'vwap']
+
+# One row per candle and indicator, so the configured set can change
+# without schema changes
+INDICATOR_TABLES_QUERY = """
+CREATE TABLE IF NOT EXISTS indicator_values (
+    symbol VARCHAR(20) NOT NULL,
+    interval VARCHAR(4) NOT NULL,
+    indicator VARCHAR(32) NOT NULL,
+    timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+    value DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (symbol, interval, indicator, timestamp)
+);
+
+-- Recurrence state (EMA, Wilder averages, VWAP sums) per series, as of
+-- last_timestamp, so a refresh only processes the candles after it
+CREATE TABLE IF NOT EXISTS indicator_state (
+    symbol VARCHAR(20) NOT NULL,
+    interval VARCHAR(4) NOT NULL,
+    last_timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+    state JSONB NOT NULL,
+    PRIMARY KEY (symbol, interval)
+);
+"""
+
+# Candles after each series' state, preceded by `lookback` worth of older
+# ones for the window based indicators
+LOAD_QUERY = """
+SELECT o.symbol, o.timestamp, o.open, o.high, o.low, o.close, o.volume,
+    s.last_timestamp IS NULL OR o.timestamp > s.last_timestamp AS new
+FROM ohlc_data o
+LEFT JOIN indicator_state s ON s.symbol = o.symbol AND s.interval = o.interval
+WHERE o.interval = %(interval)s
+AND o.symbol = ANY(%(symbols)s)
+AND (s.last_timestamp IS NULL
+     OR o.timestamp > s.last_timestamp - %(lookback)s * INTERVAL '1 millisecond')
+ORDER BY o.symbol, o.timestamp
+"""
+
+STAGING_QUERY = """
+CREATE TEMP TABLE IF NOT EXISTS indicator_staging (
+    symbol VARCHAR(20) NOT NULL,
+    interval VARCHAR(4) NOT NULL,
+    indicator VARCHAR(32) NOT NULL,
+    timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+    value DOUBLE PRECISION NOT NULL
+) ON COMMIT DELETE ROWS;
+"""
+
+MERGE_VALUES_QUERY = """
+INSERT INTO indicator_values AS v (symbol, interval, indicator, timestamp, value)
+SELECT symbol, interval, indicator, timestamp, value
+FROM indicator_staging
+ON CONFLICT (symbol, interval, indicator, timestamp)
+DO UPDATE SET value = EXCLUDED.value
+WHERE v.value IS DISTINCT FROM EXCLUDED.value;
+"""
+
+SAVE_STATE_QUERY = """
+INSERT INTO indicator_state (symbol, interval, last_timestamp, state)
+VALUES (%s, %s, %s, %s::jsonb)
+ON CONFLICT (symbol, interval)
+DO UPDATE SET last_timestamp = EXCLUDED.last_timestamp, state = EXCLUDED.state;
+"""
+
+VALUE_COLUMNS = ['symbol', 'interval', 'indicator', 'timestamp', 'value']
+
+def _seed(rows: pd.DataFrame, state: pd.DataFrame, column: str) -> pd.Series:
+    """State `column` of each row's symbol, NaN where there is none"""
+    if column not in state.columns:
+        return pd.Series(np.nan, index=rows.index)
+    return rows['symbol'].map(state[column]).astype(float)
+
+def _count(rows: pd.DataFrame, state: pd.DataFrame) -> pd.Series:
+    """Candles seen per series up to and including each row"""
+    return rows.groupby('symbol', sort=False).cumcount() + 1 + _seed(rows, state, 'count').fillna(0)
+
+def _previous_close(rows: pd.DataFrame, state: pd.DataFrame) -> pd.Series:
+    previous = rows.groupby('symbol', sort=False)['close'].shift()
+    first = ~rows['symbol'].duplicated()
+    previous[first] = _seed(rows, state, 'close')[first]
+    return previous
+
+def seeded_ewm(rows: pd.DataFrame, values: pd.Series, seeds: pd.Series,
+               alpha: float) -> pd.Series:
+    """
+    Exponential average of `values` per symbol, continuing from `seeds`
+
+    Each symbol's seed (its average before its first row, NaN for none) is
+    put in front of its values as an extra observation, which is exactly
+    where the recurrence left off. All symbols are averaged in one grouped
+    pass.
+    """
+    first = ~rows['symbol'].duplicated()
+    seeded = first & seeds.notna()
+    frame = pd.concat([
+        pd.DataFrame({'symbol': rows.loc[seeded, 'symbol'], 'x': seeds[seeded], 'order': -1}),
+        pd.DataFrame({'symbol': rows['symbol'], 'x': values, 'order': np.arange(len(rows))}),
+    ])
+    frame = frame.sort_values(['symbol', 'order'], kind='stable').reset_index(drop=True)
+    averaged = (frame.groupby('symbol', sort=False)['x'].ewm(alpha=alpha, adjust=False).mean()
+                .reset_index(level=0, drop=True).sort_index())
+    keep = (frame['order'] >= 0).to_numpy()
+    result = pd.Series(averaged.to_numpy()[keep], index=frame['order'].to_numpy()[keep])
+    return pd.Series(result.sort_index().to_numpy(), index=rows.index)
+
+class Indicator:
+    """
+    One indicator, computed for every symbol of a batch at once
+
+    compute gets the batch's new candles (sorted by symbol and time), all
+    loaded candles including `context` earlier ones per symbol, and the
+    state saved for each symbol. It returns the indicator per new candle and
+    the state as of each new candle, as columns.
+    """
+
+    context = 0
+
+    def __init__(self, period: Optional[int] = None):
+        self.period = period
+
+    @property
+    def name(self) -> str:
+        kind = type(self).__name__.lower()
+        return f"{kind}_{self.period}" if self.period else kind
+
+    def compute(self, rows: pd.DataFrame, loaded: pd.DataFrame,
+                state: pd.DataFrame) -> Tuple[pd.Series, pd.DataFrame]:
+        raise NotImplementedError
+
+class SMA(Indicator):
+    """Simple moving average of the close, over the last `period` candles"""
+
+    def __init__(self, period: int = 20):
+        super().__init__(period)
+        self.context = period - 1
+
+    def compute(self, rows, loaded, state):
+        sma = (loaded.groupby('symbol', sort=False)['close']
+               .rolling(self.period).mean().reset_index(level=0, drop=True))
+        return sma.loc[rows.index], pd.DataFrame(index=rows.index)
+
+class EMA(Indicator):
+    """Exponential moving average of the close, alpha = 2 / (period + 1)"""
+
+    def __init__(self, period: int = 12):
+        super().__init__(period)
+
+    def compute(self, rows, loaded, state):
+        ema = seeded_ewm(rows, rows['close'], _seed(rows, state, 'ema'), 2 / (self.period + 1))
+        count = _count(rows, state)
+        return ema.where(count >= self.period), pd.DataFrame({'ema': ema, 'count': count})
+
+class RSI(Indicator):
+    """Relative strength index with Wilder's smoothing (alpha = 1 / period)"""
+
+    def __init__(self, period: int = 14):
+        super().__init__(period)
+
+    def compute(self, rows, loaded, state):
+        change = rows['close'] - _previous_close(rows, state)
+        alpha = 1 / self.period
+        gain = seeded_ewm(rows, change.clip(lower=0), _seed(rows, state, 'gain'), alpha)
+        loss = seeded_ewm(rows, -change.clip(upper=0), _seed(rows, state, 'loss'), alpha)
+        # Changes seen, the first candle of a series has none
+        count = _count(rows, state) - _seed(rows, state, 'close').isna()
+        rsi = (100 - 100 / (1 + gain / loss)).where(loss > 0, 100.0)
+        return (rsi.where(count >= self.period),
+                pd.DataFrame({'gain': gain, 'loss': loss, 'close': rows['close'], 'count': count}))
+
+class ATR(Indicator):
+    """Average true range with Wilder's smoothing"""
+
+    def __init__(self, period: int = 14):
+        super().__init__(period)
+
+    def compute(self, rows, loaded, state):
+        previous = _previous_close(rows, state)
+        true_range = pd.concat([
+            rows['high'] - rows['low'],
+            (rows['high'] - previous).abs(),
+            (rows['low'] - previous).abs(),
+        ], axis=1).max(axis=1)
+        atr = seeded_ewm(rows, true_range, _seed(rows, state, 'atr'), 1 / self.period)
+        count = _count(rows, state)
+        return (atr.where(count >= self.period),
+                pd.DataFrame({'atr': atr, 'close': rows['close'], 'count': count}))
+
+class VWAP(Indicator):
+    """Volume weighted typical price, restarting every UTC day"""
+
+    def compute(self, rows, loaded, state):
+        day = rows['timestamp'].astype('int64') // 10**6 // DAY_MS
+        volume = rows['volume'].fillna(0)
+        weighted = (rows['high'] + rows['low'] + rows['close']) / 3 * volume
+
+        # Sums carried over from the state, for the rest of its day
+        same_day = _seed(rows, state, 'day') == day
+        groups = [rows['symbol'], day]
+        cum_weighted = (weighted.groupby(groups, sort=False).cumsum()
+                        + _seed(rows, state, 'weighted').where(same_day, 0))
+        cum_volume = (volume.groupby(groups, sort=False).cumsum()
+                      + _seed(rows, state, 'volume').where(same_day, 0))
+        vwap = (cum_weighted / cum_volume).where(cum_volume > 0)
+        return vwap, pd.DataFrame({'day': day, 'weighted': cum_weighted, 'volume': cum_volume})
+
+INDICATORS = {
+    'sma': SMA,
+    'ema': EMA,
+    'rsi': RSI,
+    'atr': ATR,
+    'vwap': VWAP,
+}
+
+def parse_indicator(spec: str) -> Indicator:
+    """Indicator from a 'kind[:period]' spec, e.g. 'ema:26' or 'vwap'"""
+    kind, _, period = spec.lower().partition(':')
+    if kind not in INDICATORS:
+        raise ValueError(f"Unknown indicator: {kind}")
+    return INDICATORS[kind](int(period)) if period else INDICATORS[kind]()
+
+class IndicatorEngine:
+    """
+    Maintains the indicator_values table for a configurable indicator set
+
+    Each refresh loads the candles of a batch of symbols in one query and
+    computes every indicator for all of them with grouped, vectorized
+    operations. The EMA, RSI, ATR and VWAP recurrences continue from the
+    state saved per series, so a refresh only reads the candles added since
+    the last one (plus the window of the SMAs) and each new candle costs
+    O(1).
+
+    The state is saved as of the second to last candle processed: the
+    latest one may still be open, so it is recomputed by the next refresh.
+    When older candles change, refresh_changes recomputes the series from
+    the start.
+
+    Usage:
+        engine = IndicatorEngine(['ema:12', 'rsi:14'])
+        engine.refresh('1h')
+    """
+
+    def __init__(self, indicators: Iterable[str] = DEFAULT_INDICATORS,
+                 db_handler: Optional[DatabaseHandler] = None, batch_symbols: int = 50):
+        """
+        Args:
+            indicators: Specs such as 'sma:20', see parse_indicator
+            db_handler: Handler whose database holds the candles
+            batch_symbols: Symbols loaded and computed together per batch
+        """
+        self.indicators = [parse_indicator(spec) for spec in indicators]
+        names = [indicator.name for indicator in self.indicators]
+        if len(set(names)) != len(names):
+            raise ValueError("Duplicate indicators")
+        self.db_handler = db_handler or DatabaseHandler()
+        self.db = self.db_handler.db
+        if self.db.embedded:
+            raise ValueError("The indicator engine needs Postgres")
+        self.batch_symbols = batch_symbols
+        with self.db.cursor() as cur:
+            cur.execute(INDICATOR_TABLES_QUERY)
+
+    def _load_state(self, cur, interval: str, symbols: List[str]) -> pd.DataFrame:
+        """
+        Saved state per symbol, one column per indicator field
+
+        States missing one of the configured indicators are deleted, which
+        makes their series recompute from the start.
+        """
+        cur.execute("""
+            SELECT symbol, state FROM indicator_state
+            WHERE interval = %s AND symbol = ANY(%s)
+        """, (interval, symbols))
+        states = {}
+        stale = []
+        for symbol, state in cur.fetchall():
+            if all(indicator.name in state for indicator in self.indicators):
+                states[symbol] = state
+            else:
+                stale.append(symbol)
+        if stale:
+            self.reset(interval, stale, cur)
+        return states
+
+    @staticmethod
+    def _state_frame(states: Dict[str, Dict], name: str) -> pd.DataFrame:
+        return pd.DataFrame.from_dict({symbol: state[name] for symbol, state in states.items()},
+                                      orient='index')
+
+    def _compute_batch(self, cur, interval: str, symbols: List[str]) -> int:
+        states = self._load_state(cur, interval, symbols)
+        lookback = max(indicator.context for indicator in self.indicators) * interval_to_ms(interval)
+        cur.execute(LOAD_QUERY, {'interval': interval, 'symbols': symbols, 'lookback': lookback})
+        loaded = rows_to_frame(cur)
+        if loaded.empty:
+            return 0
+        for column in ('open', 'high', 'low', 'close', 'volume'):
+            loaded[column] = loaded[column].astype(float)
+        rows = loaded[loaded['new']]
+        if rows.empty:
+            return 0
+
+        # The state to save is taken at each series' second to last new row
+        checkpoint = rows.groupby('symbol', sort=False).cumcount(ascending=False) == 1
+        checkpoints = rows.loc[checkpoint, ['symbol', 'timestamp']]
+        new_states = {symbol: {} for symbol in checkpoints['symbol']}
+
+        values = []
+        for indicator in self.indicators:
+            state = self._state_frame(states, indicator.name)
+            series, per_row = indicator.compute(rows, loaded, state)
+            values.append(pd.DataFrame({
+                'symbol': rows['symbol'],
+                'interval': interval,
+                'indicator': indicator.name,
+                'timestamp': rows['timestamp'],
+                'value': series,
+            }).dropna(subset=['value']))
+            for symbol, fields in zip(checkpoints['symbol'],
+                                      per_row.loc[checkpoints.index].to_dict('records')):
+                new_states[symbol][indicator.name] = {
+                    key: float(value) for key, value in fields.items() if pd.notna(value)
+                }
+        values = pd.concat(values, ignore_index=True)
+
+        buffer = io.StringIO()
+        values.to_csv(buffer, columns=VALUE_COLUMNS, header=False, index=False)
+        buffer.seek(0)
+        cur.execute(STAGING_QUERY)
+        cur.copy_expert(f"COPY indicator_staging ({', '.join(VALUE_COLUMNS)}) FROM STDIN "
+                        "WITH (FORMAT csv)", buffer)
+        cur.execute(MERGE_VALUES_QUERY)
+        for symbol, timestamp in checkpoints.itertuples(index=False):
+            cur.execute(SAVE_STATE_QUERY, (symbol, interval, timestamp.to_pydatetime(),
+                                           json.dumps(new_states[symbol])))
+        return len(values)
+
+    def refresh(self, interval: str, symbols: Optional[List[str]] = None) -> int:
+        """
+        Compute the indicators for the candles added since the last refresh
+
+        Args:
+            interval: Candle interval
+            symbols: Symbols to refresh, defaults to all with candles
+
+        Returns:
+            Number of indicator values written
+        """
+        symbols = sorted(symbols or self.db_handler.get_symbols(interval))
+        written = 0
+        for start in range(0, len(symbols), self.batch_symbols):
+            batch = symbols[start:start + self.batch_symbols]
+            # Values and states of a batch are committed together
+            with self.db.cursor() as cur:
+                written += self._compute_batch(cur, interval, batch)
+        return written
+
+    def reset(self, interval: str, symbols: List[str], cur=None) -> None:
+        """Drop the saved state of `symbols`, so they recompute from the start"""
+        if cur is None:
+            with self.db.cursor() as cur:
+                return self.reset(interval, symbols, cur)
+        cur.execute("DELETE FROM indicator_state WHERE interval = %s AND symbol = ANY(%s)",
+                    (interval, list(symbols)))
+
+    def refresh_changes(self, changes: Iterable[ChangedRange]) -> int:
+        """
+        Bring the indicators up to date after an ingest
+
+        Series whose changes reach back before their saved state are
+        recomputed from the start, the others continue incrementally.
+
+        Args:
+            changes: What DatabaseHandler.store_data returned for the ingest
+        """
+        by_interval = {}
+        for change in changes:
+            by_interval.setdefault(change.interval, []).append(change)
+
+        written = 0
+        for interval, interval_changes in by_interval.items():
+            symbols = sorted({change.symbol for change in interval_changes})
+            with self.db.cursor() as cur:
+                cur.execute("""
+                    SELECT symbol, last_timestamp FROM indicator_state
+                    WHERE interval = %s AND symbol = ANY(%s)
+                """, (interval, symbols))
+                checkpoints = dict(cur.fetchall())
+                stale = [change.symbol for change in interval_changes
+                         if change.symbol in checkpoints
+                         and change.first <= checkpoints[change.symbol]]
+                if stale:
+                    self.reset(interval, stale, cur)
+            written += self.refresh(interval, symbols)
+        return written
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain technical indicators over stored candles")
+    parser.add_argument('--intervals', nargs='+', default=['1d'])
+    parser.add_argument('--symbols', nargs='+', help="Defaults to every stored symbol")
+    parser.add_argument('--indicators', nargs='+', default=DEFAULT_INDICATORS,
+                        help="Specs like sma:20 ema:12 rsi:14 atr:14 vwap")
+    parser.add_argument('--rebuild', action='store_true',
+                        help="Recompute from the start instead of continuing")
+    parser.add_argument('--batch-symbols', type=int, default=50)
+    args = parser.parse_args()
+
+    engine = IndicatorEngine(args.indicators, batch_symbols=args.batch_symbols)
+    for interval in args.intervals:
+        if args.rebuild:
+            engine.reset(interval, args.symbols or engine.db_handler.get_symbols(interval))
+        written = engine.refresh(interval, args.symbols)
+        print(f"{interval}: {written} indicator values written")
+
+if __name__ == "__main__":
+    with instrumented():
+        main()
@@ -0,0 +1,71 @@
+from datetime import datetime
+from typing import Union
+
+import pytz
+
+MINUTE_MS = 60 * 1000
+HOUR_MS = 60 * MINUTE_MS
+DAY_MS = 24 * HOUR_MS
+
+# Fixed-length Binance kline intervals in milliseconds ('1M' is calendar based
+# and therefore not listed)
+INTERVAL_MS = {
+    '1m': MINUTE_MS,
+    '3m': 3 * MINUTE_MS,
+    '5m': 5 * MINUTE_MS,
+    '15m': 15 * MINUTE_MS,
+    '30m': 30 * MINUTE_MS,
+    '1h': HOUR_MS,
+    '2h': 2 * HOUR_MS,
+    '4h': 4 * HOUR_MS,
+    '6h': 6 * HOUR_MS,
+    '8h': 8 * HOUR_MS,
+    '12h': 12 * HOUR_MS,
+    '1d': DAY_MS,
+    '3d': 3 * DAY_MS,
+    '1w': 7 * DAY_MS,
+}
+
+# Weekly candles open on Monday, the epoch was a Thursday
+INTERVAL_OFFSET_MS = {
+    '1w': 4 * DAY_MS,
+}
+
+def interval_to_ms(interval: str) -> int:
+    """Length of a kline interval in milliseconds"""
+    try:
+        return INTERVAL_MS[interval]
+    except KeyError:
+        raise ValueError(f"Unsupported interval: {interval}")
+
+def floor_open_time(ts_ms: int, interval: str) -> int:
+    """Open time of the candle containing `ts_ms`"""
+    step = interval_to_ms(interval)
+    offset = INTERVAL_OFFSET_MS.get(interval, 0)
+    return (ts_ms - offset) // step * step + offset
+
+def ceil_open_time(ts_ms: int, interval: str) -> int:
+    """Open time of the first candle starting at or after `ts_ms`"""
+    floored = floor_open_time(ts_ms, interval)
+    if floored == ts_ms:
+        return ts_ms
+    return floored + interval_to_ms(interval)
+
+def to_ms(value: Union[datetime, str, int]) -> int:
+    """
+    Convert a datetime, 'YYYY-MM-DD[ HH:MM:SS]' string or epoch ms to epoch ms
+
+    Naive datetimes and strings are interpreted as UTC.
+    """
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        fmt = '%Y-%m-%d %H:%M:%S' if ' ' in value else '%Y-%m-%d'
+        value = datetime.strptime(value, fmt)
+    if value.tzinfo is None:
+        value = pytz.UTC.localize(value)
+    return int(value.timestamp() * 1000)
+
+def from_ms(ts_ms: int) -> datetime:
+    """Convert epoch ms to an aware UTC datetime"""
+    return datetime.fromtimestamp(ts_ms / 1000, tz=pytz.UTC)
@@ -0,0 +1,405 @@
+import argparse
+import os
+import socket
+import threading
+import time
+from datetime import datetime
+from typing import List, NamedTuple, Optional
+
+import pytz
+
+from src.data.backfill import MAX_KLINES_PER_REQUEST, BackfillPlanner
+from src.data.fetch_crypto_data import BinanceFetcher, DatabaseHandler, klines_to_frame
+from src.data.intervals import ceil_open_time, floor_open_time, interval_to_ms, to_ms
+from src.database.connection import Database, get_database
+from src.utils.profiling import instrumented
+
+JOB_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS ingest_jobs (
+    id BIGSERIAL PRIMARY KEY,
+    symbol VARCHAR(20) NOT NULL,
+    interval VARCHAR(4) NOT NULL,
+    start_ms BIGINT NOT NULL,       -- First candle open time of the window
+    end_ms BIGINT NOT NULL,         -- Last candle open time of the window
+    next_start_ms BIGINT NOT NULL,  -- Progress, a re-queued job resumes here
+    status VARCHAR(10) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker VARCHAR(100),
+    lease_expires_at TIMESTAMP WITH TIME ZONE,
+    heartbeat_at TIMESTAMP WITH TIME ZONE,
+    last_error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (symbol, interval, start_ms, end_ms)
+);
+
+-- Only unfinished jobs are ever scanned by claim()
+CREATE INDEX IF NOT EXISTS idx_ingest_jobs_claimable
+ON ingest_jobs (id)
+WHERE status IN ('pending', 'running');
+"""
+
+ENQUEUE_JOB_QUERY = """
+INSERT INTO ingest_jobs (symbol, interval, start_ms, end_ms, next_start_ms)
+VALUES (%s, %s, %s, %s, %s)
+ON CONFLICT (symbol, interval, start_ms, end_ms) DO NOTHING;
+"""
+
+# Pending jobs and running jobs whose lease ran out are claimable. SKIP
+# LOCKED makes concurrent claimers pass over each other's rows instead of
+# waiting on them, so no job is handed to two workers.
+CLAIM_JOBS_QUERY = """
+UPDATE ingest_jobs j
+SET status = 'running',
+    worker = %(worker)s,
+    attempts = j.attempts + 1,
+    lease_expires_at = CURRENT_TIMESTAMP + %(lease)s * INTERVAL '1 second',
+    heartbeat_at = CURRENT_TIMESTAMP,
+    updated_at = CURRENT_TIMESTAMP
+WHERE j.id IN (
+    SELECT id
+    FROM ingest_jobs
+    WHERE (status = 'pending'
+           OR (status = 'running' AND lease_expires_at < CURRENT_TIMESTAMP))
+    AND attempts < %(max_attempts)s
+    ORDER BY id
+    LIMIT %(limit)s
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING j.id, j.symbol, j.interval, j.start_ms, j.end_ms, j.next_start_ms, j.attempts;
+"""
+
+# Every write by a worker is conditional on it still holding the lease, so a
+# worker whose job was taken over after an expired lease cannot clobber it
+HEARTBEAT_QUERY = """
+UPDATE ingest_jobs
+SET lease_expires_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second',
+    heartbeat_at = CURRENT_TIMESTAMP
+WHERE id = %s AND worker = %s AND status = 'running'
+RETURNING id;
+"""
+
+PROGRESS_QUERY = """
+UPDATE ingest_jobs
+SET next_start_ms = %s,
+    updated_at = CURRENT_TIMESTAMP
+WHERE id = %s AND worker = %s AND status = 'running'
+RETURNING id;
+"""
+
+COMPLETE_JOB_QUERY = """
+UPDATE ingest_jobs
+SET status = 'done',
+    next_start_ms = end_ms + 1,
+    lease_expires_at = NULL,
+    last_error = NULL,
+    updated_at = CURRENT_TIMESTAMP
+WHERE id = %s AND worker = %s AND status = 'running'
+RETURNING id;
+"""
+
+FAIL_JOB_QUERY = """
+UPDATE ingest_jobs
+SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'pending' END,
+    lease_expires_at = NULL,
+    last_error = %s,
+    updated_at = CURRENT_TIMESTAMP
+WHERE id = %s AND worker = %s AND status = 'running'
+RETURNING status;
+"""
+
+# Jobs whose last lease expired with no attempts left would otherwise stay
+# 'running' forever
+EXPIRE_JOBS_QUERY = """
+UPDATE ingest_jobs
+SET status = 'failed',
+    last_error = COALESCE(last_error, 'lease expired'),
+    updated_at = CURRENT_TIMESTAMP
+WHERE status = 'running'
+AND lease_expires_at < CURRENT_TIMESTAMP
+AND attempts >= %s
+RETURNING id;
+"""
+
+class Job(NamedTuple):
+    id: int
+    symbol: str
+    interval: str
+    start_ms: int
+    end_ms: int
+    next_start_ms: int
+    attempts: int
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+class JobQueue:
+    """
+    Work items of (symbol, interval, window) in the ingest_jobs table
+
+    Any number of workers on any number of hosts can claim from the same
+    queue. A claimed job carries a lease that its worker extends with
+    heartbeats; when a worker dies or stalls, the lease expires and the job
+    becomes claimable again, resuming from its recorded progress.
+    """
+
+    def __init__(self, db: Optional[Database] = None, lease_seconds: int = 60,
+                 max_attempts: int = 5):
+        """
+        Args:
+            db: Database holding the queue
+            lease_seconds: How long a claim is valid without a heartbeat
+            max_attempts: Claims per job before it is marked failed
+        """
+        self.db = db or get_database()
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.ensure_table()
+
+    def ensure_table(self) -> None:
+        with self.db.cursor() as cur:
+            cur.execute(JOB_TABLE_QUERY)
+
+    def enqueue(self, symbols: List[str], intervals: List[str], start, end=None,
+                requests_per_job: int = 10) -> int:
+        """
+        Split symbols x intervals x [start, end] into jobs
+
+        Enqueueing the same range again adds nothing, jobs are unique per
+        symbol, interval and window.
+
+        Args:
+            symbols: Trading pairs
+            intervals: Timeframes
+            start: Range start as datetime, 'YYYY-MM-DD' or epoch ms
+            end: Range end, defaults to now
+            requests_per_job: /klines requests covered by one job
+
+        Returns:
+            Number of jobs added
+        """
+        planner = BackfillPlanner(MAX_KLINES_PER_REQUEST * requests_per_job)
+        end_ms = to_ms(end if end is not None else datetime.now(pytz.UTC))
+        added = 0
+        with self.db.cursor() as cur:
+            for interval in intervals:
+                windows = planner.plan(interval, ceil_open_time(to_ms(start), interval), end_ms)
+                for symbol in symbols:
+                    for window_start, window_end in windows:
+                        cur.execute(ENQUEUE_JOB_QUERY, (symbol, interval, window_start,
+                                                        window_end, window_start))
+                        added += cur.rowcount
+        return added
+
+    def enqueue_incremental(self, symbols: List[str], intervals: List[str],
+                            db_handler: Optional[DatabaseHandler] = None) -> int:
+        """
+        Jobs covering each symbol's latest stored candle up to now
+
+        Symbols without stored data get a job for their latest 1000 candles.
+        """
+        db_handler = db_handler or DatabaseHandler(self.db)
+        now_ms = to_ms(datetime.now(pytz.UTC))
+        added = 0
+        for interval in intervals:
+            latest = db_handler.get_latest_timestamps(symbols, interval)
+            end_ms = floor_open_time(now_ms, interval)
+            default_start = end_ms - (MAX_KLINES_PER_REQUEST - 1) * interval_to_ms(interval)
+            with self.db.cursor() as cur:
+                for symbol in symbols:
+                    start_ms = to_ms(latest[symbol]) if symbol in latest else default_start
+                    cur.execute(ENQUEUE_JOB_QUERY, (symbol, interval, start_ms,
+                                                    end_ms, start_ms))
+                    added += cur.rowcount
+        return added
+
+    def claim(self, worker: str, limit: int = 1) -> List[Job]:
+        """Lease up to `limit` jobs to `worker`"""
+        with self.db.cursor() as cur:
+            cur.execute(CLAIM_JOBS_QUERY, {
+                'worker': worker,
+                'lease': self.lease_seconds,
+                'max_attempts': self.max_attempts,
+                'limit': limit
+            })
+            return [Job(*row) for row in cur.fetchall()]
+
+    def _owned_update(self, query: str, params) -> bool:
+        with self.db.cursor() as cur:
+            cur.execute(query, params)
+            return cur.fetchone() is not None
+
+    def heartbeat(self, job: Job, worker: str) -> bool:
+        """Extend the lease, False when the job no longer belongs to `worker`"""
+        return self._owned_update(HEARTBEAT_QUERY, (self.lease_seconds, job.id, worker))
+
+    def record_progress(self, job: Job, worker: str, next_start_ms: int) -> bool:
+        return self._owned_update(PROGRESS_QUERY, (next_start_ms, job.id, worker))
+
+    def complete(self, job: Job, worker: str) -> bool:
+        return self._owned_update(COMPLETE_JOB_QUERY, (job.id, worker))
+
+    def fail(self, job: Job, worker: str, error: str) -> Optional[str]:
+        """Release a job after an error, returning its new status"""
+        with self.db.cursor() as cur:
+            cur.execute(FAIL_JOB_QUERY, (self.max_attempts, error[:1000], job.id, worker))
+            row = cur.fetchone()
+            return row[0] if row else None
+
+    def expire_stale(self) -> int:
+        """Mark jobs failed whose lease expired on their last attempt"""
+        with self.db.cursor() as cur:
+            cur.execute(EXPIRE_JOBS_QUERY, (self.max_attempts,))
+            return cur.rowcount
+
+    def counts(self) -> dict:
+        """Number of jobs per status"""
+        with self.db.cursor() as cur:
+            cur.execute("SELECT status, COUNT(*) FROM ingest_jobs GROUP BY status")
+            return dict(cur.fetchall())
+
+class LostLease(Exception):
+    """The job was re-queued and claimed by another worker"""
+
+class IngestWorker:
+    """
+    Claims jobs from a JobQueue and ingests their windows
+
+    A background thread heartbeats the current job every third of the lease.
+    If a heartbeat finds the job taken over, the worker stops fetching it
+    before its next request, so a window is never fetched by two workers
+    at the same time. Adding workers, on this host or others, adds
+    throughput until the exchange or the database becomes the bottleneck.
+
+    Usage:
+        worker = IngestWorker(JobQueue())
+        worker.run()
+    """
+
+    def __init__(self, job_queue: Optional[JobQueue] = None,
+                 fetcher: Optional[BinanceFetcher] = None,
+                 db_handler: Optional[DatabaseHandler] = None,
+                 worker_id: Optional[str] = None, poll_interval: float = 5.0):
+        self.queue = job_queue or JobQueue()
+        self.fetcher = fetcher or BinanceFetcher()
+        self.db_handler = db_handler or DatabaseHandler(self.queue.db)
+        self.worker_id = worker_id or default_worker_id()
+        self.poll_interval = poll_interval
+        self.planner = BackfillPlanner()
+
+    def _heartbeat_loop(self, job: Job, stop: threading.Event, lost: threading.Event) -> None:
+        while not stop.wait(self.queue.lease_seconds / 3):
+            try:
+                if not self.queue.heartbeat(job, self.worker_id):
+                    lost.set()
+                    return
+            except Exception as e:
+                # Keep trying, the lease outlives a few missed heartbeats
+                print(f"Heartbeat for job {job.id} failed: {e}")
+
+    def process(self, job: Job, lost: threading.Event) -> int:
+        """Fetch and store one job's window, returning the candles stored"""
+        step = interval_to_ms(job.interval)
+        stored = 0
+        for window_start, window_end in self.planner.plan(job.interval, job.next_start_ms,
+                                                          job.end_ms):
+            if lost.is_set():
+                raise LostLease(f"job {job.id}")
+            data = self.fetcher.get_klines(job.symbol, job.interval, self.planner.limit,
+                                           start_time=window_start, end_time=window_end)
+            frame = klines_to_frame(job.symbol, data, job.interval)
+            if len(frame):
+                self.db_handler.store_data(frame)
+                stored += len(frame)
+            if not self.queue.record_progress(job, self.worker_id, window_end + step):
+                raise LostLease(f"job {job.id}")
+        return stored
+
+    def run_job(self, job: Job) -> bool:
+        """Process `job` under a heartbeat, returning whether it completed"""
+        stop = threading.Event()
+        lost = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat_loop, args=(job, stop, lost),
+                                     daemon=True)
+        heartbeat.start()
+        try:
+            stored = self.process(job, lost)
+            completed = self.queue.complete(job, self.worker_id)
+            if completed:
+                print(f"Job {job.id} {job.symbol} {job.interval}: stored {stored} candles")
+            return completed
+        except LostLease:
+            print(f"Job {job.id} was taken over by another worker, dropping it")
+            return False
+        except Exception as e:
+            status = self.queue.fail(job, self.worker_id, str(e))
+            print(f"Job {job.id} {job.symbol} {job.interval} failed ({status}): {e}")
+            return False
+        finally:
+            stop.set()
+            heartbeat.join()
+
+    def run(self, max_jobs: Optional[int] = None, exit_when_idle: bool = False) -> int:
+        """
+        Claim and process jobs until the queue is empty or `max_jobs` is reached
+
+        Args:
+            max_jobs: Stop after this many jobs
+            exit_when_idle: Return when nothing is claimable instead of polling
+
+        Returns:
+            Number of jobs completed
+        """
+        completed = 0
+        processed = 0
+        while max_jobs is None or processed < max_jobs:
+            jobs = self.queue.claim(self.worker_id)
+            if not jobs:
+                self.queue.expire_stale()
+                if exit_when_idle:
+                    break
+                time.sleep(self.poll_interval)
+                continue
+            for job in jobs:
+                completed += self.run_job(job)
+                processed += 1
+        print(f"Worker {self.worker_id} completed {completed} jobs")
+        return completed
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared ingest job queue")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    enqueue = subparsers.add_parser('enqueue', help="Add jobs for a historical range")
+    enqueue.add_argument('--symbols', nargs='+', help="Defaults to every USDT pair")
+    enqueue.add_argument('--intervals', nargs='+', default=['1d'])
+    enqueue.add_argument('--start', help="YYYY-MM-DD, omit to only fetch what is new")
+    enqueue.add_argument('--end', help="YYYY-MM-DD, defaults to now")
+    enqueue.add_argument('--requests-per-job', type=int, default=10)
+
+    work = subparsers.add_parser('work', help="Process jobs, run one per process or host")
+    work.add_argument('--max-jobs', type=int)
+    work.add_argument('--exit-when-idle', action='store_true')
+    work.add_argument('--lease', type=int, default=60, help="Lease length in seconds")
+
+    subparsers.add_parser('status', help="Show job counts per status")
+    args = parser.parse_args()
+
+    if args.command == 'enqueue':
+        job_queue = JobQueue()
+        symbols = args.symbols or BinanceFetcher().get_exchange_info()
+        if args.start:
+            added = job_queue.enqueue(symbols, args.intervals, args.start, args.end,
+                                      args.requests_per_job)
+        else:
+            added = job_queue.enqueue_incremental(symbols, args.intervals)
+        print(f"Enqueued {added} jobs")
+    elif args.command == 'work':
+        IngestWorker(JobQueue(lease_seconds=args.lease)).run(args.max_jobs, args.exit_when_idle)
+    else:
+        for status, count in sorted(JobQueue().counts().items()):
+            print(f"{status}: {count}")
+
+if __name__ == "__main__":
+    with instrumented():
+        main()
@@ -0,0 +1,321 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.config import PANEL_DIR
+from src.data.intervals import floor_open_time, from_ms, interval_to_ms, to_ms
+from src.database.connection import StorageBackend, get_database
+from src.database.watermarks import (ack_changes, get_changes, get_watermarks, merge_ranges,
+                                     prune_change_log)
+from src.utils.profiling import instrumented
+
+PANEL_FIELDS = ('close', 'volume')
+
+# Closes and volumes of a symbol set from `start` on, in one query. An IN
+# list rather than ANY(array) so embedded backends can run it too.
+PANEL_QUERY = """
+SELECT symbol, timestamp, close, volume
+FROM ohlc_data
+WHERE interval = %s
+AND symbol IN ({symbols})
+AND timestamp >= %s
+"""
+
+# The candles of one symbol within changed ranges, appended as
+# "timestamp BETWEEN %s AND %s" terms joined by OR
+PANEL_RANGES_QUERY = """
+SELECT symbol, timestamp, close, volume
+FROM ohlc_data
+WHERE interval = %s
+AND symbol = %s
+AND ({ranges})
+"""
+
+class Panel:
+    """
+    Timestamp-aligned closes and volumes of a symbol set
+
+    Row i holds the candles opening at start_ms + i * step, column j those
+    of symbols[j]; cells without a candle are NaN. The arrays are read-only
+    memory maps of the files PanelStore keeps, so a panel of hundreds of
+    symbols opens without reading or copying anything.
+    """
+
+    def __init__(self, symbols: List[str], interval: str, start_ms: int,
+                 arrays: Dict[str, np.ndarray]):
+        self.symbols = symbols
+        self.interval = interval
+        self.start_ms = start_ms
+        self.arrays = arrays
+
+    def __len__(self) -> int:
+        return len(self.arrays['close'])
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        """Open time of each row, epoch ms"""
+        return self.start_ms + np.arange(len(self), dtype='int64') * interval_to_ms(self.interval)
+
+    def values(self, field: str = 'close', fill: Optional[str] = None) -> np.ndarray:
+        """
+        (time, symbol) array of `field`
+
+        Args:
+            field: 'close' or 'volume'
+            fill: None for the mapped array with NaN gaps, 'ffill' for a copy
+                carrying each symbol's last value forward, 'mask' for a
+                masked array hiding the gaps
+        """
+        values = self.arrays[field]
+        if fill is None:
+            return values
+        if fill == 'mask':
+            return np.ma.masked_invalid(values, copy=False)
+        if fill == 'ffill':
+            present = ~np.isnan(values)
+            rows = np.where(present, np.arange(len(values))[:, None], 0)
+            np.maximum.accumulate(rows, axis=0, out=rows)
+            filled = np.take_along_axis(values, rows, axis=0)
+            # Before a symbol's first candle there is nothing to carry
+            filled[~np.maximum.accumulate(present, axis=0)] = np.nan
+            return filled
+        raise ValueError(f"Unknown fill: {fill}")
+
+    def frame(self, field: str = 'close', fill: Optional[str] = None) -> pd.DataFrame:
+        """values() as a DataFrame indexed by open time, one column per symbol"""
+        values = self.values(field, fill)
+        if fill == 'mask':
+            values = values.filled(np.nan)
+        index = pd.to_datetime(self.timestamps, unit='ms', utc=True)
+        return pd.DataFrame(values, index=index, columns=self.symbols, copy=False)
+
+class PanelStore:
+    """
+    Cache of aligned panels as memory-mapped files, extended incrementally
+
+    Each symbol set and interval gets a directory under `directory` with one
+    raw float64 file per field, laid out time-major so new candles append
+    at the end, and a meta.json recording the symbols, the first row's open
+    time, the rows written and the ingest watermarks the panel is current
+    as of. Loading a panel whose symbols are unchanged maps the files
+    read-only. When the watermarks moved, the ranges the ingest change log
+    (see src.database.watermarks) reports since the stored versions are
+    cleared and queried again, which covers appended candles as well as
+    rewritten older ones (e.g. a backfilled gap). When the log has been
+    pruned past the stored versions the panel is rebuilt.
+
+    Each panel directory acknowledges the versions it caught up to as a
+    consumer of the change log; a removed directory keeps holding the log
+    back until watermarks.drop_consumer(cur, 'panel:<absolute path>').
+
+    Usage:
+        store = PanelStore()
+        panel = store.load(['BTCUSDT', 'ETHUSDT'], '1h', '2023-01-01')
+        returns = np.diff(np.log(panel.values('close', fill='ffill')), axis=0)
+    """
+
+    def __init__(self, db: Optional[StorageBackend] = None, directory: str = PANEL_DIR):
+        self.db = db or get_database()
+        self.directory = directory
+
+    def _panel_dir(self, symbols: List[str], interval: str) -> str:
+        digest = hashlib.sha1(','.join(symbols).encode()).hexdigest()[:16]
+        return os.path.join(self.directory, f"{interval}-{digest}")
+
+    @staticmethod
+    def _read_meta(path: str) -> Optional[Dict]:
+        try:
+            with open(os.path.join(path, 'meta.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write_meta(path: str, meta: Dict) -> None:
+        # Written after the data, so readers never see rows not yet filled
+        tmp_path = os.path.join(path, f"meta.json.{os.getpid()}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(path, 'meta.json'))
+
+    def _watermarks(self, symbols: List[str]) -> Dict[str, int]:
+        with self.db.cursor() as cur:
+            return get_watermarks(cur, symbols)
+
+    def _query(self, symbols: List[str], interval: str, since_ms: int) -> pd.DataFrame:
+        query = PANEL_QUERY.format(symbols=', '.join(['%s'] * len(symbols)))
+        return self.db.read_sql(query, [interval, *symbols, from_ms(since_ms)])
+
+    def _map(self, path: str, meta: Dict, field: str, mode: str) -> np.ndarray:
+        shape = (meta['capacity'] if mode == 'r+' else meta['rows'], len(meta['symbols']))
+        if shape[0] == 0:
+            return np.empty(shape, dtype='float64')
+        return np.memmap(os.path.join(path, f"{field}.f64"), dtype='float64',
+                         mode=mode, shape=shape)
+
+    def _write(self, path: str, meta: Dict, df: pd.DataFrame,
+               clear: Sequence[Tuple[int, int, int]] = ()) -> Dict:
+        """
+        Scatter candles into the files, growing them as needed
+
+        Args:
+            clear: (column, first row, last row) blocks set to NaN before the
+                candles are written, so candles gone from the database don't
+                linger in the panel
+        """
+        if df.empty and not clear:
+            return meta
+        step = interval_to_ms(meta['interval'])
+        ts = pd.to_datetime(df['timestamp'], utc=True).astype('int64').to_numpy() // 10**6
+        rows = (ts - meta['start_ms']) // step
+        columns = pd.Index(meta['symbols']).get_indexer(df['symbol'])
+        written = meta['rows']
+        needed = int(rows.max()) + 1 if len(rows) else written
+
+        if needed > meta['capacity']:
+            # Doubling keeps appends amortized O(1)
+            meta['capacity'] = max(needed, 2 * meta['capacity'], 1024)
+            for field in PANEL_FIELDS:
+                with open(os.path.join(path, f"{field}.f64"), 'ab') as f:
+                    f.truncate(meta['capacity'] * len(meta['symbols']) * 8)
+
+        for field in PANEL_FIELDS:
+            values = self._map(path, meta, field, 'r+')
+            if needed > written:
+                values[written:needed] = np.nan
+            for column, first, last in clear:
+                values[first:last + 1, column] = np.nan
+            values[rows, columns] = df[field].to_numpy(dtype='float64', na_value=np.nan)
+            values.flush()
+            del values
+        meta['rows'] = max(written, needed)
+        return meta
+
+    def _build(self, path: str, symbols: List[str], interval: str, start_ms: int,
+               watermarks: Dict[str, int]) -> Dict:
+        os.makedirs(path, exist_ok=True)
+        for field in PANEL_FIELDS:
+            open(os.path.join(path, f"{field}.f64"), 'wb').close()
+        meta = {'symbols': symbols, 'interval': interval, 'start_ms': start_ms,
+                'rows': 0, 'capacity': 0, 'watermarks': watermarks}
+        meta = self._write(path, meta, self._query(symbols, interval, start_ms))
+        self._acknowledge(path, meta)
+        self._write_meta(path, meta)
+        return meta
+
+    def _acknowledge(self, path: str, meta: Dict) -> None:
+        with self.db.cursor() as cur:
+            ack_changes(cur, f"panel:{os.path.abspath(path)}", meta['interval'],
+                        meta['watermarks'])
+            prune_change_log(cur)
+
+    def _catch_up(self, path: str, meta: Dict, watermarks: Dict[str, int]) -> Optional[Dict]:
+        """
+        Rewrite the cells of the ranges changed since the stored watermarks
+
+        Returns:
+            The updated meta, or None when the change log no longer goes back
+            to a stored version and the panel has to be rebuilt
+        """
+        interval = meta['interval']
+        step = interval_to_ms(interval)
+        changed = {}
+        with self.db.cursor() as cur:
+            for symbol in meta['symbols']:
+                since = meta['watermarks'].get(symbol, 0)
+                if watermarks[symbol] == since:
+                    continue
+                changes = get_changes(cur, symbol, interval, since)
+                if changes is None:
+                    return None
+                if changes:
+                    changed[symbol] = merge_ranges(changes, timedelta(milliseconds=step))
+
+        frames, clear = [], []
+        for symbol, ranges in changed.items():
+            column = meta['symbols'].index(symbol)
+            params = [interval, symbol]
+            for first, last in ranges:
+                first_ms = max(to_ms(first), meta['start_ms'])
+                last_ms = to_ms(last)
+                if last_ms < first_ms:
+                    continue
+                params.extend([from_ms(first_ms), from_ms(last_ms)])
+                last_row = min((last_ms - meta['start_ms']) // step, meta['rows'] - 1)
+                first_row = (first_ms - meta['start_ms']) // step
+                if first_row <= last_row:
+                    clear.append((column, first_row, last_row))
+            if len(params) > 2:
+                query = PANEL_RANGES_QUERY.format(
+                    ranges=' OR '.join(['timestamp BETWEEN %s AND %s'] * ((len(params) - 2) // 2)))
+                frames.append(self.db.read_sql(query, params))
+
+        if frames or clear:
+            df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(
+                columns=['symbol', 'timestamp', *PANEL_FIELDS])
+            meta = self._write(path, meta, df, clear)
+        meta['watermarks'] = watermarks
+        self._acknowledge(path, meta)
+        self._write_meta(path, meta)
+        return meta
+
+    def load(self, symbols: Iterable[str], interval: str, start, rebuild: bool = False) -> Panel:
+        """
+        Panel of `symbols` from the candle containing `start` to the latest one
+
+        Args:
+            symbols: Symbols to align, in any order (columns are sorted)
+            interval: Candle interval
+            start: Datetime, 'YYYY-MM-DD[ HH:MM:SS]' string or epoch ms
+            rebuild: Query everything again instead of extending the cache
+        """
+        symbols = sorted(set(symbols))
+        if not symbols:
+            raise ValueError("No symbols given")
+        start_ms = floor_open_time(to_ms(start), interval)
+        path = self._panel_dir(symbols, interval)
+        watermarks = self._watermarks(symbols)
+
+        meta = None if rebuild else self._read_meta(path)
+        if (meta is not None and meta['symbols'] == symbols and meta['start_ms'] <= start_ms
+                and meta['watermarks'] != watermarks):
+            meta = self._catch_up(path, meta, watermarks)
+        if meta is None or meta['symbols'] != symbols or meta['start_ms'] > start_ms:
+            loaded = time.perf_counter()
+            meta = self._build(path, symbols, interval, start_ms, watermarks)
+            print(f"Built {interval} panel of {len(symbols)} symbols x {meta['rows']} rows "
+                  f"in {time.perf_counter() - loaded:.2f}s")
+
+        arrays = {field: self._map(path, meta, field, 'r') for field in PANEL_FIELDS}
+        # A cached panel starting earlier is served as a view from `start` on
+        skip = min((start_ms - meta['start_ms']) // interval_to_ms(interval), meta['rows'])
+        return Panel(symbols, interval, start_ms,
+                     {field: values[skip:] for field, values in arrays.items()})
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or extend an aligned price panel")
+    parser.add_argument('--symbols', nargs='+', required=True)
+    parser.add_argument('--interval', default='1h')
+    parser.add_argument('--start', required=True, help="YYYY-MM-DD")
+    parser.add_argument('--directory', default=PANEL_DIR)
+    parser.add_argument('--rebuild', action='store_true', help="Query everything again")
+    args = parser.parse_args()
+
+    store = PanelStore(directory=args.directory)
+    loaded = time.perf_counter()
+    panel = store.load(args.symbols, args.interval, args.start, args.rebuild)
+    coverage = np.mean(~np.isnan(panel.values('close'))) if len(panel) else 0.0
+    print(f"{len(panel.symbols)} symbols x {len(panel)} {args.interval} rows "
+          f"({coverage:.0%} filled) loaded in {time.perf_counter() - loaded:.3f}s")
+    store.db.close()
+
+if __name__ == "__main__":
+    with instrumented():
+        main()
@@ -0,0 +1,308 @@
+import argparse
+import queue
+import threading
+import time
+from typing import Dict, List, Optional
+
+import pandas as pd
+import requests
+
+from src.data.fetch_crypto_data import BinanceFetcher, DatabaseHandler, klines_to_frame
+from src.utils.profiling import instrumented
+
+# Marks the end of a stage's input
+_DONE = object()
+
+class StageStats:
+    """Counters of one pipeline stage, shared by its workers"""
+
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = workers
+        self.processed = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        # Time spent waiting for room in the next stage's queue
+        self.blocked_seconds = 0.0
+        self.depth_sum = 0
+        self.depth_samples = 0
+        self.depth_max = 0
+        self._lock = threading.Lock()
+
+    def record(self, busy: float = 0.0, blocked: float = 0.0, processed: int = 0,
+               errors: int = 0) -> None:
+        with self._lock:
+            self.busy_seconds += busy
+            self.blocked_seconds += blocked
+            self.processed += processed
+            self.errors += errors
+
+    def sample_depth(self, depth: int) -> None:
+        with self._lock:
+            self.depth_sum += depth
+            self.depth_samples += 1
+            self.depth_max = max(self.depth_max, depth)
+
+    def as_dict(self) -> Dict:
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'processed': self.processed,
+                'errors': self.errors,
+                'busy_seconds': round(self.busy_seconds, 3),
+                'blocked_seconds': round(self.blocked_seconds, 3),
+                'avg_queue_depth': round(self.depth_sum / self.depth_samples, 2)
+                if self.depth_samples else 0.0,
+                'max_queue_depth': self.depth_max
+            }
+
+class FetchStorePipeline:
+    """
+    Overlapped fetch -> decode -> write pipeline
+
+    Each stage has its own worker threads, connected by bounded queues. When
+    the database falls behind, the write queues fill up and the decoders,
+    then the fetchers, block on them, so memory stays bounded and throughput
+    settles at the rate of the slowest stage instead of the sum of all of
+    them.
+
+    Frames are routed to writers by symbol, so concurrent transactions never
+    touch the same rows (candles, symbol_stats, watermarks) and cannot
+    deadlock on each other. A writer merges whatever frames are already
+    queued into one store_data call, up to `write_batch_rows` rows.
+
+    Usage:
+        pipeline = FetchStorePipeline(fetch_workers=8, write_workers=2)
+        metrics = pipeline.run(symbols, '1h', watermarks)
+    """
+
+    def __init__(self, fetcher: Optional[BinanceFetcher] = None,
+                 db_handler: Optional[DatabaseHandler] = None, fetch_workers: int = 4,
+                 decode_workers: int = 1, write_workers: int = 2, queue_size: int = 16,
+                 write_batch_rows: int = 50000, sample_interval: float = 0.05):
+        """
+        Args:
+            fetcher: REST client used by the fetch stage
+            db_handler: Writer used by the write stage
+            fetch_workers: Concurrent REST requests, all drawing on the
+                fetcher's request weight limiter
+            decode_workers: Threads turning raw pages into frames
+            write_workers: Concurrent database transactions
+            queue_size: Capacity of each queue between stages, in pages/frames
+            write_batch_rows: Most rows merged into one write
+            sample_interval: Seconds between queue depth samples
+        """
+        if min(fetch_workers, decode_workers, write_workers, queue_size) < 1:
+            raise ValueError("Worker counts and queue_size must be at least 1")
+        self.fetcher = fetcher or BinanceFetcher()
+        self.db_handler = db_handler or DatabaseHandler()
+        self.fetch_workers = fetch_workers
+        self.decode_workers = decode_workers
+        self.write_workers = write_workers
+        self.queue_size = queue_size
+        self.write_batch_rows = write_batch_rows
+        self.sample_interval = sample_interval
+
+    def _put(self, q: queue.Queue, item, stats: StageStats) -> None:
+        """Blocking put, the wait is the backpressure felt by `stats`' stage"""
+        start = time.perf_counter()
+        q.put(item)
+        stats.record(blocked=time.perf_counter() - start)
+
+    def _fetch_worker(self, jobs: queue.Queue, raw_pages: queue.Queue, interval: str,
+                      watermarks: Dict, stats: StageStats) -> None:
+        while True:
+            try:
+                symbol = jobs.get_nowait()
+            except queue.Empty:
+                return
+            pages = self.fetcher.iter_klines_since(symbol, watermarks.get(symbol), interval)
+            while True:
+                start = time.perf_counter()
+                try:
+                    page = next(pages, None)
+                except requests.exceptions.RequestException as e:
+                    print(f"Error fetching data for {symbol}: {e}")
+                    stats.record(busy=time.perf_counter() - start, errors=1)
+                    break
+                stats.record(busy=time.perf_counter() - start)
+                if not page:
+                    break
+                stats.record(processed=1)
+                self._put(raw_pages, (symbol, page), stats)
+
+    def _decode_worker(self, raw_pages: queue.Queue, write_queues: List[queue.Queue],
+                       interval: str, stats: StageStats) -> None:
+        while True:
+            item = raw_pages.get()
+            if item is _DONE:
+                return
+            symbol, page = item
+            start = time.perf_counter()
+            try:
+                frame = klines_to_frame(symbol, page, interval)
+            except Exception as e:
+                print(f"Error decoding data for {symbol}: {e}")
+                stats.record(busy=time.perf_counter() - start, errors=1)
+                continue
+            stats.record(busy=time.perf_counter() - start, processed=1)
+            target = write_queues[hash(symbol) % len(write_queues)]
+            self._put(target, frame, stats)
+
+    def _write_worker(self, frames: queue.Queue, stats: StageStats,
+                      totals: Dict, totals_lock: threading.Lock) -> None:
+        done = False
+        while not done:
+            item = frames.get()
+            if item is _DONE:
+                return
+            batch = [item]
+            rows = len(item)
+            # Merge what is already waiting, never wait for more
+            while rows < self.write_batch_rows:
+                try:
+                    item = frames.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _DONE:
+                    done = True
+                    break
+                batch.append(item)
+                rows += len(item)
+
+            start = time.perf_counter()
+            try:
+                data = batch[0] if len(batch) == 1 else pd.concat(batch, ignore_index=True)
+                changes = self.db_handler.store_data(data)
+            except Exception as e:
+                print(f"Error storing batch of {rows} rows: {e}")
+                stats.record(busy=time.perf_counter() - start, errors=1)
+                continue
+            stats.record(busy=time.perf_counter() - start, processed=len(batch))
+            with totals_lock:
+                totals['rows'] += rows
+                totals['changed'] += sum(change.rows for change in changes)
+
+    def _sample(self, queues: Dict[str, List[queue.Queue]], stats: Dict[str, StageStats],
+                stop: threading.Event) -> None:
+        while not stop.wait(self.sample_interval):
+            for name, stage_queues in queues.items():
+                stats[name].sample_depth(sum(q.qsize() for q in stage_queues))
+
+    @staticmethod
+    def _start(count: int, target, *args) -> List[threading.Thread]:
+        threads = [threading.Thread(target=target, args=args, daemon=True)
+                   for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def run(self, symbols: List[str], interval: str = '1d',
+            watermarks: Optional[Dict] = None) -> Dict:
+        """
+        Fetch and store `symbols`
+
+        Args:
+            symbols: Trading pairs to fetch
+            interval: Timeframe to fetch
+            watermarks: Latest stored open time per symbol. Symbols listed
+                are fetched from there on, others get the latest 1000 candles.
+
+        Returns:
+            Per-stage metrics plus overall row counts and throughput. The
+            queue depths are those of each stage's input queue.
+        """
+        watermarks = watermarks or {}
+        jobs = queue.Queue()
+        for symbol in symbols:
+            jobs.put(symbol)
+        raw_pages = queue.Queue(self.queue_size)
+        write_queues = [queue.Queue(self.queue_size) for _ in range(self.write_workers)]
+
+        stats = {
+            'fetch': StageStats('fetch', self.fetch_workers),
+            'decode': StageStats('decode', self.decode_workers),
+            'write': StageStats('write', self.write_workers)
+        }
+        totals = {'rows': 0, 'changed': 0}
+        totals_lock = threading.Lock()
+
+        stop_sampling = threading.Event()
+        sampler = threading.Thread(
+            target=self._sample,
+            args=({'fetch': [jobs], 'decode': [raw_pages], 'write': write_queues},
+                  stats, stop_sampling),
+            daemon=True
+        )
+        sampler.start()
+
+        start = time.perf_counter()
+        fetchers = self._start(self.fetch_workers, self._fetch_worker,
+                               jobs, raw_pages, interval, watermarks, stats['fetch'])
+        decoders = self._start(self.decode_workers, self._decode_worker,
+                               raw_pages, write_queues, interval, stats['decode'])
+        writers = [threading.Thread(target=self._write_worker,
+                                    args=(frames, stats['write'], totals, totals_lock),
+                                    daemon=True)
+                   for frames in write_queues]
+        for writer in writers:
+            writer.start()
+
+        # Shut the stages down in order, each once its input is exhausted
+        for thread in fetchers:
+            thread.join()
+        for _ in decoders:
+            raw_pages.put(_DONE)
+        for thread in decoders:
+            thread.join()
+        for frames in write_queues:
+            frames.put(_DONE)
+        for thread in writers:
+            thread.join()
+
+        elapsed = time.perf_counter() - start
+        stop_sampling.set()
+        sampler.join()
+
+        metrics = {name: stage.as_dict() for name, stage in stats.items()}
+        metrics['rows'] = totals['rows']
+        metrics['changed_rows'] = totals['changed']
+        metrics['elapsed_seconds'] = round(elapsed, 3)
+        metrics['rows_per_second'] = round(totals['rows'] / elapsed, 1) if elapsed else 0.0
+        return metrics
+
+def print_metrics(metrics: Dict) -> None:
+    print(f"\n{'stage':<8} {'workers':>7} {'items':>7} {'errors':>6} {'busy s':>8} "
+          f"{'blocked s':>9} {'avg depth':>9} {'max depth':>9}")
+    for name in ('fetch', 'decode', 'write'):
+        stage = metrics[name]
+        print(f"{name:<8} {stage['workers']:>7} {stage['processed']:>7} {stage['errors']:>6} "
+              f"{stage['busy_seconds']:>8.2f} {stage['blocked_seconds']:>9.2f} "
+              f"{stage['avg_queue_depth']:>9.2f} {stage['max_queue_depth']:>9}")
+    print(f"\nStored {metrics['rows']} rows ({metrics['changed_rows']} new or changed) "
+          f"in {metrics['elapsed_seconds']:.1f}s, {metrics['rows_per_second']:.0f} rows/s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch and store klines with overlapped stages")
+    parser.add_argument('--symbols', nargs='+', help="Defaults to every USDT pair")
+    parser.add_argument('--interval', default='1d')
+    parser.add_argument('--full', action='store_true',
+                        help="Ignore stored data and fetch the latest 1000 candles")
+    parser.add_argument('--fetch-workers', type=int, default=4)
+    parser.add_argument('--decode-workers', type=int, default=1)
+    parser.add_argument('--write-workers', type=int, default=2)
+    parser.add_argument('--queue-size', type=int, default=16)
+    args = parser.parse_args()
+
+    pipeline = FetchStorePipeline(fetch_workers=args.fetch_workers,
+                                  decode_workers=args.decode_workers,
+                                  write_workers=args.write_workers,
+                                  queue_size=args.queue_size)
+    symbols = args.symbols or pipeline.fetcher.get_exchange_info()
+    watermarks = ({} if args.full
+                  else pipeline.db_handler.get_latest_timestamps(symbols, args.interval))
+    print_metrics(pipeline.run(symbols, args.interval, watermarks))
+
+if __name__ == "__main__":
+    with instrumented():
+        main()
@@ -0,0 +1,248 @@
+import argparse
+import asyncio
+import json
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from src.data.stream_ingest import BINANCE_WS_URL, stream_name
+from src.utils.profiling import instrumented
+
+try:
+    import aiohttp
+    from aiohttp import web
+except ImportError:  # optional dependency, only needed for streaming
+    aiohttp = None
+
+def load_frames(path: str) -> List[Dict]:
+    """Combined-stream frames from a JSONL recording, one per line"""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+class ReplayServer:
+    """
+    Local stand-in for the Binance stream and REST endpoints
+
+    Serves recorded frames on /stream?streams=... in their original order,
+    paced by their event times, and answers /api/v3/klines from the frames
+    replayed so far, so StreamIngestor can run end to end without network
+    access, including its reconnect and gap backfill.
+
+    Every `disconnect_after` frames the server drops the connection and
+    skips `gap_frames` frames, which the client only gets back through REST.
+
+    Each stream keeps its own position in the recording, so connections
+    subscribed to different streams never consume each other's frames.
+
+    Usage:
+        server = ReplayServer('frames.jsonl', speed=0)
+        await server.start()
+        ingestor = StreamIngestor(symbols, '1m', ws_url=server.ws_url,
+                                  rest_url=server.rest_url)
+    """
+
+    def __init__(self, frames_path: str, host: str = '127.0.0.1', port: int = 8765,
+                 speed: float = 1.0, disconnect_after: Optional[int] = None,
+                 gap_frames: int = 0):
+        """
+        Args:
+            frames_path: JSONL recording, see record_frames
+            host: Interface to listen on
+            port: Port to listen on
+            speed: Replay speed relative to the recording, 0 for no pacing
+            disconnect_after: Drop each connection after this many frames
+            gap_frames: Frames skipped after a forced disconnect
+        """
+        if aiohttp is None:
+            raise ImportError("aiohttp is required for the replay server: pip install aiohttp")
+        self.frames = load_frames(frames_path)
+        self.host = host
+        self.port = port
+        self.speed = speed
+        self.disconnect_after = disconnect_after
+        self.gap_frames = gap_frames
+        # Indices of each stream's frames in the recording, and how many of
+        # them have been replayed (sent or skipped)
+        self._indices = {}
+        for index, frame in enumerate(self.frames):
+            self._indices.setdefault(frame.get('stream'), []).append(index)
+        self.positions = {stream: 0 for stream in self._indices}
+        self.connections = 0
+        self._runner = None
+
+        self.app = web.Application()
+        self.app.router.add_get('/stream', self._handle_stream)
+        self.app.router.add_get('/api/v3/klines', self._handle_klines)
+        self.app.router.add_get('/api/v3/exchangeInfo', self._handle_exchange_info)
+
+    @property
+    def ws_url(self) -> str:
+        return f"ws://{self.host}:{self.port}"
+
+    @property
+    def rest_url(self) -> str:
+        return f"http://{self.host}:{self.port}/api/v3"
+
+    @property
+    def finished(self) -> bool:
+        return all(self.positions[stream] >= len(indices)
+                   for stream, indices in self._indices.items())
+
+    def _next_frame(self, streams: Iterable[str]) -> Optional[Tuple[str, Dict]]:
+        """The earliest recorded frame of `streams` not replayed yet, and its stream"""
+        earliest = None
+        for stream in streams:
+            indices = self._indices.get(stream, [])
+            position = self.positions.get(stream, 0)
+            if position < len(indices) and (earliest is None or indices[position] < earliest[0]):
+                earliest = (indices[position], stream)
+        if earliest is None:
+            return None
+        return earliest[1], self.frames[earliest[0]]
+
+    async def start(self) -> None:
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        print(f"Replaying {len(self.frames)} frames on {self.ws_url}")
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle_stream(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.connections += 1
+        streams = set(request.query.get('streams', '').split('/'))
+
+        sent = 0
+        previous_event = None
+        while not ws.closed:
+            pending = self._next_frame(streams)
+            if pending is None:
+                break
+            stream, frame = pending
+            self.positions[stream] += 1
+
+            event_time = frame['data'].get('E')
+            if self.speed and previous_event is not None and event_time is not None:
+                await asyncio.sleep(max(0, event_time - previous_event) / 1000 / self.speed)
+            previous_event = event_time
+
+            await ws.send_str(json.dumps(frame))
+            sent += 1
+            if self.disconnect_after and sent >= self.disconnect_after:
+                for _ in range(self.gap_frames):
+                    skipped = self._next_frame(streams)
+                    if skipped is None:
+                        break
+                    self.positions[skipped[0]] += 1
+                break
+
+        await ws.close()
+        return ws
+
+    def replayed_klines(self, symbol: str, interval: str) -> List[List]:
+        """Latest state of each candle replayed so far, as /klines arrays"""
+        stream = stream_name(symbol, interval)
+        replayed = self._indices.get(stream, [])[:self.positions.get(stream, 0)]
+        candles = {}
+        for index in replayed:
+            k = self.frames[index]['data']['k']
+            candles[k['t']] = [k['t'], k['o'], k['h'], k['l'], k['c'], k['v'], k['T']]
+        return [candles[t] for t in sorted(candles)]
+
+    async def _handle_klines(self, request):
+        query = request.query
+        klines = self.replayed_klines(query['symbol'], query.get('interval', '1d'))
+        if 'startTime' in query:
+            klines = [k for k in klines if k[0] >= int(query['startTime'])]
+        if 'endTime' in query:
+            klines = [k for k in klines if k[0] <= int(query['endTime'])]
+
+        limit = int(query.get('limit', 500))
+        # Binance returns the oldest candles from startTime, otherwise the latest
+        klines = klines[:limit] if 'startTime' in query else klines[-limit:]
+        return web.json_response(klines)
+
+    async def _handle_exchange_info(self, request):
+        symbols = sorted({frame['data']['s'] for frame in self.frames if 'data' in frame})
+        return web.json_response({
+            'symbols': [{'symbol': symbol, 'status': 'TRADING'} for symbol in symbols]
+        })
+
+async def record_frames(path: str, symbols: List[str], interval: str = '1m',
+                        duration: float = 60.0, ws_url: str = BINANCE_WS_URL) -> int:
+    """
+    Record live combined-stream frames to a JSONL file for ReplayServer
+
+    Returns:
+        Number of frames recorded
+    """
+    if aiohttp is None:
+        raise ImportError("aiohttp is required for recording: pip install aiohttp")
+    streams = '/'.join(stream_name(symbol, interval) for symbol in symbols)
+    url = f"{ws_url.rstrip('/')}/stream?streams={streams}"
+
+    recorded = 0
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + duration
+    async with aiohttp.ClientSession() as session:
+        async with session.ws_connect(url) as ws:
+            with open(path, 'w') as f:
+                while (remaining := deadline - loop.time()) > 0:
+                    try:
+                        msg = await ws.receive(timeout=remaining)
+                    except asyncio.TimeoutError:
+                        break
+                    if msg.type != aiohttp.WSMsgType.TEXT:
+                        break
+                    f.write(msg.data.rstrip('\n') + '\n')
+                    recorded += 1
+
+    print(f"Recorded {recorded} frames to {path}")
+    return recorded
+
+async def serve(server: ReplayServer) -> None:
+    await server.start()
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        await server.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="Record or replay Binance kline stream frames")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    record = subparsers.add_parser('record', help="Record live frames to a JSONL file")
+    record.add_argument('path')
+    record.add_argument('--symbols', nargs='+', required=True)
+    record.add_argument('--interval', default='1m')
+    record.add_argument('--duration', type=float, default=60.0)
+
+    replay = subparsers.add_parser('replay', help="Serve a recording locally")
+    replay.add_argument('path')
+    replay.add_argument('--host', default='127.0.0.1')
+    replay.add_argument('--port', type=int, default=8765)
+    replay.add_argument('--speed', type=float, default=1.0,
+                        help="Replay speed, 0 sends frames as fast as possible")
+    replay.add_argument('--disconnect-after', type=int,
+                        help="Drop connections after this many frames")
+    replay.add_argument('--gap-frames', type=int, default=0,
+                        help="Frames skipped after each forced disconnect")
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'record':
+            asyncio.run(record_frames(args.path, args.symbols, args.interval, args.duration))
+        else:
+            server = ReplayServer(args.path, args.host, args.port, args.speed,
+                                  args.disconnect_after, args.gap_frames)
+            asyncio.run(serve(server))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    with instrumented():
+        main()
@@ -0,0 +1,307 @@
+import argparse
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.config import FETCHED_INTERVALS
+from src.data.fetch_crypto_data import (OHLC_COLUMNS, STAGING_TABLE_QUERY, ChangedRange,
+                                        DatabaseHandler)
+from src.data.intervals import (DAY_MS, INTERVAL_OFFSET_MS, floor_open_time, from_ms,
+                                interval_to_ms, to_ms)
+from src.database.partitions import ensure_partitions, is_partitioned, month_index
+from src.utils.profiling import instrumented
+
+ROLLUP_INTERVALS = ['5m', '15m', '1h', '4h', '1d', '1w']
+
+# Bucket start of a base candle, in the same epoch arithmetic as
+# intervals.floor_open_time so SQL and pandas agree on bucket boundaries
+BUCKET_EXPRESSION = """
+to_timestamp(
+    floor((extract(epoch FROM b.timestamp) - %(offset)s) / %(step)s) * %(step)s + %(offset)s
+)
+"""
+
+# first open, max high, min low, last close, summed volume per bucket. The
+# buckets are staged and then merged like any other ingest batch, so only
+# buckets whose values change are rewritten and the summaries stay exact.
+ROLLUP_QUERY = """
+INSERT INTO ohlc_staging (symbol, interval, timestamp, open, high, low, close, volume)
+SELECT
+    symbol,
+    %(target)s,
+    bucket,
+    (array_agg(open ORDER BY timestamp))[1],
+    MAX(high),
+    MIN(low),
+    (array_agg(close ORDER BY timestamp DESC))[1],
+    SUM(volume)
+FROM (
+    SELECT b.symbol, b.timestamp, b.open, b.high, b.low, b.close, b.volume,
+        {bucket} AS bucket
+    FROM ohlc_data b
+    {marks_join}
+    WHERE b.interval = %(base)s
+    {filters}
+) base
+GROUP BY symbol, bucket;
+"""
+
+# First base candle each symbol contributes to a rollup run
+ROLLUP_START_QUERY = """
+SELECT MIN(b.timestamp)
+FROM ohlc_data b
+{marks_join}
+WHERE b.interval = %(base)s
+{filters}
+GROUP BY b.symbol
+"""
+
+# Latest bucket already rolled up per symbol, it may still have been open
+ROLLUP_MARKS_JOIN = """
+    LEFT JOIN (
+        SELECT symbol, MAX(timestamp) AS since
+        FROM ohlc_data
+        WHERE interval = %(target)s
+        GROUP BY symbol
+    ) marks ON marks.symbol = b.symbol
+"""
+
+def check_rollup(base_interval: str, target: str) -> None:
+    """Raise ValueError unless `target` buckets are whole multiples of `base_interval`"""
+    base_ms = interval_to_ms(base_interval)
+    target_ms = interval_to_ms(target)
+    offset_ms = INTERVAL_OFFSET_MS.get(target, 0)
+    if target_ms <= base_ms or target_ms % base_ms or offset_ms % base_ms:
+        raise ValueError(f"Cannot roll {base_interval} candles up into {target}")
+
+def resample(df: pd.DataFrame, target: str) -> pd.DataFrame:
+    """
+    Vectorized rollup of base candles into `target` candles
+
+    Args:
+        df: Base candles with symbol, timestamp and OHLCV columns
+        target: Interval to build
+
+    Returns:
+        Candles in the OHLC_COLUMNS layout, ready for DatabaseHandler.store_data
+    """
+    if df.empty:
+        return pd.DataFrame(columns=OHLC_COLUMNS)
+
+    step_ns = interval_to_ms(target) * 1_000_000
+    offset_ns = INTERVAL_OFFSET_MS.get(target, 0) * 1_000_000
+
+    df = df.sort_values(['symbol', 'timestamp'])
+    ts_ns = pd.to_datetime(df['timestamp'], utc=True).to_numpy(dtype='datetime64[ns]').view(np.int64)
+    buckets = (ts_ns - offset_ns) // step_ns * step_ns + offset_ns
+
+    grouped = df.assign(bucket=buckets).groupby(['symbol', 'bucket'], sort=False)
+    rolled = grouped.agg(
+        open=('open', 'first'),
+        high=('high', 'max'),
+        low=('low', 'min'),
+        close=('close', 'last'),
+        volume=('volume', 'sum'),
+    ).reset_index()
+
+    rolled.insert(1, 'interval', target)
+    rolled.insert(2, 'timestamp', pd.to_datetime(rolled.pop('bucket'), unit='ns', utc=True))
+    return rolled[OHLC_COLUMNS]
+
+class RollupEngine:
+    """
+    Derives higher timeframes from stored base candles
+
+    Every refresh can run as a single set-based SQL statement per target, or
+    by loading the base candles and resampling them with pandas.
+
+    Intervals fetched directly (FETCHED_INTERVALS) are refused as targets:
+    rollups and fetches write the same ohlc_data rows, so each interval is
+    owned by one of them.
+    """
+
+    def __init__(self, db_handler: Optional[DatabaseHandler] = None,
+                 base_interval: str = '1m', engine: str = 'sql',
+                 fetched_intervals: Iterable[str] = FETCHED_INTERVALS):
+        if engine not in ('sql', 'pandas'):
+            raise ValueError(f"Unknown rollup engine: {engine}")
+        self.db_handler = db_handler or DatabaseHandler()
+        self.db = self.db_handler.db
+        if engine == 'sql' and self.db.embedded:
+            raise ValueError("The sql rollup engine needs Postgres, use engine='pandas'")
+        self.base_interval = base_interval
+        self.engine = engine
+        self.fetched_intervals = set(fetched_intervals)
+
+    @property
+    def targets(self) -> List[str]:
+        """ROLLUP_INTERVALS this engine may build"""
+        return [target for target in ROLLUP_INTERVALS
+                if target not in self.fetched_intervals
+                and interval_to_ms(target) > interval_to_ms(self.base_interval)]
+
+    def _check(self, target: str) -> None:
+        check_rollup(self.base_interval, target)
+        if target in self.fetched_intervals:
+            raise ValueError(f"{target} candles are fetched directly, rolling them up "
+                             f"would overwrite them (see FETCHED_INTERVALS)")
+
+    def _params(self, target: str) -> dict:
+        self._check(target)
+        return {
+            'base': self.base_interval,
+            'target': target,
+            'step': interval_to_ms(target) // 1000,
+            'offset': INTERVAL_OFFSET_MS.get(target, 0) // 1000,
+        }
+
+    def _run_sql(self, target: str, filters: str = '', marks: bool = False,
+                 **params) -> int:
+        query = ROLLUP_QUERY.format(
+            bucket=BUCKET_EXPRESSION,
+            marks_join=ROLLUP_MARKS_JOIN if marks else '',
+            filters=filters,
+        )
+        params = {**self._params(target), **params}
+        with self.db.cursor() as cur:
+            if interval_to_ms(target) > DAY_MS and is_partitioned(cur):
+                # A weekly bucket can open in the month before the first base
+                # candle rolled up, whose partition may not exist. Only those
+                # months are created, not ones retention has dropped.
+                cur.execute(ROLLUP_START_QUERY.format(
+                    marks_join=ROLLUP_MARKS_JOIN if marks else '', filters=filters), params)
+                ensure_partitions(cur, [
+                    month_index(from_ms(floor_open_time(to_ms(first), target)))
+                    for (first,) in cur.fetchall()
+                ])
+            cur.execute(STAGING_TABLE_QUERY)
+            cur.execute(query, params)
+            changes = self.db_handler.merge_staged(cur)
+            return sum(change.rows for change in changes)
+
+    def _run_pandas(self, target: str, symbol: str, since: Optional[datetime],
+                    until: Optional[datetime]) -> int:
+        self._check(target)
+        query = """
+        SELECT symbol, timestamp, open, high, low, close, volume
+        FROM ohlc_data
+        WHERE symbol = %s AND interval = %s
+        """
+        params = [symbol, self.base_interval]
+        if since is not None:
+            query += " AND timestamp >= %s"
+            params.append(since)
+        if until is not None:
+            query += " AND timestamp < %s"
+            params.append(until)
+
+        base = self.db.read_sql(query, params)
+        rolled = resample(base, target)
+        changes = self.db_handler.store_data(rolled)
+        return sum(change.rows for change in changes)
+
+    def rebuild(self, target: str, symbols: Optional[List[str]] = None,
+                since: Optional[datetime] = None, until: Optional[datetime] = None) -> int:
+        """
+        Recompute every `target` bucket overlapping [since, until]
+
+        Both bounds are widened to bucket boundaries so partially covered
+        buckets are recomputed from all of their base candles.
+
+        Returns:
+            Number of rollup candles written
+        """
+        if since is not None:
+            since = from_ms(floor_open_time(int(since.timestamp() * 1000), target))
+        if until is not None:
+            until_ms = floor_open_time(int(until.timestamp() * 1000), target)
+            until = from_ms(until_ms + interval_to_ms(target))
+
+        if self.engine == 'pandas':
+            symbols = symbols or self.db_handler.get_symbols(self.base_interval)
+            return sum(self._run_pandas(target, symbol, since, until) for symbol in symbols)
+
+        filters = []
+        params = {}
+        if symbols:
+            filters.append("AND b.symbol = ANY(%(symbols)s)")
+            params['symbols'] = list(symbols)
+        if since is not None:
+            filters.append("AND b.timestamp >= %(since)s")
+            params['since'] = since
+        if until is not None:
+            filters.append("AND b.timestamp < %(until)s")
+            params['until'] = until
+        return self._run_sql(target, '\n    '.join(filters), **params)
+
+    def refresh(self, targets: Optional[Iterable[str]] = None,
+                symbols: Optional[List[str]] = None) -> int:
+        """
+        Incrementally refresh rollups from their latest stored bucket onward
+
+        The latest rolled up bucket of each symbol may have been incomplete
+        when it was written, so it is recomputed along with any newer ones.
+        Symbols without rollups yet are built from their full history.
+
+        Args:
+            targets: Intervals to refresh, defaults to self.targets
+            symbols: Symbols to refresh, defaults to all
+        """
+        written = 0
+        for target in targets or self.targets:
+            if self.engine == 'pandas':
+                watched = symbols or self.db_handler.get_symbols(self.base_interval)
+                marks = self.db_handler.get_latest_timestamps(watched, target)
+                for symbol in watched:
+                    written += self._run_pandas(target, symbol, marks.get(symbol), None)
+                continue
+
+            filters = "AND (marks.since IS NULL OR b.timestamp >= marks.since)"
+            params = {}
+            if symbols:
+                filters += "\n    AND b.symbol = ANY(%(symbols)s)"
+                params['symbols'] = list(symbols)
+            written += self._run_sql(target, filters, marks=True, **params)
+        return written
+
+    def refresh_changes(self, changes: Iterable[ChangedRange],
+                        targets: Optional[Iterable[str]] = None) -> int:
+        """
+        Recompute only the buckets touched by an ingest
+
+        Args:
+            changes: What DatabaseHandler.store_data returned for the ingest
+            targets: Rollup intervals to maintain, defaults to self.targets
+        """
+        written = 0
+        for change in changes:
+            if change.interval != self.base_interval:
+                continue
+            for target in targets or self.targets:
+                written += self.rebuild(target, [change.symbol], change.first, change.last)
+        return written
+
+def main():
+    parser = argparse.ArgumentParser(description="Build higher timeframe candles from base candles")
+    parser.add_argument('--base', default='1m', help="Stored interval to roll up (default: 1m)")
+    parser.add_argument('--targets', nargs='+',
+                        help="Defaults to the rollup intervals not in FETCHED_INTERVALS")
+    parser.add_argument('--symbols', nargs='+')
+    parser.add_argument('--engine', choices=['sql', 'pandas'], default='sql')
+    parser.add_argument('--full', action='store_true',
+                        help="Rebuild the whole history instead of refreshing the tail")
+    args = parser.parse_args()
+
+    engine = RollupEngine(base_interval=args.base, engine=args.engine)
+    for target in args.targets or engine.targets:
+        if args.full:
+            written = engine.rebuild(target, args.symbols)
+        else:
+            written = engine.refresh([target], args.symbols)
+        print(f"{target}: {written} candles written")
+
+if __name__ == "__main__":
+    with instrumented():
+        main()
@@ -0,0 +1,407 @@
+import argparse
+import asyncio
+import json
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import pandas as pd
+
+from src.data.fetch_crypto_data import (BINANCE_API_URL, OHLC_COLUMNS, BinanceFetcher,
+                                        DatabaseHandler)
+from src.data.intervals import from_ms, interval_to_ms, to_ms
+from src.utils.profiling import instrumented
+
+try:
+    import aiohttp
+except ImportError:  # optional dependency, only needed for streaming
+    aiohttp = None
+
+BINANCE_WS_URL = "wss://stream.binance.com:9443"
+
+# Binance accepts up to 1024 streams per connection
+MAX_STREAMS_PER_CONNECTION = 1024
+DEFAULT_STREAMS_PER_CONNECTION = 200
+
+# Reconnect backoff in seconds, doubled after every failed attempt
+RECONNECT_MIN_DELAY = 1.0
+RECONNECT_MAX_DELAY = 60.0
+
+class Candle(NamedTuple):
+    symbol: str
+    open_time: int      # epoch ms
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: float
+    event_time: int     # epoch ms of the update that produced this state
+    closed: bool
+
+def stream_name(symbol: str, interval: str) -> str:
+    return f"{symbol.lower()}@kline_{interval}"
+
+def parse_kline_message(message: Dict) -> Optional[Candle]:
+    """
+    Decode a combined-stream kline message, None for anything else
+
+    Args:
+        message: Parsed {"stream": ..., "data": {...}} frame
+    """
+    data = message.get('data', message)
+    if data.get('e') != 'kline':
+        return None
+    k = data['k']
+    return Candle(
+        symbol=k['s'],
+        open_time=int(k['t']),
+        open=float(k['o']),
+        high=float(k['h']),
+        low=float(k['l']),
+        close=float(k['c']),
+        volume=float(k['v']),
+        event_time=int(data['E']),
+        closed=bool(k['x'])
+    )
+
+def candles_to_frame(candles: List[Candle], interval: str) -> pd.DataFrame:
+    """Columnar batch in the layout DatabaseHandler.store_data expects"""
+    if not candles:
+        return pd.DataFrame(columns=OHLC_COLUMNS)
+    df = pd.DataFrame(candles, columns=Candle._fields)
+    df['timestamp'] = pd.to_datetime(df['open_time'], unit='ms', utc=True)
+    df['interval'] = interval
+    return df[OHLC_COLUMNS]
+
+class CandleBuffer:
+    """
+    In-memory state between the stream and the database
+
+    Every update replaces the previous state of its candle, so a batch holds
+    at most one row per candle however many updates arrived for it. Updates
+    older than the state already held (by event time) are ignored, which lets
+    REST backfill and the live stream feed the same buffer in any order.
+    """
+
+    def __init__(self, write_open: bool = True):
+        """
+        Args:
+            write_open: Also flush updates of candles that are still open,
+                otherwise a candle is written once, when it closes
+        """
+        self.write_open = write_open
+        self.pending: Dict[Tuple[str, int], Candle] = {}
+        self.open_candles: Dict[str, Candle] = {}
+        self.last_open_time: Dict[str, int] = {}
+        self.oldest_pending = None
+
+    def _current(self, symbol: str, open_time: int) -> Optional[Candle]:
+        candle = self.pending.get((symbol, open_time))
+        if candle is None:
+            candle = self.open_candles.get(symbol)
+            if candle is not None and candle.open_time != open_time:
+                candle = None
+        return candle
+
+    def add(self, candle: Candle) -> bool:
+        """Apply an update, returning whether it was newer than the held state"""
+        current = self._current(candle.symbol, candle.open_time)
+        if current is not None and current.event_time > candle.event_time:
+            return False
+
+        held_open = self.open_candles.get(candle.symbol)
+        if candle.closed:
+            if held_open is not None and held_open.open_time == candle.open_time:
+                del self.open_candles[candle.symbol]
+        elif held_open is None or held_open.open_time <= candle.open_time:
+            self.open_candles[candle.symbol] = candle
+
+        if candle.closed or self.write_open:
+            if not self.pending:
+                self.oldest_pending = time.monotonic()
+            self.pending[(candle.symbol, candle.open_time)] = candle
+
+        previous = self.last_open_time.get(candle.symbol)
+        if previous is None or candle.open_time > previous:
+            self.last_open_time[candle.symbol] = candle.open_time
+        return True
+
+    def time_until_due(self, max_latency: float) -> float:
+        """Seconds until the oldest pending update exceeds `max_latency`"""
+        if not self.pending:
+            return max_latency
+        return max(0.0, self.oldest_pending + max_latency - time.monotonic())
+
+    def take(self) -> List[Candle]:
+        """Remove and return everything pending"""
+        candles = list(self.pending.values())
+        self.pending = {}
+        self.oldest_pending = None
+        return candles
+
+    def restore(self, candles: List[Candle]) -> None:
+        """Put back a batch that failed to flush, keeping newer updates"""
+        for candle in candles:
+            key = (candle.symbol, candle.open_time)
+            newer = self.pending.get(key)
+            if newer is None or newer.event_time < candle.event_time:
+                if not self.pending:
+                    self.oldest_pending = time.monotonic()
+                self.pending[key] = candle
+
+class StreamIngestor:
+    """
+    Live kline ingestion from Binance combined WebSocket streams
+
+    Symbols are spread over as few connections as the per-connection stream
+    limit allows. Updates are buffered (see CandleBuffer) and written to
+    ohlc_data in micro-batches, whenever `max_batch` candles are pending or
+    the oldest pending update is `max_latency` seconds old.
+
+    After every (re)connect the candles missed since the last one seen, or
+    since the latest stored one on startup, are fetched through the REST
+    API and fed into the same buffer.
+
+    Usage:
+        ingestor = StreamIngestor(['BTCUSDT', 'ETHUSDT'], interval='1m')
+        asyncio.run(ingestor.run())
+    """
+
+    def __init__(self, symbols: List[str], interval: str = '1m',
+                 ws_url: str = BINANCE_WS_URL, rest_url: str = BINANCE_API_URL,
+                 db_handler: Optional[DatabaseHandler] = None, max_batch: int = 500,
+                 max_latency: float = 1.0,
+                 streams_per_connection: int = DEFAULT_STREAMS_PER_CONNECTION,
+                 write_open: bool = True, idle_timeout: float = 60.0,
+                 record_path: Optional[str] = None):
+        """
+        Args:
+            symbols: Trading pairs to subscribe to
+            interval: Kline interval of every stream
+            ws_url: WebSocket base URL, the /stream endpoint is appended
+            rest_url: REST base URL used to backfill gaps
+            db_handler: Writer for the micro-batches
+            max_batch: Pending candles that trigger a flush
+            max_latency: Longest time in seconds an update waits to be written
+            streams_per_connection: Streams multiplexed over one connection
+            write_open: Also write updates of still open candles
+            idle_timeout: Reconnect when nothing arrives for this many seconds
+            record_path: Optionally append every raw frame to this file, for
+                replaying later with src.data.replay_server
+        """
+        if aiohttp is None:
+            raise ImportError("aiohttp is required for streaming: pip install aiohttp")
+        if not 0 < streams_per_connection <= MAX_STREAMS_PER_CONNECTION:
+            raise ValueError(f"streams_per_connection must be in 1..{MAX_STREAMS_PER_CONNECTION}")
+        interval_to_ms(interval)  # Rejects anything that isn't a known interval
+
+        self.symbols = [symbol.upper() for symbol in symbols]
+        self.interval = interval
+        self.ws_url = ws_url.rstrip('/')
+        self.rest_fetcher = BinanceFetcher(rest_url)
+        self.db_handler = db_handler or DatabaseHandler()
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.streams_per_connection = streams_per_connection
+        self.idle_timeout = idle_timeout
+        self.record_path = record_path
+
+        self.buffer = CandleBuffer(write_open)
+        self.stats = {
+            'messages': 0,
+            'stale_updates': 0,
+            'flushes': 0,
+            'rows_written': 0,
+            'reconnects': 0,
+            'backfilled': 0
+        }
+        self._batch_ready = asyncio.Event()
+        self._stopping = asyncio.Event()
+        self._record_file = None
+
+    def connection_groups(self) -> List[List[str]]:
+        """Symbols handled by each connection"""
+        size = self.streams_per_connection
+        return [self.symbols[i:i + size] for i in range(0, len(self.symbols), size)]
+
+    def stream_url(self, symbols: List[str]) -> str:
+        streams = '/'.join(stream_name(symbol, self.interval) for symbol in symbols)
+        return f"{self.ws_url}/stream?streams={streams}"
+
+    def current_candle(self, symbol: str) -> Optional[Candle]:
+        """Latest state of the candle still open for `symbol`"""
+        return self.buffer.open_candles.get(symbol.upper())
+
+    def _add(self, candle: Candle) -> None:
+        if not self.buffer.add(candle):
+            self.stats['stale_updates'] += 1
+        elif len(self.buffer.pending) >= self.max_batch:
+            self._batch_ready.set()
+
+    async def _backfill(self, symbols: List[str]) -> None:
+        """Fetch what was missed since the last candle seen per symbol"""
+        loop = asyncio.get_running_loop()
+        step = interval_to_ms(self.interval)
+        for symbol in symbols:
+            since = self.buffer.last_open_time.get(symbol)
+            if since is None:
+                continue
+            # State as of the request, stream updates after it take precedence
+            fetched_at = int(time.time() * 1000)
+            df = await loop.run_in_executor(None, self.rest_fetcher.fetch_klines_since,
+                                            symbol, from_ms(since), self.interval)
+            open_times = df['timestamp'].map(to_ms) if len(df) else []
+            for open_time, row in zip(open_times, df.itertuples(index=False)):
+                self._add(Candle(symbol, open_time, row.open, row.high, row.low, row.close,
+                                 row.volume, fetched_at, open_time + step <= fetched_at))
+            self.stats['backfilled'] += len(df)
+
+    def _record(self, raw: str) -> None:
+        if self._record_file is not None:
+            self._record_file.write(raw.rstrip('\n') + '\n')
+
+    async def _consume(self, ws) -> None:
+        """Read frames until the connection closes or goes quiet"""
+        while not self._stopping.is_set():
+            try:
+                msg = await ws.receive(timeout=self.idle_timeout)
+            except asyncio.TimeoutError:
+                print(f"No data for {self.idle_timeout:.0f}s, reconnecting")
+                return
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                # CLOSE, CLOSED or ERROR, pings are answered by aiohttp
+                return
+            self._record(msg.data)
+            candle = parse_kline_message(json.loads(msg.data))
+            if candle is not None:
+                self.stats['messages'] += 1
+                self._add(candle)
+
+    async def _connection_loop(self, session, symbols: List[str]) -> None:
+        """Keep one connection alive, backfilling after every connect"""
+        url = self.stream_url(symbols)
+        delay = RECONNECT_MIN_DELAY
+        while not self._stopping.is_set():
+            backfill = None
+            try:
+                async with session.ws_connect(url) as ws:
+                    print(f"Connected {len(symbols)} streams")
+                    delay = RECONNECT_MIN_DELAY
+                    # Runs next to the consumer so live updates keep flowing
+                    backfill = asyncio.create_task(self._backfill(symbols))
+                    await self._consume(ws)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"Stream connection failed: {e}")
+            finally:
+                if backfill is not None and not backfill.done():
+                    backfill.cancel()
+
+            if self._stopping.is_set():
+                break
+            self.stats['reconnects'] += 1
+            print(f"Reconnecting in {delay:.0f}s")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    async def flush(self) -> int:
+        """Write everything pending, returning the number of candles flushed"""
+        candles = self.buffer.take()
+        if not candles:
+            return 0
+        loop = asyncio.get_running_loop()
+        try:
+            # Keep the event loop free for the stream while the DB write runs
+            await loop.run_in_executor(None, self.db_handler.store_data,
+                                       candles_to_frame(candles, self.interval))
+        except Exception:
+            self.buffer.restore(candles)
+            raise
+        self.stats['flushes'] += 1
+        self.stats['rows_written'] += len(candles)
+        return len(candles)
+
+    async def _flush_loop(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(),
+                                       self.buffer.time_until_due(self.max_latency))
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                # The batch is back in the buffer and retried on the next round
+                print(f"Error flushing batch: {e}")
+                await asyncio.sleep(self.max_latency)
+
+    def stop(self) -> None:
+        """Ask run() to flush what is pending and return"""
+        self._stopping.set()
+        self._batch_ready.set()
+
+    async def run(self) -> None:
+        """Stream until stop() is called"""
+        loop = asyncio.get_running_loop()
+        # Resume from the stored data so downtime is backfilled on connect
+        latest = await loop.run_in_executor(None, self.db_handler.get_latest_timestamps,
+                                            self.symbols, self.interval)
+        for symbol, timestamp in latest.items():
+            self.buffer.last_open_time[symbol] = to_ms(timestamp)
+
+        if self.record_path:
+            self._record_file = open(self.record_path, 'a')
+        try:
+            async with aiohttp.ClientSession() as session:
+                tasks = [asyncio.create_task(self._connection_loop(session, group))
+                         for group in self.connection_groups()]
+                flusher = asyncio.create_task(self._flush_loop())
+                await self._stopping.wait()
+                await asyncio.gather(*tasks, flusher)
+            await self.flush()
+        finally:
+            if self._record_file is not None:
+                self._record_file.close()
+                self._record_file = None
+        print(f"Stream stopped: {self.stats}")
+
+async def run_until_interrupted(ingestor: StreamIngestor,
+                                duration: Optional[float] = None) -> None:
+    """Run `ingestor` for `duration` seconds, or until cancelled"""
+    task = asyncio.create_task(ingestor.run())
+    try:
+        await asyncio.wait_for(asyncio.shield(task), duration)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        pass
+    finally:
+        ingestor.stop()
+        await task
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream live klines from Binance into ohlc_data")
+    parser.add_argument('--symbols', nargs='+', required=True)
+    parser.add_argument('--interval', default='1m')
+    parser.add_argument('--ws-url', default=BINANCE_WS_URL)
+    parser.add_argument('--rest-url', default=BINANCE_API_URL)
+    parser.add_argument('--max-batch', type=int, default=500)
+    parser.add_argument('--max-latency', type=float, default=1.0,
+                        help="Seconds an update may wait before being written")
+    parser.add_argument('--closed-only', action='store_true',
+                        help="Only write candles once they close")
+    parser.add_argument('--duration', type=float, help="Stop after this many seconds")
+    parser.add_argument('--record', help="Append raw frames to this JSONL file")
+    args = parser.parse_args()
+
+    ingestor = StreamIngestor(args.symbols, args.interval, args.ws_url, args.rest_url,
+                              max_batch=args.max_batch, max_latency=args.max_latency,
+                              write_open=not args.closed_only, record_path=args.record)
+    try:
+        asyncio.run(run_until_interrupted(ingestor, args.duration))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    with instrumented():
+        main()
@@ -0,0 +1,225 @@
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Optional, Sequence
+
+import pandas as pd
+
+from src.config import DB_BACKEND, DB_CONFIG, DB_PATH, DB_POOL_MAX, DB_POOL_MIN
+
+try:
+    from psycopg2.pool import ThreadedConnectionPool
+except ImportError:  # only needed for the Postgres backend
+    ThreadedConnectionPool = None
+
+# Hot lookups, prepared once per pooled connection. Parameters use the
+# server-side $n placeholders.
+PREPARED_QUERIES = {
+    'available_symbols': """
+        SELECT DISTINCT symbol
+        FROM ohlc_data
+        ORDER BY symbol
+    """,
+    'database_stats': """
+        SELECT
+            symbol,
+            interval,
+            record_count,
+            first_timestamp as earliest_date,
+            last_timestamp as latest_date,
+            ROUND(volume_sum / NULLIF(record_count, 0), 2) as avg_volume
+        FROM symbol_stats
+        WHERE record_count > 0
+        ORDER BY record_count DESC
+    """,
+    'date_range': """
+        SELECT
+            MIN(first_timestamp) as earliest_date,
+            MAX(last_timestamp) as latest_date,
+            COALESCE(SUM(record_count), 0) as total_records
+        FROM symbol_stats
+        WHERE symbol = $1
+        AND interval = $2
+    """,
+    'symbol_intervals': """
+        SELECT interval, first_timestamp, last_timestamp
+        FROM symbol_stats
+        WHERE symbol = $1
+        AND record_count > 0
+    """,
+    'recent_data': """
+        SELECT
+            timestamp,
+            open,
+            high,
+            low,
+            close,
+            volume
+        FROM ohlc_data
+        WHERE symbol = $1
+        AND interval = $3
+        ORDER BY timestamp DESC
+        LIMIT $2
+    """,
+    'range_data': """
+        SELECT
+            timestamp,
+            open,
+            high,
+            low,
+            close,
+            volume
+        FROM ohlc_data
+        WHERE symbol = $1
+        AND timestamp BETWEEN $2 AND $3
+        AND interval = $4
+        ORDER BY timestamp DESC
+    """,
+    'latest_timestamps': """
+        SELECT symbol, MAX(timestamp)
+        FROM ohlc_data
+        WHERE symbol = ANY($1)
+        AND interval = $2
+        GROUP BY symbol
+    """,
+}
+
+def rows_to_frame(cur) -> pd.DataFrame:
+    """
+    Build a DataFrame from an executed cursor the way pd.read_sql_query would:
+    decimals become floats and timestamp columns become datetime64
+    """
+    columns = [desc[0] for desc in cur.description]
+    df = pd.DataFrame.from_records(cur.fetchall(), columns=columns, coerce_float=True)
+    for column in df.columns:
+        if len(df) and isinstance(df[column].iloc[0], datetime):
+            df[column] = pd.to_datetime(df[column], utc=True)
+    return df
+
+class StorageBackend:
+    """
+    What the fetcher, viewer and exporter need from a storage engine
+
+    Queries use %s placeholders. Named queries (PREPARED_QUERIES for
+    Postgres) are run through execute_prepared / query_prepared, so each
+    backend can use its own dialect for them.
+    """
+
+    # Embedded engines store candles through upsert_frame instead of the
+    # Postgres staging merge, and don't support the Postgres-only tools
+    # (partitions, job queue, SQL rollups, ...)
+    embedded = False
+
+    @contextmanager
+    def connection(self):
+        """One transaction, committed on success and rolled back on error"""
+        raise NotImplementedError
+
+    @contextmanager
+    def cursor(self):
+        """Cursor in its own transaction"""
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                yield cur
+
+    def read_sql(self, query: str, params: Optional[Sequence] = None) -> pd.DataFrame:
+        raise NotImplementedError
+
+    def execute_prepared(self, cur, name: str, params: Sequence = ()) -> None:
+        raise NotImplementedError
+
+    def query_prepared(self, name: str, params: Sequence = ()) -> pd.DataFrame:
+        """Run a named query and return a DataFrame"""
+        with self.cursor() as cur:
+            self.execute_prepared(cur, name, params)
+            return rows_to_frame(cur)
+
+    def close(self) -> None:
+        raise NotImplementedError
+
+class Database(StorageBackend):
+    """
+    Pooled access to the crypto_market_data database
+
+    Connections are borrowed per unit of work and returned to the pool
+    afterwards. When every connection is in use, callers wait for one to be
+    returned instead of failing.
+    """
+
+    def __init__(self, conn_params: Optional[Dict] = None, minconn: int = DB_POOL_MIN,
+                 maxconn: int = DB_POOL_MAX):
+        if ThreadedConnectionPool is None:
+            raise ImportError("psycopg2 is required for the Postgres backend: "
+                              "pip install psycopg2-binary")
+        self.conn_params = conn_params or DB_CONFIG
+        self.pool = ThreadedConnectionPool(minconn, maxconn, **self.conn_params)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._prepared = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection for one transaction
+
+        The transaction is committed when the block exits normally and rolled
+        back on an exception.
+        """
+        with self._slots:
+            conn = self.pool.getconn()
+            try:
+                with conn:
+                    yield conn
+            finally:
+                broken = bool(conn.closed)
+                if broken:
+                    with self._lock:
+                        self._prepared.pop(id(conn), None)
+                self.pool.putconn(conn, close=broken)
+
+    def read_sql(self, query: str, params: Optional[Sequence] = None) -> pd.DataFrame:
+        """Run a query on a pooled connection and return a DataFrame"""
+        with self.connection() as conn:
+            return pd.read_sql_query(query, conn, params=params)
+
+    def _prepare(self, conn, cur, name: str) -> None:
+        with self._lock:
+            prepared = self._prepared.setdefault(id(conn), set())
+            if name in prepared:
+                return
+            prepared.add(name)
+        try:
+            cur.execute(f"PREPARE {name} AS {PREPARED_QUERIES[name]}")
+        except Exception:
+            with self._lock:
+                prepared.discard(name)
+            raise
+
+    def execute_prepared(self, cur, name: str, params: Sequence = ()) -> None:
+        """Execute one of PREPARED_QUERIES on `cur`, preparing it on first use"""
+        self._prepare(cur.connection, cur, name)
+        if params:
+            placeholders = ', '.join(['%s'] * len(params))
+            cur.execute(f"EXECUTE {name}({placeholders})", tuple(params))
+        else:
+            cur.execute(f"EXECUTE {name}")
+
+    def close(self) -> None:
+        self.pool.closeall()
+        self._prepared.clear()
+
+_database = None
+_database_lock = threading.Lock()
+
+def get_database() -> StorageBackend:
+    """Process-wide shared backend selected by DB_BACKEND, created on first use"""
+    global _database
+    with _database_lock:
+        if _database is None:
+            if DB_BACKEND == 'postgres':
+                _database = Database()
+            else:
+                # Imported here, the embedded engines build on this module
+                from src.database.embedded import EmbeddedDatabase
+                _database = EmbeddedDatabase(DB_PATH, DB_BACKEND)
+        return _database
@@ -1,15 +1,70 @@
+import argparse
 import psycopg2
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 
-def create_database():
+from src.config import DB_CONFIG
+from src.database.fixed_point import FIXED_LAYOUT_QUERY
+from src.database.symbol_stats import SYMBOL_STATS_TABLE_QUERY
+from src.database.watermarks import CHANGE_LOG_TABLE_QUERIES, WATERMARK_TABLE_QUERY
+from src.utils.profiling import instrumented
+
+# One row per symbol, interval and candle open time
+OHLC_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS ohlc_data (
+    id SERIAL PRIMARY KEY,
+    symbol VARCHAR(20) NOT NULL,  -- Increased size for longer crypto symbols
+    interval VARCHAR(4) NOT NULL DEFAULT '1d',  -- Binance kline interval
+    timestamp TIMESTAMP WITH TIME ZONE NOT NULL,  -- Using timestamptz for UTC times
+    open DECIMAL(18,8) NOT NULL,  -- Increased precision for crypto prices
+    high DECIMAL(18,8) NOT NULL,
+    low DECIMAL(18,8) NOT NULL,
+    close DECIMAL(18,8) NOT NULL,
+    volume DECIMAL(24,8),  -- Changed to decimal for crypto volumes
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(symbol, interval, timestamp)  -- Also serves (symbol, ...) lookups
+);
+
+-- Create index for timestamp queries
+CREATE INDEX IF NOT EXISTS idx_timestamp 
+ON ohlc_data(timestamp);
+"""
+
+# Same columns, range partitioned by month on timestamp. Partitions are
+# created on demand by the ingest path (see src/database/partitions.py), so
+# range scans and retention only touch the months involved. The BRIN index
+# stays a few pages per partition however much history is stored.
+PARTITIONED_OHLC_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS ohlc_data (
+    symbol VARCHAR(20) NOT NULL,
+    interval VARCHAR(4) NOT NULL DEFAULT '1d',
+    timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+    open DECIMAL(18,8) NOT NULL,
+    high DECIMAL(18,8) NOT NULL,
+    low DECIMAL(18,8) NOT NULL,
+    close DECIMAL(18,8) NOT NULL,
+    volume DECIMAL(24,8),
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (symbol, interval, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+CREATE INDEX IF NOT EXISTS idx_timestamp_brin
+ON ohlc_data USING BRIN (timestamp);
+"""
+
+def create_database(partitioned: bool = False, fixed: bool = False):
+    """
+    Create the crypto_market_data database and the ohlc_data table
+    
+    Args:
+        partitioned: Create ohlc_data range partitioned by month
+        fixed: Store candles in the compact fixed-point layout, with
+            ohlc_data as a view (see src/database/fixed_point.py)
+    """
+    if partitioned and fixed:
+        raise ValueError("The fixed-point layout cannot be partitioned")
+    
     # Connect to default postgres database first
-    conn_params = {
-        'dbname': 'postgres',
-        'user': 'username',
-        'password': 'password',
-        'host': 'localhost',
-        'port': '5432'
-    }
+    conn_params = {**DB_CONFIG, 'dbname': 'postgres'}
     
     try:
         # Connect to default postgres database
@@ -18,7 +73,7 @@ def create_database():
         cur = conn.cursor()
         
         # Create new database
-        db_name = 'crypto_market_data'
+        db_name = DB_CONFIG['dbname']
         cur.execute(f"SELECT 1 FROM pg_catalog.pg_database WHERE datname = '{db_name}'")
         exists = cur.fetchone()
         
@@ -37,32 +92,21 @@ def create_database():
         cur = conn.cursor()
         
         # Create OHLC table with cryptocurrency specific considerations
-        create_table_query = """
-        CREATE TABLE IF NOT EXISTS ohlc_data (
-            id SERIAL PRIMARY KEY,
-            symbol VARCHAR(20) NOT NULL,  -- Increased size for longer crypto symbols
-            timestamp TIMESTAMP WITH TIME ZONE NOT NULL,  -- Using timestamptz for UTC times
-            open DECIMAL(18,8) NOT NULL,  -- Increased precision for crypto prices
-            high DECIMAL(18,8) NOT NULL,
-            low DECIMAL(18,8) NOT NULL,
-            close DECIMAL(18,8) NOT NULL,
-            volume DECIMAL(24,8),  -- Changed to decimal for crypto volumes
-            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(symbol, timestamp)
-        );
-        
-        -- Create index for faster queries
-        CREATE INDEX IF NOT EXISTS idx_symbol_timestamp 
-        ON ohlc_data(symbol, timestamp);
-        
-        -- Create index for timestamp queries
-        CREATE INDEX IF NOT EXISTS idx_timestamp 
-        ON ohlc_data(timestamp);
-        """
+        if fixed:
+            create_table_query = FIXED_LAYOUT_QUERY
+        elif partitioned:
+            create_table_query = PARTITIONED_OHLC_TABLE_QUERY
+        else:
+            create_table_query = OHLC_TABLE_QUERY
         
         cur.execute(create_table_query)
+        cur.execute(WATERMARK_TABLE_QUERY)
+        for query in CHANGE_LOG_TABLE_QUERIES:
+            cur.execute(query)
+        cur.execute(SYMBOL_STATS_TABLE_QUERY)
         conn.commit()
-        print("OHLC table created successfully")
+        layout = "partitioned " if partitioned else "fixed-point " if fixed else ""
+        print(f"OHLC {layout}table created successfully")
         
     except Exception as e:
         print(f"Error: {e}")
@@ -72,5 +116,17 @@ def create_database():
         if conn:
             conn.close()
 
+def main():
+    parser = argparse.ArgumentParser(description="Create the crypto market database")
+    layout = parser.add_mutually_exclusive_group()
+    layout.add_argument('--partitioned', action='store_true',
+                        help="Partition ohlc_data by month with a BRIN timestamp index")
+    layout.add_argument('--fixed', action='store_true',
+                        help="Store prices and volume as scaled BIGINTs")
+    args = parser.parse_args()
+    
+    create_database(partitioned=args.partitioned, fixed=args.fixed)
+
 if __name__ == "__main__":
-    create_database()
\ No newline at end of file
+    with instrumented():
+        main()
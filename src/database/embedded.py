@@ -0,0 +1,398 @@
+import json
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from src.database.connection import StorageBackend, rows_to_frame
+from src.database.watermarks import CHANGE_LOG_TABLE_QUERIES, WATERMARK_TABLE_QUERY, log_changes
+
+try:
+    import duckdb
+except ImportError:  # optional dependency, SQLite is used as the fallback
+    duckdb = None
+
+# Candles as plain doubles, keyed like the Postgres table. DuckDB stores
+# them column by column, so scans and aggregates only read what they use.
+EMBEDDED_OHLC_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS ohlc_data (
+    symbol VARCHAR NOT NULL,
+    interval VARCHAR NOT NULL,
+    timestamp TIMESTAMPTZ NOT NULL,
+    open DOUBLE NOT NULL,
+    high DOUBLE NOT NULL,
+    low DOUBLE NOT NULL,
+    close DOUBLE NOT NULL,
+    volume DOUBLE,
+    PRIMARY KEY (symbol, interval, timestamp)
+)
+"""
+
+# Counterparts of PREPARED_QUERIES. Statistics are computed from the
+# candles directly, which a columnar engine does at scan speed.
+EMBEDDED_QUERIES = {
+    'available_symbols': """
+        SELECT DISTINCT symbol
+        FROM ohlc_data
+        ORDER BY symbol
+    """,
+    'database_stats': """
+        SELECT
+            symbol,
+            interval,
+            COUNT(*) as record_count,
+            MIN(timestamp) as earliest_date,
+            MAX(timestamp) as latest_date,
+            ROUND(AVG(volume), 2) as avg_volume
+        FROM ohlc_data
+        GROUP BY symbol, interval
+        ORDER BY record_count DESC
+    """,
+    'date_range': """
+        SELECT
+            MIN(timestamp) as earliest_date,
+            MAX(timestamp) as latest_date,
+            COUNT(*) as total_records
+        FROM ohlc_data
+        WHERE symbol = $1
+        AND interval = $2
+    """,
+    'symbol_intervals': """
+        SELECT interval, MIN(timestamp) AS first_timestamp, MAX(timestamp) AS last_timestamp
+        FROM ohlc_data
+        WHERE symbol = $1
+        GROUP BY interval
+    """,
+    'recent_data': """
+        SELECT
+            timestamp,
+            open,
+            high,
+            low,
+            close,
+            volume
+        FROM ohlc_data
+        WHERE symbol = $1
+        AND interval = $3
+        ORDER BY timestamp DESC
+        LIMIT $2
+    """,
+    'range_data': """
+        SELECT *
+        FROM ohlc_data
+        WHERE symbol = $1
+        AND timestamp BETWEEN $2 AND $3
+        AND interval = $4
+        ORDER BY timestamp
+    """,
+    'latest_timestamps': """
+        SELECT symbol, MAX(timestamp)
+        FROM ohlc_data
+        WHERE symbol IN (SELECT {symbols})
+        AND interval = $2
+        GROUP BY symbol
+    """
+}
+
+# Rows of a batch that are new or differ from what is stored
+CHANGED_ROWS_QUERY = """
+CREATE TEMP TABLE changed AS
+SELECT i.symbol, i.interval, i.timestamp, i.open, i.high, i.low, i.close, i.volume,
+    o.symbol IS NULL AS inserted
+FROM incoming i
+LEFT JOIN ohlc_data o
+ON o.symbol = i.symbol AND o.interval = i.interval AND o.timestamp = i.timestamp
+WHERE o.symbol IS NULL
+OR o.open {ne} i.open
+OR o.high {ne} i.high
+OR o.low {ne} i.low
+OR o.close {ne} i.close
+OR o.volume {ne} i.volume
+"""
+
+# Portable counterpart of BUMP_WATERMARKS_QUERY, run once per symbol
+BUMP_WATERMARK_QUERY = """
+INSERT INTO ingest_watermarks (symbol, version, updated_at)
+VALUES (?, 1, CURRENT_TIMESTAMP)
+ON CONFLICT (symbol)
+DO UPDATE SET
+    version = ingest_watermarks.version + 1,
+    updated_at = EXCLUDED.updated_at
+"""
+
+COLUMNS = ['symbol', 'interval', 'timestamp', 'open', 'high', 'low', 'close', 'volume']
+TIMESTAMP_COLUMNS = ('timestamp', 'earliest_date', 'latest_date')
+# 'YYYY-MM-DD[ HH:MM:SS]' parameters, as the viewer and exporters pass them
+DATE_STRING = re.compile(r'\d{4}-\d{2}-\d{2}( \d{2}:\d{2}:\d{2})?')
+
+class DuckDBEngine:
+    name = 'duckdb'
+    not_distinct = 'IS DISTINCT FROM'
+    symbols_list = 'UNNEST($1)'
+
+    def connect(self, path: str):
+        if duckdb is None:
+            raise ImportError("duckdb is required for the DuckDB backend: pip install duckdb")
+        return duckdb.connect(path)
+
+    def cursor(self, con):
+        # DuckDB cursors are separate connections with their own
+        # transactions, so statements run on the connection itself
+        return con
+
+    def begin(self, con) -> None:
+        con.execute("BEGIN TRANSACTION")
+
+    def placeholders(self, query: str) -> str:
+        return query
+
+    def param(self, value):
+        return value
+
+    def load_frame(self, con, df: pd.DataFrame) -> None:
+        con.register('incoming_frame', df)
+        con.execute("CREATE TEMP TABLE incoming AS SELECT * FROM incoming_frame")
+        con.unregister('incoming_frame')
+
+    def to_datetime(self, value) -> datetime:
+        return value
+
+class SQLiteEngine:
+    name = 'sqlite'
+    not_distinct = 'IS NOT'
+    # SQLite has no arrays, lists are passed as JSON
+    symbols_list = 'value FROM json_each(?1)'
+
+    def connect(self, path: str):
+        con = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES,
+                              check_same_thread=False, isolation_level=None)
+        con.execute("PRAGMA journal_mode=WAL")
+        return con
+
+    def cursor(self, con):
+        return con.cursor()
+
+    def begin(self, con) -> None:
+        con.execute("BEGIN")
+
+    def placeholders(self, query: str) -> str:
+        return re.sub(r'\$(\d+)', r'?\1', query)
+
+    def param(self, value):
+        if isinstance(value, (list, tuple)):
+            return json.dumps(list(value))
+        if isinstance(value, str) and DATE_STRING.fullmatch(value):
+            # Compared as text against stored timestamps, so a bare date
+            # must become the same ISO form to mean midnight UTC as it does
+            # for Postgres
+            return _format_timestamp(datetime.fromisoformat(value))
+        return value
+
+    def load_frame(self, con, df: pd.DataFrame) -> None:
+        con.execute("""
+            CREATE TEMP TABLE incoming (
+                symbol TEXT, interval TEXT, timestamp TIMESTAMPTZ,
+                open REAL, high REAL, low REAL, close REAL, volume REAL
+            )
+        """)
+        con.executemany("INSERT INTO incoming VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        df.itertuples(index=False, name=None))
+
+    def to_datetime(self, value) -> datetime:
+        return value if isinstance(value, datetime) else _parse_timestamp(value)
+
+def _format_timestamp(value: datetime) -> str:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat(sep=' ')
+
+def _parse_timestamp(value) -> datetime:
+    if isinstance(value, bytes):
+        value = value.decode()
+    return datetime.fromisoformat(value)
+
+# Timestamps are stored as UTC ISO strings, which sort chronologically
+sqlite3.register_adapter(datetime, _format_timestamp)
+sqlite3.register_adapter(pd.Timestamp, lambda ts: _format_timestamp(ts.to_pydatetime()))
+sqlite3.register_converter('TIMESTAMPTZ', _parse_timestamp)
+
+ENGINES = {
+    'duckdb': DuckDBEngine,
+    'sqlite': SQLiteEngine
+}
+
+class EmbeddedCursor:
+    """DB-API cursor taking %s placeholders, like psycopg2's"""
+
+    def __init__(self, engine, con):
+        self._engine = engine
+        self._con = con
+        self._cur = engine.cursor(con)
+        # Accepted for compatibility with psycopg2 named cursors, rows are
+        # always fetched incrementally
+        self.itersize = 2000
+
+    def execute(self, query: str, params: Optional[Sequence] = None):
+        query = self._engine.placeholders(query.replace('%s', '?'))
+        params = [self._engine.param(value) for value in params or []]
+        self._cur.execute(query, params)
+        return self
+
+    def executemany(self, query: str, rows):
+        self._cur.executemany(query.replace('%s', '?'), rows)
+
+    @property
+    def description(self):
+        return self._cur.description
+
+    @property
+    def rowcount(self):
+        return getattr(self._cur, 'rowcount', -1)
+
+    def fetchone(self):
+        return self._cur.fetchone()
+
+    def fetchmany(self, size: int):
+        return self._cur.fetchmany(size)
+
+    def fetchall(self):
+        return self._cur.fetchall()
+
+    def __iter__(self):
+        while True:
+            rows = self._cur.fetchmany(self.itersize)
+            if not rows:
+                return
+            yield from rows
+
+    def close(self):
+        if self._cur is not self._con:
+            self._cur.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class EmbeddedConnection:
+    def __init__(self, engine, con):
+        self._engine = engine
+        self._con = con
+
+    def cursor(self, name: Optional[str] = None) -> EmbeddedCursor:
+        """A new cursor, `name` is accepted for psycopg2 compatibility"""
+        return EmbeddedCursor(self._engine, self._con)
+
+class EmbeddedDatabase(StorageBackend):
+    """
+    Serverless storage in a single DuckDB (or SQLite) file
+
+    A drop-in for Database wherever candles are ingested, viewed and
+    exported, for research boxes and CI without Postgres. One connection is
+    shared and every transaction is serialised, which suits the single
+    writer these engines allow.
+
+    Usage:
+        db = EmbeddedDatabase('crypto.duckdb')
+        DatabaseHandler(db).store_data(frame)
+        CryptoDataViewer(db).get_database_stats()
+    """
+
+    embedded = True
+
+    def __init__(self, path: str = 'crypto_market_data.db', engine: str = 'duckdb'):
+        """
+        Args:
+            path: Database file, ':memory:' for a throwaway database
+            engine: 'duckdb', or 'sqlite' where DuckDB isn't installed
+        """
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown embedded engine: {engine}")
+        self.path = path
+        self.engine = ENGINES[engine]()
+        self._con = self.engine.connect(path)
+        self._lock = threading.RLock()
+        with self.cursor() as cur:
+            cur.execute(EMBEDDED_OHLC_TABLE_QUERY)
+            cur.execute(WATERMARK_TABLE_QUERY)
+            for query in CHANGE_LOG_TABLE_QUERIES:
+                cur.execute(query)
+
+    @contextmanager
+    def connection(self):
+        with self._lock:
+            self.engine.begin(self._con)
+            try:
+                yield EmbeddedConnection(self.engine, self._con)
+            except BaseException:
+                self._con.rollback()
+                raise
+            self._con.commit()
+
+    @staticmethod
+    def _parse_timestamps(df: pd.DataFrame) -> pd.DataFrame:
+        for column in TIMESTAMP_COLUMNS:
+            if column in df.columns and df[column].dtype == object:
+                df[column] = pd.to_datetime(df[column], utc=True)
+        return df
+
+    def read_sql(self, query: str, params: Optional[Sequence] = None) -> pd.DataFrame:
+        with self.cursor() as cur:
+            cur.execute(query, params)
+            return self._parse_timestamps(rows_to_frame(cur))
+
+    def execute_prepared(self, cur, name: str, params: Sequence = ()) -> None:
+        query = EMBEDDED_QUERIES[name].format(symbols=self.engine.symbols_list)
+        cur.execute(self.engine.placeholders(query), params)
+
+    def query_prepared(self, name: str, params: Sequence = ()) -> pd.DataFrame:
+        return self._parse_timestamps(super().query_prepared(name, params))
+
+    def upsert_frame(self, df: pd.DataFrame) -> List[Tuple]:
+        """
+        Insert or update candles, skipping rows whose values are unchanged
+
+        Args:
+            df: Frame with the OHLC_COLUMNS
+
+        Returns:
+            (symbol, interval, first, last, rows, inserted) per symbol and
+            interval actually written, `inserted` counting the new rows
+        """
+        df = df[COLUMNS].drop_duplicates(['symbol', 'interval', 'timestamp'], keep='last')
+        df = df.assign(timestamp=pd.to_datetime(df['timestamp'], utc=True))
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DROP TABLE IF EXISTS incoming")
+                cur.execute("DROP TABLE IF EXISTS changed")
+                self.engine.load_frame(self._con, df)
+                cur.execute(CHANGED_ROWS_QUERY.format(ne=self.engine.not_distinct))
+                cur.execute("""
+                    INSERT OR REPLACE INTO ohlc_data
+                        (symbol, interval, timestamp, open, high, low, close, volume)
+                    SELECT symbol, interval, timestamp, open, high, low, close, volume
+                    FROM changed
+                """)
+                cur.execute("""
+                    SELECT symbol, interval, MIN(timestamp), MAX(timestamp), COUNT(*),
+                        SUM(CAST(inserted AS INTEGER))
+                    FROM changed
+                    GROUP BY symbol, interval
+                """)
+                changes = [(symbol, interval, self.engine.to_datetime(first),
+                            self.engine.to_datetime(last), rows, inserted)
+                           for symbol, interval, first, last, rows, inserted in cur.fetchall()]
+                cur.execute("DROP TABLE incoming")
+                cur.execute("DROP TABLE changed")
+                for symbol in sorted({change[0] for change in changes}):
+                    cur.execute(BUMP_WATERMARK_QUERY, (symbol,))
+                log_changes(cur, changes)
+        return changes
+
+    def close(self) -> None:
+        self._con.close()
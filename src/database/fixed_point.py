@@ -0,0 +1,254 @@
+from typing import List
+
+from src.database.symbol_stats import APPLY_STATS_CHANGES_CTE
+from src.database.watermarks import mark_changed
+
+# Binance never quotes more than 8 decimals
+MAX_SCALE = 8
+# A symbol's scale is chosen from the first values seen for it, leaving this
+# factor of room below the BIGINT limit for later, larger values (rollups
+# into weekly candles sum thousands of volumes). Values outgrowing even
+# that get the symbol rescaled, see rescale_symbols.
+FIXED_POINT_HEADROOM = 10 ** 6
+BIGINT_MAX = 2 ** 63 - 1
+MAX_SCALED_VALUE = BIGINT_MAX // FIXED_POINT_HEADROOM
+
+# Compact alternative to the DECIMAL layout. Prices and volume are stored as
+# BIGINT multiples of 10^-scale, with the scale kept per symbol, and the
+# symbol itself as an integer id. There is no surrogate key, and the fixed
+# width 8 byte columns come first so no alignment padding is needed between
+# them. ohlc_data becomes a view decoding the values back, so readers keep
+# working unchanged.
+FIXED_LAYOUT_QUERY = """
+CREATE TABLE IF NOT EXISTS symbols (
+    id SERIAL PRIMARY KEY,
+    symbol VARCHAR(20) NOT NULL UNIQUE,
+    price_scale SMALLINT NOT NULL,   -- open/high/low/close = value / 10^price_scale
+    volume_scale SMALLINT NOT NULL   -- volume = value / 10^volume_scale
+);
+
+CREATE TABLE IF NOT EXISTS ohlc_fixed (
+    timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+    open BIGINT NOT NULL,
+    high BIGINT NOT NULL,
+    low BIGINT NOT NULL,
+    close BIGINT NOT NULL,
+    volume BIGINT,
+    symbol_id INTEGER NOT NULL REFERENCES symbols (id),
+    interval VARCHAR(4) NOT NULL DEFAULT '1d',
+    PRIMARY KEY (symbol_id, interval, timestamp)
+);
+
+CREATE INDEX IF NOT EXISTS idx_ohlc_fixed_timestamp_brin
+ON ohlc_fixed USING BRIN (timestamp);
+
+CREATE OR REPLACE VIEW ohlc_data AS
+SELECT
+    y.symbol,
+    f.interval,
+    f.timestamp,
+    f.open / (10::FLOAT8 ^ y.price_scale) AS open,
+    f.high / (10::FLOAT8 ^ y.price_scale) AS high,
+    f.low / (10::FLOAT8 ^ y.price_scale) AS low,
+    f.close / (10::FLOAT8 ^ y.price_scale) AS close,
+    f.volume / (10::FLOAT8 ^ y.volume_scale) AS volume
+FROM ohlc_fixed f
+JOIN symbols y ON y.id = f.symbol_id;
+"""
+
+# Largest scale (up to MAX_SCALE decimals) keeping `column` under
+# MAX_SCALED_VALUE
+_SCALE_EXPRESSION = (
+    "LEAST({max_scale}, GREATEST(0, FLOOR(LOG({limit} / GREATEST(MAX({column}), 1)))))::SMALLINT"
+)
+
+# Give symbols seen for the first time in `source` an id and their scales
+REGISTER_SYMBOLS_QUERY = """
+INSERT INTO symbols (symbol, price_scale, volume_scale)
+SELECT
+    symbol,
+    {price_scale},
+    {volume_scale}
+FROM {{source}}
+WHERE symbol NOT IN (SELECT symbol FROM symbols)
+GROUP BY symbol
+ORDER BY symbol
+ON CONFLICT (symbol) DO NOTHING;
+""".format(
+    price_scale=_SCALE_EXPRESSION.format(max_scale=MAX_SCALE, limit=MAX_SCALED_VALUE,
+                                         column='high'),
+    volume_scale=_SCALE_EXPRESSION.format(max_scale=MAX_SCALE, limit=MAX_SCALED_VALUE,
+                                          column='volume')
+)
+
+# Registered symbols whose values in `source` would overflow BIGINT at their
+# scales, with the scales fitting those values (never above the current ones)
+RESCALE_CANDIDATES_QUERY = """
+SELECT
+    y.id,
+    y.symbol,
+    LEAST(y.price_scale, {price_scale}) AS price_scale,
+    LEAST(y.volume_scale, {volume_scale}) AS volume_scale,
+    MAX(s.high) AS max_high,
+    MAX(s.volume) AS max_volume
+FROM {{source}} s
+JOIN symbols y ON y.symbol = s.symbol
+GROUP BY y.id, y.symbol, y.price_scale, y.volume_scale
+HAVING MAX(s.high) * (10::NUMERIC ^ y.price_scale) > {bigint_max}
+OR MAX(s.volume) * (10::NUMERIC ^ y.volume_scale) > {bigint_max};
+""".format(
+    price_scale=_SCALE_EXPRESSION.format(max_scale=MAX_SCALE, limit=MAX_SCALED_VALUE,
+                                         column='s.high'),
+    volume_scale=_SCALE_EXPRESSION.format(max_scale=MAX_SCALE, limit=MAX_SCALED_VALUE,
+                                          column='s.volume'),
+    bigint_max=BIGINT_MAX
+)
+
+# Re-encode a symbol's stored rows at lower scales, then record them
+RESCALE_ROWS_QUERY = """
+UPDATE ohlc_fixed SET
+    open = ROUND(open / (10::NUMERIC ^ (y.price_scale - %(price_scale)s)))::BIGINT,
+    high = ROUND(high / (10::NUMERIC ^ (y.price_scale - %(price_scale)s)))::BIGINT,
+    low = ROUND(low / (10::NUMERIC ^ (y.price_scale - %(price_scale)s)))::BIGINT,
+    close = ROUND(close / (10::NUMERIC ^ (y.price_scale - %(price_scale)s)))::BIGINT,
+    volume = ROUND(volume / (10::NUMERIC ^ (y.volume_scale - %(volume_scale)s)))::BIGINT
+FROM symbols y
+WHERE y.id = ohlc_fixed.symbol_id
+AND y.id = %(id)s;
+
+UPDATE symbols
+SET price_scale = %(price_scale)s, volume_scale = %(volume_scale)s
+WHERE id = %(id)s;
+"""
+
+# Values in the DECIMAL layout encoded for ohlc_fixed, from `source`
+ENCODED_ROWS_QUERY = """
+SELECT
+    y.id AS symbol_id,
+    s.interval,
+    s.timestamp,
+    ROUND(s.open * (10::NUMERIC ^ y.price_scale))::BIGINT AS open,
+    ROUND(s.high * (10::NUMERIC ^ y.price_scale))::BIGINT AS high,
+    ROUND(s.low * (10::NUMERIC ^ y.price_scale))::BIGINT AS low,
+    ROUND(s.close * (10::NUMERIC ^ y.price_scale))::BIGINT AS close,
+    ROUND(s.volume * (10::NUMERIC ^ y.volume_scale))::BIGINT AS volume
+FROM {source} s
+JOIN symbols y ON y.symbol = s.symbol
+"""
+
+# Fixed layout counterpart of MERGE_STAGING_QUERY, with the same result
+# columns and the same symbol_stats maintenance. Volume deltas are computed
+# on the scaled integers and decoded once per symbol.
+MERGE_STAGING_FIXED_QUERY = """
+WITH encoded AS (
+    SELECT DISTINCT ON (symbol_id, interval, timestamp) *
+    FROM (""" + ENCODED_ROWS_QUERY.format(source='ohlc_staging') + """) e
+    ORDER BY symbol_id, interval, timestamp
+),
+previous AS (
+    SELECT o.symbol_id, o.interval, o.timestamp, o.volume
+    FROM ohlc_fixed o
+    JOIN encoded e USING (symbol_id, interval, timestamp)
+),
+merged AS (
+    INSERT INTO ohlc_fixed AS t (timestamp, open, high, low, close, volume, symbol_id, interval)
+    SELECT timestamp, open, high, low, close, volume, symbol_id, interval
+    FROM encoded
+    ON CONFLICT (symbol_id, interval, timestamp)
+    DO UPDATE SET
+        open = EXCLUDED.open,
+        high = EXCLUDED.high,
+        low = EXCLUDED.low,
+        close = EXCLUDED.close,
+        volume = EXCLUDED.volume
+    WHERE (t.open, t.high, t.low, t.close, t.volume)
+        IS DISTINCT FROM
+        (EXCLUDED.open, EXCLUDED.high, EXCLUDED.low, EXCLUDED.close, EXCLUDED.volume)
+    RETURNING t.symbol_id, t.interval, t.timestamp, t.volume, (t.xmax = 0) AS inserted
+),
+changes AS (
+    SELECT
+        y.symbol,
+        m.interval,
+        MIN(m.timestamp) AS first_timestamp,
+        MAX(m.timestamp) AS last_timestamp,
+        COUNT(*) AS changed_rows,
+        COUNT(*) FILTER (WHERE m.inserted) AS new_rows,
+        SUM(COALESCE(m.volume, 0) - COALESCE(p.volume, 0))::NUMERIC
+            / (10::NUMERIC ^ MIN(y.volume_scale)) AS volume_delta
+    FROM merged m
+    LEFT JOIN previous p USING (symbol_id, interval, timestamp)
+    JOIN symbols y ON y.id = m.symbol_id
+    GROUP BY y.symbol, m.interval
+),
+""" + APPLY_STATS_CHANGES_CTE + """
+SELECT symbol, interval, first_timestamp, last_timestamp, changed_rows, new_rows
+FROM changes;
+"""
+
+def is_fixed_layout(cur) -> bool:
+    """Whether ohlc_data is the view over ohlc_fixed"""
+    cur.execute("SELECT to_regclass('ohlc_fixed') IS NOT NULL")
+    return cur.fetchone()[0]
+
+def register_symbols(cur, source: str = 'ohlc_staging') -> None:
+    """
+    Assign ids and scales to the symbols in `source` that have none yet,
+    and rescale those whose new values outgrew their scales
+    """
+    cur.execute(REGISTER_SYMBOLS_QUERY.format(source=source))
+    rescale_symbols(cur, source)
+
+def rescale_symbols(cur, source: str = 'ohlc_staging') -> List[str]:
+    """
+    Lower the scales of registered symbols whose values in `source` would
+    overflow the BIGINT columns, re-encoding their stored rows
+
+    Digits below the new scale are rounded away. Run under the symbols'
+    merge locks (see lock_staged_symbols), before encoding `source`.
+
+    Returns:
+        The symbols rescaled
+
+    Raises:
+        ValueError: A value doesn't fit even without decimals, naming the
+            symbol so the batch can be fixed
+    """
+    cur.execute(RESCALE_CANDIDATES_QUERY.format(source=source))
+    rescaled = []
+    for symbol_id, symbol, price_scale, volume_scale, max_high, max_volume in cur.fetchall():
+        if (max_high * 10 ** price_scale > BIGINT_MAX
+                or (max_volume is not None and max_volume * 10 ** volume_scale > BIGINT_MAX)):
+            raise ValueError(f"{symbol}: high {max_high} or volume {max_volume} overflows the "
+                             f"fixed-point layout's BIGINT columns even at scale 0")
+        cur.execute(RESCALE_ROWS_QUERY, {'id': symbol_id, 'price_scale': price_scale,
+                                         'volume_scale': volume_scale})
+        print(f"Rescaled {symbol} to price scale {price_scale}, volume scale {volume_scale}")
+        rescaled.append(symbol)
+
+    if rescaled:
+        # Stored values lost their lowest digits
+        cur.execute("""
+            SELECT y.symbol, f.interval, MIN(f.timestamp), MAX(f.timestamp)
+            FROM ohlc_fixed f
+            JOIN symbols y ON y.id = f.symbol_id
+            WHERE y.symbol = ANY(%s)
+            GROUP BY y.symbol, f.interval
+        """, (rescaled,))
+        mark_changed(cur, cur.fetchall())
+    return rescaled
+
+def copy_into_fixed(cur, source: str) -> int:
+    """
+    Encode every row of `source`, a table in the DECIMAL layout, into ohlc_fixed
+
+    Returns:
+        Number of rows copied
+    """
+    register_symbols(cur, source)
+    cur.execute(f"""
+        INSERT INTO ohlc_fixed (timestamp, open, high, low, close, volume, symbol_id, interval)
+        SELECT timestamp, open, high, low, close, volume, symbol_id, interval
+        FROM ({ENCODED_ROWS_QUERY.format(source=source)}) e
+    """)
+    return cur.rowcount
@@ -0,0 +1,207 @@
+import argparse
+import json
+import statistics
+from typing import Dict, Optional
+
+from src.database.connection import Database, get_database
+from src.database.create_crypto_database import OHLC_TABLE_QUERY
+from src.database.fixed_point import FIXED_LAYOUT_QUERY, copy_into_fixed
+from src.utils.profiling import instrumented
+
+# Each layout is built in its own schema so both can be called ohlc_data
+NUMERIC_SCHEMA = 'layout_bench_numeric'
+FIXED_SCHEMA = 'layout_bench_fixed'
+
+# Prices spread over several orders of magnitude so symbols get different
+# scales, minute candles from 2020-01-01
+SYNTHETIC_ROWS_QUERY = """
+INSERT INTO ohlc_data (symbol, interval, timestamp, open, high, low, close, volume)
+SELECT
+    'SYM' || s || 'USDT',
+    '1m',
+    to_timestamp(1577836800 + i * 60),
+    p, p * 1.002, p * 0.998, p * 1.001, v
+FROM generate_series(1, %(symbols)s) AS s
+CROSS JOIN generate_series(0, %(candles)s - 1) AS i
+CROSS JOIN LATERAL (
+    SELECT
+        (10 ^ (s %% 6 - 2) * (100 + 10 * sin(i / 500.0)))::NUMERIC(18,8) AS p,
+        (random() * 10 ^ (s %% 5 + 1))::NUMERIC(24,8) AS v
+) x;
+"""
+
+COPY_ROWS_QUERY = """
+INSERT INTO ohlc_data (symbol, interval, timestamp, open, high, low, close, volume)
+SELECT symbol, interval, timestamp, open, high, low, close, volume
+FROM public.ohlc_data;
+"""
+
+# Run against both layouts through ohlc_data, i.e. through the decoding
+# view for the fixed-point one
+SCAN_QUERIES = {
+    'full_aggregate': """
+        SELECT symbol, AVG(close), MAX(high), MIN(low), SUM(volume)
+        FROM ohlc_data
+        GROUP BY symbol
+    """,
+    'symbol_range': """
+        SELECT timestamp, open, high, low, close, volume
+        FROM ohlc_data
+        WHERE symbol = %(symbol)s AND interval = %(interval)s
+        ORDER BY timestamp
+    """
+}
+
+# The same aggregate on the stored integers, decoded once per symbol
+FIXED_RAW_QUERIES = {
+    'full_aggregate_raw': """
+        SELECT y.symbol,
+            AVG(f.close) / 10 ^ MIN(y.price_scale),
+            MAX(f.high) / 10 ^ MIN(y.price_scale),
+            MIN(f.low) / 10 ^ MIN(y.price_scale),
+            SUM(f.volume) / 10 ^ MIN(y.volume_scale)
+        FROM ohlc_fixed f
+        JOIN symbols y ON y.id = f.symbol_id
+        GROUP BY y.symbol
+    """
+}
+
+SIZE_QUERY = """
+SELECT
+    pg_relation_size(%(table)s::regclass),
+    pg_indexes_size(%(table)s::regclass),
+    pg_total_relation_size(%(table)s::regclass)
+"""
+
+class LayoutBenchmark:
+    """
+    Compares the DECIMAL and fixed-point layouts on the same rows
+
+    Both layouts are filled in scratch schemas, either with synthetic
+    minute candles or with a copy of the current ohlc_data, then measured
+    for on-disk size and for the execution time (EXPLAIN ANALYZE, median of
+    `repeat` runs after a warm-up) of the SCAN_QUERIES.
+    """
+
+    def __init__(self, db: Optional[Database] = None, repeat: int = 5):
+        self.db = db or get_database()
+        self.repeat = repeat
+
+    def setup(self, symbols: int = 20, candles: int = 50000, from_data: bool = False) -> int:
+        """Build both layouts, returning the number of rows in each"""
+        with self.db.cursor() as cur:
+            for schema in (NUMERIC_SCHEMA, FIXED_SCHEMA):
+                cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+                cur.execute(f"CREATE SCHEMA {schema}")
+
+            cur.execute(f"SET LOCAL search_path TO {NUMERIC_SCHEMA}, public")
+            cur.execute(OHLC_TABLE_QUERY)
+            if from_data:
+                cur.execute(COPY_ROWS_QUERY)
+            else:
+                cur.execute(SYNTHETIC_ROWS_QUERY, {'symbols': symbols, 'candles': candles})
+            rows = cur.rowcount
+
+            cur.execute(f"SET LOCAL search_path TO {FIXED_SCHEMA}, public")
+            cur.execute(FIXED_LAYOUT_QUERY)
+            copy_into_fixed(cur, f"{NUMERIC_SCHEMA}.ohlc_data")
+
+            cur.execute(f"ANALYZE {NUMERIC_SCHEMA}.ohlc_data")
+            cur.execute(f"ANALYZE {FIXED_SCHEMA}.ohlc_fixed")
+            cur.execute(f"ANALYZE {FIXED_SCHEMA}.symbols")
+        return rows
+
+    def teardown(self) -> None:
+        with self.db.cursor() as cur:
+            for schema in (NUMERIC_SCHEMA, FIXED_SCHEMA):
+                cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+
+    def sizes(self, table: str) -> Dict[str, int]:
+        with self.db.cursor() as cur:
+            cur.execute(SIZE_QUERY, {'table': table})
+            heap, indexes, total = cur.fetchone()
+        return {'heap_bytes': heap, 'index_bytes': indexes, 'total_bytes': total}
+
+    def time_query(self, schema: str, query: str, params: Dict) -> float:
+        """Median execution time in ms of `query` within `schema`"""
+        timings = []
+        for run in range(self.repeat + 1):
+            with self.db.cursor() as cur:
+                cur.execute(f"SET LOCAL search_path TO {schema}, public")
+                cur.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {query}", params)
+                plan = cur.fetchone()[0]
+            # The first run only warms the cache
+            if run:
+                timings.append(plan[0]['Execution Time'])
+        return statistics.median(timings)
+
+    def _sample_series(self) -> Dict:
+        with self.db.cursor() as cur:
+            cur.execute(f"SELECT symbol, interval FROM {NUMERIC_SCHEMA}.ohlc_data LIMIT 1")
+            row = cur.fetchone()
+        return {'symbol': row[0], 'interval': row[1]} if row else {'symbol': '', 'interval': ''}
+
+    def run(self, symbols: int = 20, candles: int = 50000, from_data: bool = False,
+            keep: bool = False) -> Dict:
+        """
+        Build, measure and (unless `keep`) drop both layouts
+
+        Returns:
+            Row count, then sizes and query timings (ms) per layout
+        """
+        try:
+            rows = self.setup(symbols, candles, from_data)
+            params = self._sample_series()
+            results = {
+                'rows': rows,
+                'numeric': {
+                    **self.sizes(f"{NUMERIC_SCHEMA}.ohlc_data"),
+                    **{name: self.time_query(NUMERIC_SCHEMA, query, params)
+                       for name, query in SCAN_QUERIES.items()}
+                },
+                'fixed': {
+                    **self.sizes(f"{FIXED_SCHEMA}.ohlc_fixed"),
+                    **{name: self.time_query(FIXED_SCHEMA, query, params)
+                       for name, query in {**SCAN_QUERIES, **FIXED_RAW_QUERIES}.items()}
+                }
+            }
+        finally:
+            if not keep:
+                self.teardown()
+        return results
+
+def print_results(results: Dict) -> None:
+    numeric, fixed = results['numeric'], results['fixed']
+    print(f"\n{results['rows']} rows per layout\n")
+    print(f"{'':<20} {'numeric':>14} {'fixed':>14} {'ratio':>7}")
+    for key in ('heap_bytes', 'index_bytes', 'total_bytes'):
+        ratio = fixed[key] / numeric[key] if numeric[key] else 0
+        print(f"{key:<20} {numeric[key] / 2**20:>11.1f} MB {fixed[key] / 2**20:>11.1f} MB "
+              f"{ratio:>7.2f}")
+    for name in SCAN_QUERIES:
+        ratio = fixed[name] / numeric[name] if numeric[name] else 0
+        print(f"{name:<20} {numeric[name]:>11.1f} ms {fixed[name]:>11.1f} ms {ratio:>7.2f}")
+    for name in FIXED_RAW_QUERIES:
+        print(f"{name:<20} {'':>14} {fixed[name]:>11.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the DECIMAL and fixed-point layouts")
+    parser.add_argument('--symbols', type=int, default=20, help="Synthetic symbols")
+    parser.add_argument('--candles', type=int, default=50000, help="Synthetic candles per symbol")
+    parser.add_argument('--from-data', action='store_true',
+                        help="Copy the current ohlc_data instead of generating rows")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--keep', action='store_true', help="Keep the scratch schemas")
+    parser.add_argument('--json', help="Also write the results to this file")
+    args = parser.parse_args()
+
+    results = LayoutBenchmark(repeat=args.repeat).run(args.symbols, args.candles,
+                                                      args.from_data, args.keep)
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    with instrumented():
+        main()
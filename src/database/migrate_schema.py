@@ -0,0 +1,186 @@
+import argparse
+
+import pytz
+
+from src.data.intervals import interval_to_ms
+from src.database.connection import get_database
+from src.database.create_crypto_database import PARTITIONED_OHLC_TABLE_QUERY
+from src.database.fixed_point import FIXED_LAYOUT_QUERY, copy_into_fixed, is_fixed_layout
+from src.database.partitions import (ensure_partitions, has_column, is_partitioned, month_index,
+                                     month_start)
+from src.database.symbol_stats import ensure_symbol_stats_table
+from src.database.watermarks import ensure_watermark_table, mark_changed, series_ranges
+from src.utils.profiling import instrumented
+
+LEGACY_TABLE = 'ohlc_data_legacy'
+
+def add_interval_column(cur, interval: str) -> None:
+    """
+    Make an existing, unpartitioned ohlc_data interval aware in place
+
+    Existing rows get `interval`, and the uniqueness moves from
+    (symbol, timestamp) to (symbol, interval, timestamp). The redundant
+    idx_symbol_timestamp index is dropped since the unique constraint covers it.
+    """
+    cur.execute(f"""
+        ALTER TABLE ohlc_data
+        ADD COLUMN IF NOT EXISTS interval VARCHAR(4) NOT NULL DEFAULT '{interval}'
+    """)
+    cur.execute("ALTER TABLE ohlc_data ALTER COLUMN interval SET DEFAULT '1d'")
+    cur.execute("ALTER TABLE ohlc_data DROP CONSTRAINT IF EXISTS ohlc_data_symbol_timestamp_key")
+    cur.execute("DROP INDEX IF EXISTS idx_symbol_timestamp")
+    cur.execute("""
+        ALTER TABLE ohlc_data
+        ADD CONSTRAINT ohlc_data_symbol_interval_timestamp_key
+        UNIQUE (symbol, interval, timestamp)
+    """)
+
+def rename_to_legacy(cur) -> None:
+    """Move ohlc_data out of the way as LEGACY_TABLE"""
+    cur.execute(f"ALTER TABLE ohlc_data RENAME TO {LEGACY_TABLE}")
+    # Constraint and index names stay behind with the old table and would
+    # clash with the ones the new table creates
+    cur.execute("SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass",
+                (LEGACY_TABLE,))
+    for (name,) in cur.fetchall():
+        cur.execute(f"ALTER TABLE {LEGACY_TABLE} RENAME CONSTRAINT {name} TO {name}_legacy")
+    for index in ('idx_timestamp', 'idx_symbol_timestamp'):
+        cur.execute(f"ALTER INDEX IF EXISTS {index} RENAME TO {index}_legacy")
+
+def migrate_to_partitioned(cur, interval: str, keep_legacy: bool = False) -> int:
+    """
+    Move ohlc_data into the monthly partitioned layout
+
+    The current table is renamed, the partitioned table is created in its
+    place and the rows are copied over one month at a time, so each INSERT
+    only touches a single partition.
+
+    Returns:
+        Number of rows migrated
+    """
+    interval_aware = has_column(cur, 'interval')
+
+    rename_to_legacy(cur)
+    cur.execute(PARTITIONED_OHLC_TABLE_QUERY)
+
+    cur.execute(f"SELECT MIN(timestamp), MAX(timestamp) FROM {LEGACY_TABLE}")
+    first, last = cur.fetchone()
+    # Returned in the session time zone, partitions are cut by UTC month
+    months = [] if first is None else list(range(month_index(first.astimezone(pytz.UTC)),
+                                                 month_index(last.astimezone(pytz.UTC)) + 1))
+    ensure_partitions(cur, months)
+
+    interval_expr = 'interval' if interval_aware else cur.mogrify('%s', (interval,)).decode()
+    migrated = 0
+    for index in months:
+        cur.execute(f"""
+            INSERT INTO ohlc_data
+                (symbol, interval, timestamp, open, high, low, close, volume, created_at)
+            SELECT symbol, {interval_expr}, timestamp, open, high, low, close, volume, created_at
+            FROM {LEGACY_TABLE}
+            WHERE timestamp >= %s AND timestamp < %s
+        """, (month_start(index), month_start(index + 1)))
+        migrated += cur.rowcount
+
+    cur.execute(f"SELECT COUNT(*) FROM {LEGACY_TABLE}")
+    expected = cur.fetchone()[0]
+    if migrated != expected:
+        raise RuntimeError(f"Migrated {migrated} rows but {LEGACY_TABLE} holds {expected}")
+
+    if not keep_legacy:
+        cur.execute(f"DROP TABLE {LEGACY_TABLE}")
+    return migrated
+
+def migrate_to_fixed(cur, keep_legacy: bool = False) -> int:
+    """
+    Move an interval aware ohlc_data table into the fixed-point layout
+
+    The table is renamed, ohlc_fixed and the ohlc_data view are created in
+    its place and every row is encoded with its symbol's scale.
+
+    Returns:
+        Number of rows migrated
+    """
+    rename_to_legacy(cur)
+    cur.execute(FIXED_LAYOUT_QUERY)
+    migrated = copy_into_fixed(cur, LEGACY_TABLE)
+
+    cur.execute(f"SELECT COUNT(*) FROM {LEGACY_TABLE}")
+    expected = cur.fetchone()[0]
+    if migrated != expected:
+        raise RuntimeError(f"Migrated {migrated} rows but {LEGACY_TABLE} holds {expected}")
+
+    if not keep_legacy:
+        cur.execute(f"DROP TABLE {LEGACY_TABLE}")
+    return migrated
+
+def migrate(partitioned: bool = False, interval: str = '1d', keep_legacy: bool = False,
+            fixed: bool = False) -> None:
+    """
+    Bring an existing ohlc_data table up to the interval aware schema
+
+    Runs in a single transaction, a failure leaves the old table untouched.
+    Every series rewritten gets its watermark bumped and its full range
+    logged, so caches and consumers of the change log reload it.
+
+    Args:
+        partitioned: Also convert to the monthly partitioned layout
+        interval: Interval of the rows already stored
+        keep_legacy: Keep the old table as ohlc_data_legacy after copying
+        fixed: Also convert to the fixed-point layout
+    """
+    interval_to_ms(interval)  # Rejects anything that isn't a known interval
+    if partitioned and fixed:
+        raise ValueError("The fixed-point layout cannot be partitioned")
+
+    db = get_database()
+    with db.cursor() as cur:
+        ensure_watermark_table(cur)
+        changed = True
+        if is_fixed_layout(cur):
+            print("ohlc_data already uses the fixed-point layout")
+            changed = False
+        elif fixed:
+            if not has_column(cur, 'interval'):
+                add_interval_column(cur, interval)
+            migrated = migrate_to_fixed(cur, keep_legacy)
+            print(f"Migrated {migrated} rows into ohlc_fixed")
+        elif partitioned:
+            if is_partitioned(cur):
+                print("ohlc_data is already partitioned")
+                changed = False
+            else:
+                migrated = migrate_to_partitioned(cur, interval, keep_legacy)
+                print(f"Migrated {migrated} rows into partitioned ohlc_data")
+        else:
+            if has_column(cur, 'interval'):
+                print("ohlc_data already has an interval column")
+                changed = False
+            else:
+                add_interval_column(cur, interval)
+                print(f"Added interval column, existing rows marked as '{interval}'")
+
+        if changed:
+            mark_changed(cur, series_ranges(cur))
+
+        if ensure_symbol_stats_table(cur):
+            print("Built symbol_stats from the existing rows")
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate ohlc_data to the interval aware schema")
+    layout = parser.add_mutually_exclusive_group()
+    layout.add_argument('--partitioned', action='store_true',
+                        help="Convert to monthly range partitions with a BRIN index")
+    layout.add_argument('--fixed', action='store_true',
+                        help="Convert to the fixed-point BIGINT layout")
+    parser.add_argument('--interval', default='1d',
+                        help="Interval of the existing rows (default: 1d)")
+    parser.add_argument('--keep-legacy', action='store_true',
+                        help=f"Keep the old table as {LEGACY_TABLE}")
+    args = parser.parse_args()
+
+    migrate(args.partitioned, args.interval, args.keep_legacy, args.fixed)
+
+if __name__ == "__main__":
+    with instrumented():
+        main()
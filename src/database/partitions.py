@@ -0,0 +1,118 @@
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+import pytz
+
+from src.database.watermarks import mark_changed, series_ranges
+
+# Serialises partition creation between concurrent writers
+PARTITION_LOCK_KEY = 'ohlc_data_partitions'
+
+def month_index(ts: datetime) -> int:
+    """Months since year 0, used to identify a monthly partition"""
+    return ts.year * 12 + ts.month - 1
+
+def month_start(index: int) -> datetime:
+    """First instant (UTC) of the month identified by `index`"""
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=pytz.UTC)
+
+def partition_name(index: int, table: str = 'ohlc_data') -> str:
+    start = month_start(index)
+    return f"{table}_y{start.year}m{start.month:02d}"
+
+def partition_month(name: str, table: str = 'ohlc_data') -> Optional[int]:
+    """Month index of a partition created by ensure_partitions, None for others"""
+    prefix = f"{table}_y"
+    if not name.startswith(prefix):
+        return None
+    year, month = name[len(prefix):].split('m')
+    return int(year) * 12 + int(month) - 1
+
+def is_partitioned(cur, table: str = 'ohlc_data') -> bool:
+    """Whether `table`, as resolved through the search_path, is declaratively partitioned"""
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    row = cur.fetchone()
+    return row is not None and row[0] == 'p'
+
+def has_column(cur, column: str, table: str = 'ohlc_data') -> bool:
+    cur.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema()
+        AND table_name = %s AND column_name = %s
+    """, (table, column))
+    return cur.fetchone() is not None
+
+def existing_partitions(cur, table: str = 'ohlc_data') -> List[str]:
+    """Names of the partitions currently attached to `table`"""
+    cur.execute("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.oid = to_regclass(%s)
+        ORDER BY child.relname
+    """, (table,))
+    return [row[0] for row in cur.fetchall()]
+
+def ensure_partitions(cur, months: Iterable[int], table: str = 'ohlc_data') -> List[str]:
+    """
+    Create the monthly partitions for `months` that don't exist yet
+
+    Args:
+        cur: Cursor inside the writing transaction
+        months: Month indexes, see month_index
+        table: Partitioned parent table
+
+    Returns:
+        Names of the partitions created
+    """
+    months = sorted(set(months))
+    if not months:
+        return []
+
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (PARTITION_LOCK_KEY,))
+    existing = set(existing_partitions(cur, table))
+
+    created = []
+    for index in months:
+        name = partition_name(index, table)
+        if name in existing:
+            continue
+        cur.execute(
+            f"CREATE TABLE {name} PARTITION OF {table} "
+            f"FOR VALUES FROM (%s) TO (%s)",
+            (month_start(index), month_start(index + 1))
+        )
+        created.append(name)
+    return created
+
+def drop_partitions_before(cur, cutoff: datetime, table: str = 'ohlc_data') -> List[str]:
+    """
+    Drop every monthly partition that ends on or before `cutoff`
+
+    Retention then costs one catalog operation per month instead of a
+    DELETE over the rows. The watermarks of the symbols losing candles are
+    bumped and the dropped ranges logged, so caches and consumers of the
+    change log notice. symbol_stats does not see the dropped rows, so run
+    rebuild_symbol_stats in the same transaction afterwards.
+    """
+    if cutoff.tzinfo is None:
+        cutoff = pytz.UTC.localize(cutoff)
+
+    dropped = []
+    ranges = {}
+    for name in existing_partitions(cur, table):
+        index = partition_month(name, table)
+        if index is None:
+            continue
+        if month_start(index + 1) <= cutoff:
+            for symbol, interval, first, last in series_ranges(cur, name):
+                known = ranges.get((symbol, interval))
+                if known is not None:
+                    first, last = min(first, known[0]), max(last, known[1])
+                ranges[(symbol, interval)] = (first, last)
+            cur.execute(f"DROP TABLE {name}")
+            dropped.append(name)
+    mark_changed(cur, [(symbol, interval, first, last)
+                       for (symbol, interval), (first, last) in sorted(ranges.items())])
+    return dropped
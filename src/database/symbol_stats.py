@@ -0,0 +1,102 @@
+import argparse
+
+from src.database.connection import get_database
+from src.database.watermarks import bump_watermarks, ensure_watermark_table
+from src.utils.profiling import instrumented
+
+# Per symbol and interval summary kept up to date by the ingest merge (see
+# MERGE_STAGING_QUERY), so statistics cost O(symbols) instead of O(rows)
+SYMBOL_STATS_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS symbol_stats (
+    symbol VARCHAR(20) NOT NULL,
+    interval VARCHAR(4) NOT NULL,
+    record_count BIGINT NOT NULL DEFAULT 0,
+    first_timestamp TIMESTAMP WITH TIME ZONE,
+    last_timestamp TIMESTAMP WITH TIME ZONE,
+    volume_sum DECIMAL(38,8) NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (symbol, interval)
+);
+"""
+
+# Final CTE of the staging merges: applies their `changes` CTE (new_rows,
+# first/last_timestamp and volume_delta per symbol and interval)
+APPLY_STATS_CHANGES_CTE = """
+stats AS (
+    INSERT INTO symbol_stats AS st
+        (symbol, interval, record_count, first_timestamp, last_timestamp, volume_sum)
+    SELECT symbol, interval, new_rows, first_timestamp, last_timestamp, volume_delta
+    FROM changes
+    ON CONFLICT (symbol, interval)
+    DO UPDATE SET
+        record_count = st.record_count + EXCLUDED.record_count,
+        first_timestamp = LEAST(st.first_timestamp, EXCLUDED.first_timestamp),
+        last_timestamp = GREATEST(st.last_timestamp, EXCLUDED.last_timestamp),
+        volume_sum = st.volume_sum + EXCLUDED.volume_sum,
+        updated_at = CURRENT_TIMESTAMP
+)
+"""
+
+REBUILD_SYMBOL_STATS_QUERY = """
+DELETE FROM symbol_stats;
+
+INSERT INTO symbol_stats
+    (symbol, interval, record_count, first_timestamp, last_timestamp, volume_sum)
+SELECT
+    symbol,
+    interval,
+    COUNT(*),
+    MIN(timestamp),
+    MAX(timestamp),
+    COALESCE(SUM(volume), 0)
+FROM ohlc_data
+GROUP BY symbol, interval;
+"""
+
+def ensure_symbol_stats_table(cur) -> bool:
+    """
+    Create symbol_stats if needed, filling it from ohlc_data when created
+
+    Returns:
+        Whether the table had to be created
+    """
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext('symbol_stats'))")
+    cur.execute("SELECT to_regclass('symbol_stats') IS NULL")
+    if not cur.fetchone()[0]:
+        return False
+    cur.execute(SYMBOL_STATS_TABLE_QUERY)
+    cur.execute(REBUILD_SYMBOL_STATS_QUERY)
+    return True
+
+def rebuild_symbol_stats(cur) -> None:
+    """
+    Recompute symbol_stats from ohlc_data with one full scan
+
+    Needed after rows are removed outside the ingest path, e.g. when old
+    partitions are dropped for retention. Every symbol's watermark is
+    bumped, so statistics cached against it are recomputed.
+    """
+    cur.execute(SYMBOL_STATS_TABLE_QUERY)
+    cur.execute(REBUILD_SYMBOL_STATS_QUERY)
+    cur.execute("SELECT DISTINCT symbol FROM symbol_stats")
+    ensure_watermark_table(cur)
+    bump_watermarks(cur, [symbol for (symbol,) in cur.fetchall()])
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the symbol_stats summary table")
+    parser.add_argument('--rebuild', action='store_true',
+                        help="Recompute every row from ohlc_data")
+    args = parser.parse_args()
+
+    with get_database().cursor() as cur:
+        if args.rebuild:
+            rebuild_symbol_stats(cur)
+            print("symbol_stats rebuilt")
+        elif ensure_symbol_stats_table(cur):
+            print("symbol_stats created")
+        else:
+            print("symbol_stats already exists")
+
+if __name__ == "__main__":
+    with instrumented():
+        main()
@@ -0,0 +1,266 @@
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# A per-symbol counter bumped by every write that changes the symbol's
+# candles. Readers compare versions to know whether cached results are stale.
+WATERMARK_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS ingest_watermarks (
+    symbol VARCHAR(20) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+BUMP_WATERMARKS_QUERY = """
+INSERT INTO ingest_watermarks AS w (symbol, version, updated_at)
+SELECT symbol, 1, CURRENT_TIMESTAMP
+FROM unnest(%s::varchar[]) AS symbol
+ON CONFLICT (symbol)
+DO UPDATE SET
+    version = w.version + 1,
+    updated_at = EXCLUDED.updated_at;
+"""
+
+# The candle range each write changed, under the version it bumped the
+# symbol to, so consumers can catch up on exactly what changed since a
+# version they processed (see src.utils.delta_export). Plain types only,
+# embedded backends create it too.
+CHANGE_LOG_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS ingest_changes (
+    symbol VARCHAR(20) NOT NULL,
+    version BIGINT NOT NULL,
+    interval VARCHAR(4) NOT NULL,
+    first_timestamp TIMESTAMPTZ NOT NULL,
+    last_timestamp TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (symbol, version, interval)
+)
+"""
+
+# The version each consumer of the log has processed per series. The log of
+# a series is pruned up to the lowest of them, see prune_change_log.
+CHANGE_CONSUMERS_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS ingest_change_consumers (
+    consumer VARCHAR(255) NOT NULL,
+    symbol VARCHAR(20) NOT NULL,
+    interval VARCHAR(4) NOT NULL,
+    version BIGINT NOT NULL,
+    PRIMARY KEY (consumer, symbol, interval)
+)
+"""
+
+# Versions up to pruned_through are gone from the log of a series
+CHANGE_HORIZON_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS ingest_change_horizon (
+    symbol VARCHAR(20) NOT NULL,
+    interval VARCHAR(4) NOT NULL,
+    pruned_through BIGINT NOT NULL,
+    PRIMARY KEY (symbol, interval)
+)
+"""
+
+CHANGE_LOG_TABLE_QUERIES = [
+    CHANGE_LOG_TABLE_QUERY,
+    CHANGE_CONSUMERS_TABLE_QUERY,
+    CHANGE_HORIZON_TABLE_QUERY,
+]
+
+# Only series some consumer reads are logged ...
+LOG_CHANGE_QUERY = """
+INSERT INTO ingest_changes (symbol, version, interval, first_timestamp, last_timestamp)
+SELECT symbol, version, %s, %s, %s
+FROM ingest_watermarks w
+WHERE symbol = %s
+AND EXISTS (
+    SELECT 1 FROM ingest_change_consumers c
+    WHERE c.symbol = w.symbol AND c.interval = %s
+)
+"""
+
+# ... for the others the horizon moves to the new version instead, so a
+# consumer registering later with an older version reloads in full
+SKIP_CHANGE_QUERY = """
+INSERT INTO ingest_change_horizon (symbol, interval, pruned_through)
+SELECT symbol, %s, version
+FROM ingest_watermarks w
+WHERE symbol = %s
+AND NOT EXISTS (
+    SELECT 1 FROM ingest_change_consumers c
+    WHERE c.symbol = w.symbol AND c.interval = %s
+)
+ON CONFLICT (symbol, interval)
+DO UPDATE SET pruned_through = EXCLUDED.pruned_through
+"""
+
+ACK_CHANGES_QUERY = """
+INSERT INTO ingest_change_consumers (consumer, symbol, interval, version)
+VALUES (%s, %s, %s, %s)
+ON CONFLICT (consumer, symbol, interval)
+DO UPDATE SET version = EXCLUDED.version
+"""
+
+# The horizon only moves forward. WHERE true lets SQLite parse the upsert.
+ADVANCE_HORIZON_QUERY = """
+INSERT INTO ingest_change_horizon (symbol, interval, pruned_through)
+SELECT symbol, interval, MIN(version)
+FROM ingest_change_consumers
+WHERE true
+GROUP BY symbol, interval
+ON CONFLICT (symbol, interval)
+DO UPDATE SET pruned_through = CASE
+    WHEN EXCLUDED.pruned_through > ingest_change_horizon.pruned_through
+    THEN EXCLUDED.pruned_through
+    ELSE ingest_change_horizon.pruned_through
+END
+"""
+
+PRUNE_CHANGES_QUERY = """
+DELETE FROM ingest_changes
+WHERE version <= (
+    SELECT h.pruned_through
+    FROM ingest_change_horizon h
+    WHERE h.symbol = ingest_changes.symbol
+    AND h.interval = ingest_changes.interval
+)
+"""
+
+def ensure_watermark_table(cur) -> None:
+    cur.execute(WATERMARK_TABLE_QUERY)
+    for query in CHANGE_LOG_TABLE_QUERIES:
+        cur.execute(query)
+
+def bump_watermarks(cur, symbols: Iterable[str]) -> None:
+    """Mark `symbols` as changed, inside the transaction that changed them"""
+    symbols = sorted(set(symbols))
+    if symbols:
+        cur.execute(BUMP_WATERMARKS_QUERY, (symbols,))
+
+def log_changes(cur, changes: Iterable[Tuple]) -> None:
+    """
+    Record the ranges a write changed, after bump_watermarks in the same
+    transaction
+
+    Series without a registered consumer (see ack_changes) are not logged,
+    their horizon just moves past the write, so the log only grows for
+    series something reads it for.
+
+    Args:
+        changes: (symbol, interval, first, last, ...) per symbol and
+            interval, e.g. the ChangedRanges of a store_data call
+    """
+    changes = [(symbol, interval, first, last) for symbol, interval, first, last, *_ in changes]
+    if changes:
+        cur.executemany(LOG_CHANGE_QUERY, [(interval, first, last, symbol, interval)
+                                           for symbol, interval, first, last in changes])
+        cur.executemany(SKIP_CHANGE_QUERY, [(interval, symbol, interval)
+                                            for symbol, interval, _, _ in changes])
+
+def series_ranges(cur, table: str = 'ohlc_data') -> List[Tuple]:
+    """(symbol, interval, first, last) of every series stored in `table`"""
+    cur.execute(f"""
+        SELECT symbol, interval, MIN(timestamp), MAX(timestamp)
+        FROM {table}
+        GROUP BY symbol, interval
+    """)
+    return cur.fetchall()
+
+def mark_changed(cur, changes: Iterable[Tuple]) -> None:
+    """
+    Bump and log candles changed outside the ingest path (retention drops,
+    migrations), in the transaction that changed them
+
+    Args:
+        changes: (symbol, interval, first, last), at most one per series
+    """
+    changes = list(changes)
+    if changes:
+        ensure_watermark_table(cur)
+        bump_watermarks(cur, [change[0] for change in changes])
+        log_changes(cur, changes)
+
+def get_changes(cur, symbol: str, interval: str,
+                since_version: int) -> Optional[List[Tuple]]:
+    """
+    (first, last) of every range of a series changed after `since_version`
+
+    Returns:
+        The ranges ordered by first, or None when the log has been pruned
+        past `since_version` and can no longer tell what changed; the
+        caller then has to reload the series in full
+    """
+    cur.execute("""
+        SELECT pruned_through FROM ingest_change_horizon
+        WHERE symbol = %s AND interval = %s
+    """, (symbol, interval))
+    horizon = cur.fetchone()
+    if horizon is not None and since_version < horizon[0]:
+        return None
+    cur.execute("""
+        SELECT first_timestamp, last_timestamp FROM ingest_changes
+        WHERE symbol = %s AND interval = %s AND version > %s
+        ORDER BY first_timestamp
+    """, (symbol, interval, since_version))
+    return cur.fetchall()
+
+def merge_ranges(ranges: List[Tuple[datetime, datetime]],
+                 gap: timedelta = timedelta(0)) -> List[Tuple[datetime, datetime]]:
+    """
+    (first, last) ranges, sorted by first, merged into disjoint ones
+
+    Ranges overlapping or at most `gap` apart are merged, so the
+    back-to-back single-candle ranges a streamed series logs become one.
+    """
+    merged = []
+    for first, last in ranges:
+        if merged and first <= merged[-1][1] + gap:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+def ack_changes(cur, consumer: str, interval: str, versions: Dict[str, int]) -> None:
+    """
+    Record that `consumer` has processed its series up to `versions`
+
+    Args:
+        consumer: Stable name of the consumer, e.g. 'delta:<output dir>'
+        interval: Interval of the series
+        versions: Processed watermark version per symbol
+    """
+    rows = [(consumer, symbol, interval, version) for symbol, version in versions.items()]
+    if rows:
+        cur.executemany(ACK_CHANGES_QUERY, rows)
+
+def drop_consumer(cur, consumer: str) -> None:
+    """Stop holding back the pruning of the log for a retired consumer"""
+    cur.execute("DELETE FROM ingest_change_consumers WHERE consumer = %s", (consumer,))
+
+def prune_change_log(cur) -> None:
+    """
+    Drop the log entries every registered consumer has processed
+
+    Each series keeps the entries after the lowest version its consumers
+    acknowledged (series without consumers aren't logged, see log_changes).
+    The pruned through version is recorded, so a consumer that falls behind
+    it (or joins later with an old version) gets None from get_changes and
+    reloads instead of missing changes.
+    """
+    cur.execute(ADVANCE_HORIZON_QUERY)
+    cur.execute(PRUNE_CHANGES_QUERY)
+
+def get_watermarks(cur, symbols: Iterable[str]) -> Dict[str, int]:
+    """Current version per symbol, 0 for symbols never written"""
+    symbols = list(symbols)
+    if not symbols:
+        return {}
+    # An IN list rather than ANY(array) so embedded backends can run it too
+    placeholders = ', '.join(['%s'] * len(symbols))
+    cur.execute(f"SELECT symbol, version FROM ingest_watermarks WHERE symbol IN ({placeholders})",
+                symbols)
+    versions = dict(cur.fetchall())
+    return {symbol: versions.get(symbol, 0) for symbol in symbols}
+
+def get_global_watermark(cur) -> Tuple[int, int]:
+    """(symbols, summed versions), which changes whenever any symbol is written"""
+    cur.execute("SELECT COUNT(*), COALESCE(SUM(version), 0) FROM ingest_watermarks")
+    count, total = cur.fetchone()
+    return int(count), int(total)
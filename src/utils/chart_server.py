@@ -0,0 +1,146 @@
+import argparse
+import json
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+from urllib.parse import parse_qs, urlparse
+
+from src.utils.downsample import MAX_POINTS, RangeDownsampler
+from src.utils.profiling import instrumented
+from src.utils.view_crypto_data import CryptoDataViewer
+
+class ChartServer:
+    """
+    JSON endpoint serving chart-sized range queries from a background thread
+
+    GET /ohlc?symbol=BTCUSDT&interval=1m&start=2020-01-01&end=2024-01-01&points=1500
+        Bucketed candles as {"t": [...], "o": [...], "h": [...], "l": [...],
+        "c": [...], "v": [...]} with t the bucket open time in epoch ms
+    GET /close?...same parameters...
+        LTTB downsampled closes as {"t": [...], "c": [...]}
+    GET /symbols
+        {"symbols": [...]}
+
+    start and end are epoch ms or 'YYYY-MM-DD[ HH:MM:SS]' UTC, end defaults
+    to the latest stored candle and points to 1500. Responses go through the viewer's query
+    cache, so repeated requests for an unchanged symbol are served from
+    memory.
+
+    Usage:
+        server = ChartServer(CryptoDataViewer(), port=8767).start()
+    """
+
+    def __init__(self, viewer: CryptoDataViewer, host: str = '127.0.0.1', port: int = 8767):
+        self.viewer = viewer
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                try:
+                    status, body = server.handle(url.path, query)
+                except ValueError as e:
+                    status, body = 400, {'error': str(e)}
+                except Exception as e:
+                    print(f"Error serving {self.path}: {str(e)}")
+                    status, body = 500, {'error': 'Internal error'}
+                server._send(self, status, body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def handle(self, path: str, query: Dict):
+        """Status and JSON body of a request"""
+        if path == '/symbols':
+            return 200, {'symbols': self.viewer.get_available_symbols()}
+        if path not in ('/ohlc', '/close'):
+            return 404, {'error': f"Unknown path: {path}"}
+
+        if 'symbol' not in query or 'start' not in query:
+            raise ValueError("symbol and start are required")
+        symbol = query['symbol'].upper()
+        interval = query.get('interval', '1m')
+        start = _parse_time(query['start'])
+        end = _parse_time(query['end']) if 'end' in query else None
+        try:
+            points = int(query.get('points', 1500))
+        except ValueError:
+            raise ValueError(f"points must be an integer up to {MAX_POINTS}")
+
+        if path == '/ohlc':
+            df = self.viewer.get_bucketed_ohlc(symbol, start, end, interval, points)
+            return 200, {
+                't': df['bucket_ms'].astype('int64').tolist(),
+                **{column[0]: _floats(df[column])
+                   for column in ('open', 'high', 'low', 'close', 'volume')},
+            }
+        df = self.viewer.get_downsampled_close(symbol, start, end, interval, points)
+        return 200, {'t': df['ts_ms'].astype('int64').tolist(), 'c': _floats(df['close'])}
+
+    def _send(self, handler: BaseHTTPRequestHandler, status: int, body) -> None:
+        payload = json.dumps(body, separators=(',', ':')).encode()
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(payload)))
+        handler.send_header('Access-Control-Allow-Origin', '*')
+        handler.end_headers()
+        handler.wfile.write(payload)
+
+    def start(self) -> 'ChartServer':
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        print(f"Serving charts on {self.url}")
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+def _parse_time(value: str):
+    """Epoch ms, or a date string left for to_ms to parse"""
+    return int(value) if value.isdigit() else value
+
+def _floats(series) -> list:
+    """Values as JSON-safe floats, NaN becoming null"""
+    return [None if math.isnan(value) else value for value in series.astype('float64').tolist()]
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve downsampled range queries for charts")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8767)
+    parser.add_argument('--engine', choices=['sql', 'numpy'],
+                        help="Where buckets are computed, defaults to sql on Postgres")
+    args = parser.parse_args()
+
+    viewer = CryptoDataViewer()
+    if args.engine:
+        viewer.downsampler = RangeDownsampler(viewer.db, args.engine)
+    server = ChartServer(viewer, args.host, args.port)
+    print(f"Serving charts on {server.url}")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server.server_close()
+        viewer.db.close()
+
+if __name__ == "__main__":
+    with instrumented():
+        main()
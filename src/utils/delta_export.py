@@ -0,0 +1,306 @@
+import argparse
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from src.database.connection import get_database
+from src.data.intervals import interval_to_ms
+from src.database.watermarks import (ack_changes, ensure_watermark_table, get_changes,
+                                     get_watermarks, merge_ranges, prune_change_log)
+from src.utils.metrics import track_query
+from src.utils.parquet_export import FILE_SCHEMA
+from src.utils.profiling import instrumented
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency, only needed for Parquet export
+    pa = None
+
+DEFAULT_DELTA_DIR = os.path.join('crypto_exports', 'delta')
+MANIFEST_FILE = 'manifest.json'
+# Chunks a series accumulates before compact() merges them
+COMPACT_MIN_CHUNKS = 8
+# Rows per round trip from the server-side cursor, and per row group
+FETCH_SIZE = 50000
+
+PRICE_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+
+class DeltaExporter:
+    """
+    Incremental export of ohlc_data to append-only Parquet chunks
+
+    A manifest records, per symbol and interval, the ingest watermark
+    version exported last and the files holding the series. An export only
+    looks at series whose watermark moved since, reads the candle ranges
+    the ingest change log (see src.database.watermarks) reports for the
+    versions in between, and appends them as one chunk named after the new
+    version. The first export of a series writes its full history as the
+    first chunk. A nightly run over the whole universe thus reads only the
+    day's candles.
+
+    Chunks may repeat candles: a later chunk holds the newer values of a
+    rewritten candle. Readers merge a series' files in order and keep the
+    last row per timestamp (see load); compact() does the same once and
+    replaces the files with a single compacted one.
+
+    Each output directory is a consumer of the change log: an export
+    acknowledges the versions it wrote and prunes the entries every consumer
+    has processed. A directory that is no longer exported to keeps holding
+    the log back until watermarks.drop_consumer(cur, exporter.consumer).
+
+    Usage:
+        exporter = DeltaExporter()
+        exporter.export(interval='1d')
+        exporter.compact()
+    """
+
+    def __init__(self, db=None, output_dir: str = DEFAULT_DELTA_DIR,
+                 compression: str = 'zstd'):
+        if pa is None:
+            raise ImportError("pyarrow is required for delta export: pip install pyarrow")
+        self.db = db or get_database()
+        self.output_dir = output_dir
+        self.compression = compression
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    def _series_dir(self, symbol: str, interval: str) -> str:
+        return os.path.join(self.output_dir, f"symbol={symbol}", f"interval={interval}")
+
+    def read_manifest(self) -> Dict:
+        try:
+            with open(os.path.join(self.output_dir, MANIFEST_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'series': {}}
+
+    def _write_manifest(self, manifest: Dict) -> None:
+        path = os.path.join(self.output_dir, MANIFEST_FILE)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    def _export_rows(self, conn, symbol: str, interval: str,
+                     ranges: Optional[List[Tuple[datetime, datetime]]], path: str) -> int:
+        """
+        Stream the candles of a series, all of them or those within
+        `ranges`, into a Parquet file
+
+        Rows are read through a named (server-side) cursor FETCH_SIZE at a
+        time, so a series' first export doesn't hold its history in memory.
+
+        Returns:
+            Number of rows written, the file is only created when positive
+        """
+        query = """
+        SELECT timestamp, open, high, low, close, volume
+        FROM ohlc_data
+        WHERE symbol = %s
+        AND interval = %s
+        """
+        params = [symbol, interval]
+        if ranges is not None:
+            query += " AND (" + " OR ".join(["timestamp BETWEEN %s AND %s"] * len(ranges)) + ")"
+            for first, last in ranges:
+                params.extend([first, last])
+        query += " ORDER BY timestamp"
+
+        written = 0
+        writer = None
+        tmp_path = f"{path}.tmp"
+        with track_query('delta', 'full' if ranges is None else 'changes') as observation, \
+                conn.cursor(name=f"delta_{symbol.lower()}") as cur:
+            cur.itersize = FETCH_SIZE
+            cur.execute(query, params)
+            try:
+                while True:
+                    rows = cur.fetchmany(FETCH_SIZE)
+                    if not rows:
+                        break
+                    df = pd.DataFrame(rows, columns=['timestamp'] + PRICE_COLUMNS)
+                    df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
+                    df[PRICE_COLUMNS] = df[PRICE_COLUMNS].astype('float64')
+                    if writer is None:
+                        writer = pq.ParquetWriter(tmp_path, FILE_SCHEMA,
+                                                  compression=self.compression)
+                    writer.write_table(pa.Table.from_pandas(df, schema=FILE_SCHEMA,
+                                                            preserve_index=False))
+                    written += len(rows)
+            finally:
+                if writer is not None:
+                    writer.close()
+            observation.rows = written
+        if writer is not None:
+            os.replace(tmp_path, path)
+        return written
+
+    def _write_file(self, df: pd.DataFrame, path: str) -> None:
+        table = pa.Table.from_pandas(df, schema=FILE_SCHEMA, preserve_index=False)
+        tmp_path = f"{path}.tmp"
+        pq.write_table(table, tmp_path, compression=self.compression)
+        os.replace(tmp_path, path)
+
+    @property
+    def consumer(self) -> str:
+        """Name this export acknowledges the change log under"""
+        return f"delta:{os.path.abspath(self.output_dir)}"
+
+    def export(self, symbols: Optional[List[str]] = None, interval: str = '1d') -> Dict:
+        """
+        Append what changed since the last export of each series
+
+        The exported versions are acknowledged in the change log, which is
+        then pruned up to what every consumer has processed (see
+        src.database.watermarks.prune_change_log). Series whose log has been
+        pruned past their exported version are exported in full again.
+
+        Args:
+            symbols: Symbols to export, defaults to every symbol stored for
+                `interval`
+            interval: Interval to export
+
+        Returns:
+            Rows written per symbol, for the symbols with changes
+        """
+        if symbols is None:
+            stats = self.db.query_prepared('database_stats')
+            symbols = sorted(stats.loc[stats['interval'] == interval, 'symbol'].unique())
+
+        gap = timedelta(milliseconds=interval_to_ms(interval))
+        manifest = self.read_manifest()
+        written = {}
+        with self.db.connection() as conn:
+            with conn.cursor() as cur:
+                ensure_watermark_table(cur)
+                # Read before the candles: rows changing meanwhile are
+                # exported now and again under their own version next time
+                versions = get_watermarks(cur, symbols)
+            exported = {}
+            for symbol in symbols:
+                key = f"{symbol}/{interval}"
+                entry = manifest['series'].get(key)
+                version = versions[symbol]
+                if entry is not None and entry['version'] == version:
+                    continue
+
+                ranges = None
+                if entry is None:
+                    entry = {'version': version, 'compacted': None, 'chunks': [], 'rows': 0}
+                else:
+                    with conn.cursor() as cur:
+                        changes = get_changes(cur, symbol, interval, entry['version'])
+                    if changes is not None:
+                        ranges = merge_ranges(changes, gap)
+                    entry['version'] = version
+                manifest['series'][key] = entry
+                exported[symbol] = version
+                if ranges == []:
+                    continue
+
+                directory = self._series_dir(symbol, interval)
+                os.makedirs(directory, exist_ok=True)
+                chunk = f"chunk-{version:012d}.parquet"
+                rows = self._export_rows(conn, symbol, interval, ranges,
+                                         os.path.join(directory, chunk))
+                if not rows:
+                    continue
+                if chunk not in entry['chunks']:
+                    entry['chunks'].append(chunk)
+                entry['rows'] += rows
+                written[symbol] = rows
+
+            with conn.cursor() as cur:
+                ack_changes(cur, self.consumer, interval, exported)
+                prune_change_log(cur)
+
+        manifest['updated_at'] = datetime.now().isoformat(timespec='seconds')
+        self._write_manifest(manifest)
+        print(f"Exported {sum(written.values())} {interval} rows for {len(written)} of "
+              f"{len(symbols)} symbols to {self.output_dir}")
+        return written
+
+    def _files(self, key: str, entry: Dict) -> List[str]:
+        symbol, interval = key.split('/')
+        directory = self._series_dir(symbol, interval)
+        names = ([entry['compacted']] if entry['compacted'] else []) + entry['chunks']
+        return [os.path.join(directory, name) for name in names]
+
+    def _merge(self, files: List[str]) -> pd.DataFrame:
+        """A series' files merged, keeping the latest row per timestamp"""
+        df = pd.concat([pq.read_table(path).to_pandas() for path in files], ignore_index=True)
+        return (df.drop_duplicates('timestamp', keep='last')
+                .sort_values('timestamp')
+                .reset_index(drop=True))
+
+    def load(self, symbol: str, interval: str = '1d') -> pd.DataFrame:
+        """An exported series as of the last export"""
+        entry = self.read_manifest()['series'].get(f"{symbol}/{interval}")
+        files = self._files(f"{symbol}/{interval}", entry) if entry else []
+        if not files:
+            return pd.DataFrame(columns=['timestamp'] + PRICE_COLUMNS)
+        return self._merge(files)
+
+    def compact(self, min_chunks: int = COMPACT_MIN_CHUNKS) -> int:
+        """
+        Merge the chunks of series that accumulated `min_chunks` or more
+
+        Each is rewritten as one compacted file holding the latest row per
+        timestamp, then the merged files are deleted.
+
+        Args:
+            min_chunks: Chunks a series needs before it is compacted
+
+        Returns:
+            Number of series compacted
+        """
+        manifest = self.read_manifest()
+        compacted = 0
+        for key, entry in sorted(manifest['series'].items()):
+            if len(entry['chunks']) < max(min_chunks, 1):
+                continue
+            files = self._files(key, entry)
+            df = self._merge(files)
+            name = f"compacted-{entry['version']:012d}.parquet"
+            path = os.path.join(os.path.dirname(files[0]), name)
+            self._write_file(df, path)
+
+            entry.update(compacted=name, chunks=[], rows=len(df))
+            # The manifest points at the new file before the old ones go
+            self._write_manifest(manifest)
+            for old in files:
+                if old != path:
+                    os.remove(old)
+            compacted += 1
+
+        print(f"Compacted {compacted} series in {self.output_dir}")
+        return compacted
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental Parquet export of changed candles")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export = subparsers.add_parser('export', help="Append changes since the last export")
+    export.add_argument('--symbols', nargs='+', help="Defaults to every symbol")
+    export.add_argument('--intervals', nargs='+', default=['1d'])
+
+    compact = subparsers.add_parser('compact', help="Merge accumulated chunks")
+    compact.add_argument('--min-chunks', type=int, default=COMPACT_MIN_CHUNKS)
+
+    for subparser in (export, compact):
+        subparser.add_argument('--output-dir', default=DEFAULT_DELTA_DIR)
+    args = parser.parse_args()
+
+    exporter = DeltaExporter(output_dir=args.output_dir)
+    if args.command == 'export':
+        for interval in args.intervals:
+            exporter.export(args.symbols, interval)
+    else:
+        exporter.compact(args.min_chunks)
+
+if __name__ == "__main__":
+    with instrumented():
+        main()
@@ -0,0 +1,290 @@
+import math
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.data.intervals import floor_open_time, from_ms, interval_to_ms, to_ms
+
+# Upper bound on points per response, well above any screen width
+MAX_POINTS = 10000
+# Buckets per output point for the close series: each keeps its first,
+# last, lowest and highest close (M4), which LTTB then picks from
+CLOSE_OVERSAMPLING = 4
+
+# Bucket of a candle, counted in epoch ms from the aligned range start
+_BUCKET_EXPRESSION = """
+%(origin)s + FLOOR(
+    (EXTRACT(EPOCH FROM timestamp) * 1000 - %(origin)s) / %(width)s
+)::BIGINT * %(width)s
+"""
+
+# First open, max high, min low, last close and summed volume per bucket,
+# like the rollups
+BUCKETED_OHLC_QUERY = """
+SELECT
+    bucket_ms,
+    (array_agg(open ORDER BY timestamp))[1] AS open,
+    MAX(high) AS high,
+    MIN(low) AS low,
+    (array_agg(close ORDER BY timestamp DESC))[1] AS close,
+    SUM(volume) AS volume
+FROM (
+    SELECT timestamp, open, high, low, close, volume, """ + _BUCKET_EXPRESSION + """ AS bucket_ms
+    FROM ohlc_data
+    WHERE symbol = %(symbol)s
+    AND interval = %(interval)s
+    AND timestamp >= to_timestamp(%(start)s / 1000.0)
+    AND timestamp < to_timestamp(%(end)s / 1000.0)
+) candles
+GROUP BY bucket_ms
+ORDER BY bucket_ms
+"""
+
+# Time and value of the first, last, lowest and highest close per bucket
+M4_CLOSE_QUERY = """
+SELECT
+    MIN(ts_ms) AS first_ms,
+    (array_agg(close ORDER BY ts_ms))[1] AS first_close,
+    MAX(ts_ms) AS last_ms,
+    (array_agg(close ORDER BY ts_ms DESC))[1] AS last_close,
+    (array_agg(ts_ms ORDER BY close, ts_ms))[1] AS min_ms,
+    MIN(close) AS min_close,
+    (array_agg(ts_ms ORDER BY close DESC, ts_ms))[1] AS max_ms,
+    MAX(close) AS max_close
+FROM (
+    SELECT close, (EXTRACT(EPOCH FROM timestamp) * 1000)::BIGINT AS ts_ms,
+        """ + _BUCKET_EXPRESSION + """ AS bucket_ms
+    FROM ohlc_data
+    WHERE symbol = %(symbol)s
+    AND interval = %(interval)s
+    AND timestamp >= to_timestamp(%(start)s / 1000.0)
+    AND timestamp < to_timestamp(%(end)s / 1000.0)
+) candles
+GROUP BY bucket_ms
+ORDER BY bucket_ms
+"""
+
+RANGE_QUERY = """
+SELECT timestamp, open, high, low, close, volume
+FROM ohlc_data
+WHERE symbol = %s
+AND interval = %s
+AND timestamp >= %s
+AND timestamp < %s
+ORDER BY timestamp
+"""
+
+class BucketPlan(NamedTuple):
+    source_interval: str   # Stored interval the buckets are built from
+    origin: int            # Start of the first bucket, epoch ms
+    width: int             # Bucket width in ms, a multiple of the source step
+
+def plan_buckets(interval: str, start_ms: int, end_ms: int, points: int,
+                 stored: Dict[str, Tuple[int, int]]) -> BucketPlan:
+    """
+    Buckets covering [start_ms, end_ms) in at most `points` buckets
+
+    Buckets are built from the coarsest stored interval that still fits in
+    one bucket and aggregates whole candles of `interval` (e.g. stored 1h
+    rollups for a 1m range spanning years), so far fewer rows are read. A
+    coarser interval is only used when its stored candles span the part of
+    the range `interval` has candles for; rollups lagging behind or starting
+    later would otherwise cut the series short.
+
+    Args:
+        stored: Open time of the first and last stored candle (epoch ms)
+            per interval of the symbol
+    """
+    step = interval_to_ms(interval)
+    raw_width = max(step, math.ceil((end_ms - start_ms) / points))
+    lo, hi = start_ms, end_ms
+    if interval in stored:
+        first_ms, last_ms = stored[interval]
+        lo, hi = max(lo, first_ms), min(hi, last_ms + step)
+    source = interval
+    for candidate, (first_ms, last_ms) in stored.items():
+        try:
+            candidate_step = interval_to_ms(candidate)
+        except ValueError:
+            continue
+        if not (candidate_step % step == 0 and candidate_step <= raw_width
+                and candidate_step > interval_to_ms(source)):
+            continue
+        if lo < hi and (first_ms > floor_open_time(lo, candidate)
+                        or last_ms < floor_open_time(hi - 1, candidate)):
+            continue
+        source = candidate
+    source_step = interval_to_ms(source)
+    width = math.ceil(raw_width / source_step) * source_step
+    return BucketPlan(source, floor_open_time(start_ms, source), width)
+
+def bucket_ohlc_frame(df: pd.DataFrame, plan: BucketPlan) -> pd.DataFrame:
+    """Vectorized counterpart of BUCKETED_OHLC_QUERY over loaded candles"""
+    if df.empty:
+        return pd.DataFrame(columns=['bucket_ms', 'open', 'high', 'low', 'close', 'volume'])
+    ts = pd.to_datetime(df['timestamp'], utc=True).astype('int64') // 10**6
+    bucket = plan.origin + (ts - plan.origin) // plan.width * plan.width
+    return (df.assign(bucket_ms=bucket.to_numpy())
+            .groupby('bucket_ms', sort=True)
+            .agg(open=('open', 'first'), high=('high', 'max'), low=('low', 'min'),
+                 close=('close', 'last'), volume=('volume', 'sum'))
+            .reset_index())
+
+def m4_frame(df: pd.DataFrame, plan: BucketPlan) -> pd.DataFrame:
+    """Vectorized counterpart of M4_CLOSE_QUERY over loaded candles"""
+    ts = pd.to_datetime(df['timestamp'], utc=True).astype('int64').to_numpy() // 10**6
+    frame = pd.DataFrame({'ts_ms': ts, 'close': df['close'].to_numpy(dtype='float64')})
+    frame['bucket_ms'] = plan.origin + (ts - plan.origin) // plan.width * plan.width
+    grouped = frame.groupby('bucket_ms', sort=True)
+    lowest = frame.loc[grouped['close'].idxmin()].set_index('bucket_ms')
+    highest = frame.loc[grouped['close'].idxmax()].set_index('bucket_ms')
+    return pd.DataFrame({
+        'first_ms': grouped['ts_ms'].first(),
+        'first_close': grouped['close'].first(),
+        'last_ms': grouped['ts_ms'].last(),
+        'last_close': grouped['close'].last(),
+        'min_ms': lowest['ts_ms'],
+        'min_close': lowest['close'],
+        'max_ms': highest['ts_ms'],
+        'max_close': highest['close'],
+    }).reset_index(drop=True)
+
+def m4_points(m4: pd.DataFrame):
+    """The distinct (time, close) points of an M4 result, in time order"""
+    times = np.concatenate([m4[f"{kind}_ms"].to_numpy(dtype='int64')
+                            for kind in ('first', 'last', 'min', 'max')])
+    closes = np.concatenate([m4[f"{kind}_close"].to_numpy(dtype='float64')
+                             for kind in ('first', 'last', 'min', 'max')])
+    times, index = np.unique(times, return_index=True)
+    return times, closes[index]
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling
+
+    Keeps the first and last point and, from each of the `threshold` - 2
+    buckets in between, the point forming the largest triangle with the
+    point kept before it and the average of the next bucket. The areas of a
+    bucket are computed at once with NumPy.
+
+    Returns:
+        Indices of the kept points
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    edges = (np.arange(threshold - 1) * (n - 2) / (threshold - 2)).astype(np.int64) + 1
+    edges[-1] = n - 1
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0] = 0
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs((x[previous] - avg_x) * (y[start:end] - y[previous])
+                      - (x[previous] - x[start:end]) * (avg_y - y[previous]))
+        previous = start + int(np.argmax(area))
+        kept[i + 1] = previous
+    kept[-1] = n - 1
+    return kept
+
+class RangeDownsampler:
+    """
+    Range queries returning at most a given number of points
+
+    ohlc() aggregates candles into time buckets, close() returns an LTTB
+    downsampled close series. On Postgres the buckets are computed by the
+    server ('sql'), so only the bucketed rows cross the wire; with
+    engine='numpy' (and on embedded backends) the candles are loaded and
+    bucketed with vectorized pandas/NumPy.
+
+    Usage:
+        downsampler = RangeDownsampler(get_database())
+        candles = downsampler.ohlc('BTCUSDT', '1m', '2020-01-01', '2024-01-01', 1500)
+    """
+
+    def __init__(self, db, engine: Optional[str] = None):
+        if engine not in (None, 'sql', 'numpy'):
+            raise ValueError(f"Unknown downsampling engine: {engine}")
+        self.db = db
+        self.engine = engine or ('numpy' if db.embedded else 'sql')
+
+    def _plan(self, symbol: str, interval: str, start, end, points: int):
+        stats = self.db.query_prepared('symbol_intervals', [symbol])
+        stored = {}
+        for row in stats.itertuples(index=False):
+            if pd.isna(row.first_timestamp) or pd.isna(row.last_timestamp):
+                continue
+            stored[row.interval] = (to_ms(pd.Timestamp(row.first_timestamp).to_pydatetime()),
+                                    to_ms(pd.Timestamp(row.last_timestamp).to_pydatetime()))
+        start_ms = to_ms(start)
+        if end is not None:
+            end_ms = to_ms(end)
+        elif interval in stored:
+            # Open ended: up to the latest stored candle, so the result only
+            # changes when candles do
+            end_ms = stored[interval][1] + interval_to_ms(interval)
+        else:
+            end_ms = start_ms + interval_to_ms(interval)
+        if end_ms <= start_ms:
+            raise ValueError("end must be after start")
+        plan = plan_buckets(interval, start_ms, end_ms, points, stored)
+        params = {'symbol': symbol, 'interval': plan.source_interval, 'start': start_ms,
+                  'end': end_ms, 'origin': plan.origin, 'width': plan.width}
+        return plan, params
+
+    @staticmethod
+    def _check_points(points: int) -> None:
+        if not 2 <= points <= MAX_POINTS:
+            raise ValueError(f"points must be between 2 and {MAX_POINTS}")
+
+    def _load(self, params: dict) -> pd.DataFrame:
+        df = self.db.read_sql(RANGE_QUERY, [params['symbol'], params['interval'],
+                                            from_ms(params['start']), from_ms(params['end'])])
+        for column in ('open', 'high', 'low', 'close', 'volume'):
+            df[column] = df[column].astype('float64')
+        return df
+
+    def ohlc(self, symbol: str, interval: str, start, end=None, points: int = 1500):
+        """
+        Bucketed candles of [start, end), end defaulting to the latest
+        stored candle
+
+        Returns:
+            The plan used and a frame of bucket_ms, open, high, low, close
+            and volume, one row per non-empty bucket
+        """
+        self._check_points(points)
+        plan, params = self._plan(symbol, interval, start, end, points)
+        if self.engine == 'sql':
+            return plan, self.db.read_sql(BUCKETED_OHLC_QUERY, params)
+        return plan, bucket_ohlc_frame(self._load(params), plan)
+
+    def close(self, symbol: str, interval: str, start, end=None, points: int = 1500):
+        """
+        Close series of [start, end) downsampled to `points` with LTTB, end
+        defaulting to the latest stored candle
+
+        The candles are first reduced to the M4 points of
+        CLOSE_OVERSAMPLING * `points` buckets, which keeps every local
+        extreme while bounding what is read.
+
+        Returns:
+            The plan used and a frame of ts_ms and close
+        """
+        self._check_points(points)
+        plan, params = self._plan(symbol, interval, start, end, points * CLOSE_OVERSAMPLING)
+        if self.engine == 'sql':
+            m4 = self.db.read_sql(M4_CLOSE_QUERY, params)
+        else:
+            loaded = self._load(params)
+            m4 = m4_frame(loaded, plan) if len(loaded) else pd.DataFrame()
+        if m4.empty:
+            return plan, pd.DataFrame(columns=['ts_ms', 'close'])
+        times, closes = m4_points(m4)
+        kept = lttb(times.astype('float64'), closes, points)
+        return plan, pd.DataFrame({'ts_ms': times[kept], 'close': closes[kept]})
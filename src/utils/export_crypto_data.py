@@ -1,36 +1,95 @@
-import psycopg2
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import os
+import xlsxwriter
+
+from src.database.connection import get_database, rows_to_frame
+from src.utils.metrics import track_query
+from src.utils.profiling import instrumented
+
+# Rows per round trip when streaming from the server-side cursor
+STREAM_CHUNK_SIZE = 50000
+# Rows per worksheet, including the header
+EXCEL_MAX_ROWS = 1048576
+STREAM_COLUMNS = ['timestamp', 'symbol', 'open', 'high', 'low', 'close', 'volume']
+# Day zero of Excel's serial date numbers
+EXCEL_EPOCH = pd.Timestamp('1899-12-30')
+
+def symbol_query(symbol, start_date=None, end_date=None, interval='1d'):
+    """Query and params selecting one symbol's export rows, newest first"""
+    query = """
+    SELECT 
+        timestamp,
+        symbol,
+        open,
+        high,
+        low,
+        close,
+        volume
+    FROM ohlc_data
+    WHERE symbol = %s
+    AND interval = %s
+    """
+    params = [symbol, interval]
+    
+    if start_date and end_date:
+        query += " AND timestamp BETWEEN %s AND %s"
+        params.extend([start_date, end_date])
+    
+    query += " ORDER BY timestamp DESC"
+    return query, params
+
+def _export_symbol_file(export_dir, symbol, start_date, end_date, interval):
+    """Process pool task: write one symbol's own workbook"""
+    exporter = CryptoDataExporter(export_dir=export_dir)
+    return exporter.export_single_symbol(symbol, start_date, end_date, interval)
+
+def _export_symbol_parquet(dataset_dir, symbol, start_date, end_date, interval):
+    """Process pool task: write one symbol's partitions of the Parquet dataset"""
+    from src.utils.parquet_export import ParquetExporter
+    
+    exporter = ParquetExporter(dataset_dir=dataset_dir)
+    with exporter.db.connection() as conn:
+        return exporter.export_symbol(conn, symbol, interval, start_date, end_date)
+
+def _encode_symbol(symbol, start_date, end_date, interval):
+    """
+    Process pool task: fetch one symbol and pre-encode it for the workbook
+    
+    Returns the symbol and a float array of rows holding the Excel serial
+    date followed by open, high, low, close and volume, so the assembling
+    process only has to write numbers.
+    """
+    query, params = symbol_query(symbol, start_date, end_date, interval)
+    df = get_database().read_sql(query, params)
+    
+    timestamps = pd.to_datetime(df['timestamp'], utc=True).dt.tz_localize(None)
+    serial = (timestamps - EXCEL_EPOCH) / pd.Timedelta(days=1)
+    values = np.column_stack([
+        serial.to_numpy(dtype='float64'),
+        df[['open', 'high', 'low', 'close', 'volume']].to_numpy(dtype='float64')
+    ])
+    return symbol, values
 
 class CryptoDataExporter:
-    def __init__(self):
-        self.conn_params = {
-            'dbname': 'crypto_market_data',
-            'user': 'username',
-            'password': 'password',
-            'host': 'localhost',
-            'port': '5432'
-        }
+    def __init__(self, db=None, export_dir='crypto_exports'):
+        self.db = db or get_database()
         
         # Create exports directory if it doesn't exist
-        self.export_dir = 'crypto_exports'
+        self.export_dir = export_dir
         if not os.path.exists(self.export_dir):
             os.makedirs(self.export_dir)
     
     def get_available_symbols(self):
         """List all symbols in the database"""
-        query = """
-        SELECT DISTINCT symbol 
-        FROM ohlc_data 
-        ORDER BY symbol;
-        """
-        
-        with psycopg2.connect(**self.conn_params) as conn:
-            df = pd.read_sql_query(query, conn)
-            return df['symbol'].tolist()
+        df = self.db.query_prepared('available_symbols')
+        return df['symbol'].tolist()
     
-    def export_single_symbol(self, symbol, start_date=None, end_date=None):
+    def export_single_symbol(self, symbol, start_date=None, end_date=None, interval='1d'):
         """Export data for a single symbol to Excel"""
         # Base query
         query = """
@@ -44,8 +103,9 @@ class CryptoDataExporter:
             volume
         FROM ohlc_data
         WHERE symbol = %s
+        AND interval = %s
         """
-        params = [symbol]
+        params = [symbol, interval]
         
         # Add date range if specified
         if start_date and end_date:
@@ -55,8 +115,9 @@ class CryptoDataExporter:
         query += " ORDER BY timestamp DESC"
         
         # Fetch data
-        with psycopg2.connect(**self.conn_params) as conn:
-            df = pd.read_sql_query(query, conn, params=params)
+        with track_query('exporter', 'single_symbol') as observation:
+            df = self.db.read_sql(query, params)
+            observation.rows = len(df)
         
         # Format timestamp
         df['timestamp'] = pd.to_datetime(df['timestamp']).dt.strftime('%Y-%m-%d %H:%M:%S')
@@ -107,15 +168,26 @@ class CryptoDataExporter:
         print(f"Data exported to {filename}")
         return filename
     
-    def export_all_symbols(self, start_date=None, end_date=None):
-        """Export data for all symbols to separate sheets in one Excel file"""
+    def export_all_symbols(self, start_date=None, end_date=None, interval='1d',
+                           streaming=False):
+        """
+        Export data for all symbols to separate sheets in one Excel file
+        
+        With streaming=True rows are read and written in fixed-size chunks,
+        see export_all_symbols_streaming.
+        """
+        if streaming:
+            return self.export_all_symbols_streaming(start_date, end_date, interval)
+        
         symbols = self.get_available_symbols()
         
         # Create Excel file
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f"{self.export_dir}/all_crypto_data_{timestamp}.xlsx"
         
-        with pd.ExcelWriter(filename, engine='xlsxwriter') as writer:
+        # One pooled connection serves every symbol
+        with self.db.connection() as conn, \
+                pd.ExcelWriter(filename, engine='xlsxwriter') as writer:
             workbook = writer.book
             
             # Add formats
@@ -148,8 +220,9 @@ class CryptoDataExporter:
                     volume
                 FROM ohlc_data
                 WHERE symbol = %s
+                AND interval = %s
                 """
-                params = [symbol]
+                params = [symbol, interval]
                 
                 if start_date and end_date:
                     query += " AND timestamp BETWEEN %s AND %s"
@@ -157,8 +230,11 @@ class CryptoDataExporter:
                 
                 query += " ORDER BY timestamp DESC"
                 
-                with psycopg2.connect(**self.conn_params) as conn:
-                    df = pd.read_sql_query(query, conn, params=params)
+                with track_query('exporter', 'all_symbols') as observation, \
+                        conn.cursor() as cur:
+                    cur.execute(query, params)
+                    df = rows_to_frame(cur)
+                    observation.rows = len(df)
                 
                 # Format timestamp
                 df['timestamp'] = pd.to_datetime(df['timestamp']).dt.strftime('%Y-%m-%d %H:%M:%S')
@@ -186,6 +262,230 @@ class CryptoDataExporter:
         print(f"All data exported to {filename}")
         return filename
 
+    def export_all_symbols_streaming(self, start_date=None, end_date=None, interval='1d',
+                                     chunk_size=STREAM_CHUNK_SIZE):
+        """
+        Export all symbols with memory use independent of the row count
+        
+        Each symbol is read through a named (server-side) cursor chunk by
+        chunk and written straight to a constant_memory workbook, which
+        flushes every row to disk once the next one starts. Timestamps are
+        written as native Excel datetimes. Symbols with more rows than an
+        Excel sheet holds continue on additional sheets.
+        """
+        symbols = self.get_available_symbols()
+        
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        filename = f"{self.export_dir}/all_crypto_data_{timestamp}.xlsx"
+        
+        workbook, formats = self._stream_workbook(filename)
+        
+        try:
+            with self.db.connection() as conn:
+                for symbol in symbols:
+                    query, params = symbol_query(symbol, start_date, end_date, interval)
+                    
+                    # Timed together with the writing, rows are read as it goes
+                    with track_query('exporter', 'streaming') as observation, \
+                            conn.cursor(name=f"export_{symbol.lower()}") as cur:
+                        cur.itersize = chunk_size
+                        cur.execute(query, params)
+                        observation.rows = self._stream_sheets(workbook, formats, symbol,
+                                                               cur, chunk_size)
+        finally:
+            workbook.close()
+        
+        print(f"All data exported to {filename}")
+        return filename
+    
+    def export_all_symbols_parallel(self, start_date=None, end_date=None, interval='1d',
+                                    target='workbook', max_workers=None):
+        """
+        Export all symbols with one worker process per symbol at a time
+        
+        Args:
+            start_date: Optional range start (YYYY-MM-DD)
+            end_date: Optional range end (YYYY-MM-DD)
+            interval: Interval to export
+            target: 'workbook' - workers fetch and pre-encode each symbol,
+                        then this process assembles one combined workbook
+                    'files' - workers write one workbook per symbol into a
+                        run directory
+                    'parquet' - workers write their symbol's partitions of
+                        the Parquet dataset
+            max_workers: Worker processes, defaults to the CPU count
+        
+        Returns:
+            The combined workbook, run directory or dataset directory
+        
+        Embedded backends allow a single process to open the database, so
+        with them the same targets are written sequentially in this process.
+        """
+        if target not in ('workbook', 'files', 'parquet'):
+            raise ValueError(f"Unknown export target: {target}")
+        if self.db.embedded:
+            return self._export_all_sequential(start_date, end_date, interval, target)
+        
+        symbols = self.get_available_symbols()
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        max_workers = max_workers or os.cpu_count()
+        
+        # Workers open their own connection pools, so they must not inherit
+        # this process's connections through fork
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as pool:
+            if target == 'files':
+                output = os.path.join(self.export_dir, f"all_crypto_data_{timestamp}")
+                os.makedirs(output, exist_ok=True)
+                futures = [pool.submit(_export_symbol_file, output, symbol,
+                                       start_date, end_date, interval)
+                           for symbol in symbols]
+                for future in as_completed(futures):
+                    future.result()
+            
+            elif target == 'parquet':
+                from src.utils.parquet_export import DEFAULT_DATASET_DIR
+                
+                output = DEFAULT_DATASET_DIR
+                futures = {pool.submit(_export_symbol_parquet, output, symbol,
+                                       start_date, end_date, interval): symbol
+                           for symbol in symbols}
+                for future in as_completed(futures):
+                    print(f"Exported {future.result()} rows for {futures[future]}")
+            
+            else:
+                output = f"{self.export_dir}/all_crypto_data_{timestamp}.xlsx"
+                workbook, formats = self._stream_workbook(output)
+                try:
+                    # Results are written in submission order, keeping sheets
+                    # sorted, with at most two per worker encoded ahead so
+                    # memory stays bounded however many symbols there are
+                    pending = deque()
+                    remaining = iter(symbols)
+                    for symbol in remaining:
+                        pending.append(pool.submit(_encode_symbol, symbol, start_date,
+                                                   end_date, interval))
+                        if len(pending) >= max_workers * 2:
+                            break
+                    while pending:
+                        symbol, values = pending.popleft().result()
+                        next_symbol = next(remaining, None)
+                        if next_symbol is not None:
+                            pending.append(pool.submit(_encode_symbol, next_symbol, start_date,
+                                                       end_date, interval))
+                        self._write_encoded_sheets(workbook, formats, symbol, values)
+                finally:
+                    workbook.close()
+        
+        print(f"All data exported to {output}")
+        return output
+    
+    def _export_all_sequential(self, start_date, end_date, interval, target):
+        """export_all_symbols_parallel's targets, written by this process"""
+        if target == 'workbook':
+            return self.export_all_symbols_streaming(start_date, end_date, interval)
+        
+        symbols = self.get_available_symbols()
+        if target == 'files':
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            output = os.path.join(self.export_dir, f"all_crypto_data_{timestamp}")
+            exporter = CryptoDataExporter(db=self.db, export_dir=output)
+            for symbol in symbols:
+                exporter.export_single_symbol(symbol, start_date, end_date, interval)
+        else:
+            from src.utils.parquet_export import ParquetExporter
+            
+            output = ParquetExporter(db=self.db).export(symbols, interval, start_date, end_date)
+        
+        print(f"All data exported to {output}")
+        return output
+    
+    def _stream_workbook(self, filename):
+        """Create a constant_memory workbook and the formats its sheets use"""
+        workbook = xlsxwriter.Workbook(filename, {
+            'constant_memory': True,
+            'remove_timezone': True
+        })
+        formats = {
+            'header': workbook.add_format({
+                'bold': True,
+                'text_wrap': True,
+                'valign': 'top',
+                'border': 1,
+                'bg_color': '#D9D9D9'
+            }),
+            'timestamp': workbook.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'}),
+            'number': workbook.add_format({'num_format': '#,##0.00000000'}),
+            'volume': workbook.add_format({'num_format': '#,##0.00'})
+        }
+        return workbook, formats
+    
+    def _write_encoded_sheets(self, workbook, formats, symbol, values):
+        """Write rows pre-encoded by _encode_symbol to one or more sheets"""
+        sheet_number = 1
+        worksheet = self._add_stream_sheet(workbook, formats, symbol, sheet_number)
+        row_num = 1
+        
+        for row in values.tolist():
+            if row_num >= EXCEL_MAX_ROWS:
+                sheet_number += 1
+                worksheet = self._add_stream_sheet(workbook, formats, symbol, sheet_number)
+                row_num = 1
+            
+            worksheet.write_number(row_num, 0, row[0], formats['timestamp'])
+            worksheet.write_string(row_num, 1, symbol)
+            # NULL volumes arrive as NaN, left blank like the streaming path
+            worksheet.write_row(row_num, 2, [None if value != value else value
+                                             for value in row[1:]])
+            row_num += 1
+    
+    def _add_stream_sheet(self, workbook, formats, symbol, sheet_number):
+        """Add a formatted sheet with its header row for streamed rows"""
+        suffix = '' if sheet_number == 1 else f" ({sheet_number})"
+        # Excel sheet names limited to 31 chars
+        worksheet = workbook.add_worksheet(symbol[:31 - len(suffix)] + suffix)
+        
+        # Set column widths and formats
+        worksheet.set_column('A:A', 20, formats['timestamp'])  # Timestamp
+        worksheet.set_column('B:B', 12)  # Symbol
+        worksheet.set_column('C:F', 15, formats['number'])  # OHLC
+        worksheet.set_column('G:G', 15, formats['volume'])  # Volume
+        
+        # Freeze top row
+        worksheet.freeze_panes(1, 0)
+        worksheet.write_row(0, 0, STREAM_COLUMNS, formats['header'])
+        return worksheet
+    
+    def _stream_sheets(self, workbook, formats, symbol, cur, chunk_size):
+        """Write a cursor's rows to sheets for `symbol`, returning the row count"""
+        sheet_number = 1
+        worksheet = self._add_stream_sheet(workbook, formats, symbol, sheet_number)
+        row_num = 1
+        written = 0
+        
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                return written
+            written += len(rows)
+            
+            for row in rows:
+                if row_num >= EXCEL_MAX_ROWS:
+                    sheet_number += 1
+                    worksheet = self._add_stream_sheet(workbook, formats, symbol, sheet_number)
+                    row_num = 1
+                
+                # Rows come back in the session time zone and remove_timezone
+                # only drops it, so convert to UTC like the other export modes
+                timestamp = row[0]
+                if timestamp.tzinfo is not None:
+                    timestamp = timestamp.astimezone(timezone.utc)
+                worksheet.write_datetime(row_num, 0, timestamp, formats['timestamp'])
+                worksheet.write_string(row_num, 1, row[1])
+                worksheet.write_row(row_num, 2, [float(value) if value is not None else None
+                                                 for value in row[2:]])
+                row_num += 1
+
 def main():
     exporter = CryptoDataExporter()
     
@@ -196,9 +496,10 @@ def main():
         print("3. Export single symbol with date range")
         print("4. Export all symbols with date range")
         print("5. List available symbols")
-        print("6. Exit")
+        print("6. Export all symbols (streaming, for large histories)")
+        print("7. Exit")
         
-        choice = input("\nEnter your choice (1-6): ")
+        choice = input("\nEnter your choice (1-7): ")
         
         if choice == '1':
             symbol = input("Enter symbol (e.g., BTCUSDT): ").upper()
@@ -225,6 +526,9 @@ def main():
                 print(symbol)
         
         elif choice == '6':
+            exporter.export_all_symbols(streaming=True)
+        
+        elif choice == '7':
             print("Goodbye!")
             break
         
@@ -232,4 +536,5 @@ def main():
             print("Invalid choice. Please try again.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with instrumented():
+        main()
\ No newline at end of file
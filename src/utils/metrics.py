@@ -0,0 +1,223 @@
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Seconds, from a fast local query to a slow rate limited request
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Rows per batch or query result
+ROW_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+
+def _escape_label(value) -> str:
+    """A label value as the text exposition format quotes it"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names: Sequence[str], values: Tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """A named family of samples, one per combination of label values"""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+                    for key, value in sorted(self._values.items())]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        return '\n'.join(lines + self.samples())
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    le = _format_labels(self.label_names, key, f'le="{_format_value(bound)}"')
+                    lines.append(f"{self.name}_bucket{le} {count}")
+                labels = _format_labels(self.label_names, key)
+                lines.append(f"{self.name}_sum{labels} {total!r}")
+                lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+REGISTRY = Registry()
+
+# BinanceFetcher
+BINANCE_REQUESTS = REGISTRY.register(Counter(
+    'binance_requests_total', "Binance REST requests by endpoint and HTTP status",
+    ['endpoint', 'status']))
+BINANCE_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'binance_request_seconds', "Binance REST request latency", ['endpoint']))
+BINANCE_USED_WEIGHT = REGISTRY.register(Gauge(
+    'binance_used_weight', "Request weight used in the current minute, as last reported"))
+BINANCE_RETRIES = REGISTRY.register(Counter(
+    'binance_retries_total', "Requests retried after a rate limit response", ['status']))
+
+# DatabaseHandler.store_data
+STORE_BATCHES = REGISTRY.register(Counter(
+    'store_batches_total', "store_data calls by outcome", ['outcome']))
+STORE_BATCH_ROWS = REGISTRY.register(Histogram(
+    'store_batch_rows', "Rows per store_data batch", buckets=ROW_BUCKETS))
+STORE_SECONDS = REGISTRY.register(Histogram(
+    'store_seconds', "store_data duration"))
+STORE_ROWS = REGISTRY.register(Counter(
+    'store_rows_total', "Stored rows: inserted, updated, or unchanged (a conflict with "
+    "identical values)", ['result']))
+
+# Viewer and exporter queries
+QUERY_SECONDS = REGISTRY.register(Histogram(
+    'query_seconds', "Read query duration", ['source', 'query']))
+QUERY_ROWS = REGISTRY.register(Counter(
+    'query_rows_total', "Rows returned by read queries", ['source', 'query']))
+
+def record_store(batch_rows: int, seconds: float, inserted: int, changed: int) -> None:
+    STORE_BATCHES.inc(outcome='ok')
+    STORE_BATCH_ROWS.observe(batch_rows)
+    STORE_SECONDS.observe(seconds)
+    STORE_ROWS.inc(inserted, result='inserted')
+    STORE_ROWS.inc(changed - inserted, result='updated')
+    STORE_ROWS.inc(batch_rows - changed, result='unchanged')
+
+class QueryObservation:
+    """Set `rows` to the number of rows the timed query returned"""
+
+    def __init__(self):
+        self.rows = 0
+
+@contextmanager
+def track_query(source: str, query: str):
+    """
+    Time a read query and count its rows
+
+    Usage:
+        with track_query('viewer', 'recent_data') as observation:
+            df = ...
+            observation.rows = len(df)
+    """
+    observation = QueryObservation()
+    start = time.perf_counter()
+    yield observation
+    QUERY_SECONDS.observe(time.perf_counter() - start, source=source, query=query)
+    QUERY_ROWS.inc(observation.rows, source=source, query=query)
+
+class MetricsServer:
+    """
+    Serves REGISTRY on http://host:port/metrics from a background thread
+
+    Usage:
+        server = MetricsServer(9108).start()
+    """
+
+    def __init__(self, port: int, host: str = '127.0.0.1', registry: Registry = REGISTRY):
+        self.registry = registry
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    def _handler(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                payload = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def start(self) -> 'MetricsServer':
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        print(f"Serving metrics on {self.url}")
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+_server = None
+
+def start_metrics_server(port: Optional[int], host: str = '127.0.0.1') -> Optional[MetricsServer]:
+    """Start the process-wide endpoint once, when a port is configured"""
+    global _server
+    if port and _server is None:
+        _server = MetricsServer(port, host).start()
+    return _server
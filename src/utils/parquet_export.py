@@ -0,0 +1,231 @@
+import argparse
+import os
+from datetime import datetime
+from typing import List, Optional
+
+import pandas as pd
+import pytz
+
+from src.database.connection import get_database
+from src.database.partitions import month_index, month_start
+from src.utils.metrics import track_query
+from src.utils.profiling import instrumented
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency, only needed for Parquet export
+    pa = None
+
+DEFAULT_DATASET_DIR = os.path.join('crypto_exports', 'parquet')
+
+# Rows per round trip from the server-side cursor
+FETCH_SIZE = 50000
+# Small enough that a date filter can skip most of a month's file
+ROW_GROUP_SIZE = 16384
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("pyarrow is required for Parquet export: pip install pyarrow")
+
+def _partitioning():
+    """Hive layout symbol=.../interval=.../month=YYYY-MM, all as strings"""
+    return ds.partitioning(
+        pa.schema([
+            ('symbol', pa.string()),
+            ('interval', pa.string()),
+            ('month', pa.string())
+        ]),
+        flavor='hive'
+    )
+
+FILE_SCHEMA = None if pa is None else pa.schema([
+    ('timestamp', pa.timestamp('ms', tz='UTC')),
+    ('open', pa.float64()),
+    ('high', pa.float64()),
+    ('low', pa.float64()),
+    ('close', pa.float64()),
+    ('volume', pa.float64())
+])
+
+class ParquetExporter:
+    """
+    Exports ohlc_data to a local Parquet dataset partitioned by symbol,
+    interval and month
+
+    Rows are streamed ordered by time, so each month is written as one file
+    whose row groups hold contiguous time ranges, and re-exporting a month
+    replaces just that partition.
+    """
+
+    def __init__(self, db=None, dataset_dir: str = DEFAULT_DATASET_DIR,
+                 compression: str = 'zstd'):
+        _require_pyarrow()
+        self.db = db or get_database()
+        self.dataset_dir = dataset_dir
+        self.compression = compression
+        os.makedirs(self.dataset_dir, exist_ok=True)
+
+    def _write_month(self, symbol: str, interval: str, month: str, rows: List) -> None:
+        columns = list(zip(*rows))
+        table = pa.table([
+            pa.array(columns[0], pa.timestamp('ms', tz='UTC')),
+            *[pa.array([float(v) if v is not None else None for v in column], pa.float64())
+              for column in columns[1:]]
+        ], schema=FILE_SCHEMA)
+
+        directory = os.path.join(self.dataset_dir, f"symbol={symbol}",
+                                 f"interval={interval}", f"month={month}")
+        os.makedirs(directory, exist_ok=True)
+        pq.write_table(table, os.path.join(directory, 'part-0.parquet'),
+                       compression=self.compression, row_group_size=ROW_GROUP_SIZE)
+
+    def export_symbol(self, conn, symbol: str, interval: str = '1d',
+                      start_date=None, end_date=None) -> int:
+        """Export one symbol on an open connection, returning the row count"""
+        query = """
+        SELECT timestamp, open, high, low, close, volume
+        FROM ohlc_data
+        WHERE symbol = %s
+        AND interval = %s
+        """
+        params = [symbol, interval]
+
+        if start_date and end_date:
+            # Each file holds a whole month, so a partial range still has to
+            # rewrite the months it touches completely
+            first = month_index(ParquetReader._to_utc(start_date))
+            last = month_index(ParquetReader._to_utc(end_date))
+            query += " AND timestamp >= %s AND timestamp < %s"
+            params.extend([month_start(first), month_start(last + 1)])
+
+        query += " ORDER BY timestamp"
+
+        exported = 0
+        month_rows = []
+        current_month = None
+        with track_query('parquet', 'symbol') as observation, \
+                conn.cursor(name=f"parquet_{symbol.lower()}") as cur:
+            cur.itersize = FETCH_SIZE
+            cur.execute(query, params)
+            for row in cur:
+                observation.rows += 1
+                month = row[0].astimezone(pytz.UTC).strftime('%Y-%m')
+                if month != current_month and month_rows:
+                    self._write_month(symbol, interval, current_month, month_rows)
+                    exported += len(month_rows)
+                    month_rows = []
+                current_month = month
+                month_rows.append(row)
+
+        if month_rows:
+            self._write_month(symbol, interval, current_month, month_rows)
+            exported += len(month_rows)
+        return exported
+
+    def export(self, symbols: Optional[List[str]] = None, interval: str = '1d',
+               start_date=None, end_date=None) -> str:
+        """
+        Export symbols to the dataset
+
+        Args:
+            symbols: Symbols to export, defaults to every symbol in the database
+            interval: Interval to export
+            start_date: Optional range start (YYYY-MM-DD)
+            end_date: Optional range end (YYYY-MM-DD)
+
+        Returns:
+            The dataset directory
+        """
+        if symbols is None:
+            symbols = self.db.query_prepared('available_symbols')['symbol'].tolist()
+
+        with self.db.connection() as conn:
+            for symbol in symbols:
+                exported = self.export_symbol(conn, symbol, interval, start_date, end_date)
+                print(f"Exported {exported} {interval} rows for {symbol}")
+
+        print(f"Data exported to {self.dataset_dir}")
+        return self.dataset_dir
+
+class ParquetReader:
+    """
+    Reads the dataset written by ParquetExporter without touching Postgres
+
+    Symbol, interval and date filters are pushed down: partitions outside
+    them are never opened, and row groups are skipped using their timestamp
+    statistics.
+
+    Usage:
+        reader = ParquetReader()
+        df = reader.load(['BTCUSDT'], '1h', '2024-01-01', '2024-12-31')
+    """
+
+    def __init__(self, dataset_dir: str = DEFAULT_DATASET_DIR):
+        _require_pyarrow()
+        self.dataset_dir = dataset_dir
+        self.dataset = ds.dataset(dataset_dir, format='parquet', partitioning=_partitioning())
+
+    @staticmethod
+    def _to_utc(value) -> datetime:
+        ts = pd.Timestamp(value)
+        return ts.tz_localize('UTC') if ts.tzinfo is None else ts.tz_convert('UTC')
+
+    def build_filter(self, symbols: Optional[List[str]] = None, interval: str = '1d',
+                     start=None, end=None):
+        """Dataset filter expression for the given symbols and date range"""
+        expression = ds.field('interval') == interval
+        if symbols:
+            expression &= ds.field('symbol').isin(symbols)
+        if start is not None:
+            start = self._to_utc(start)
+            expression &= ds.field('month') >= start.strftime('%Y-%m')
+            expression &= ds.field('timestamp') >= pa.scalar(start.to_pydatetime(),
+                                                             pa.timestamp('ms', tz='UTC'))
+        if end is not None:
+            end = self._to_utc(end)
+            expression &= ds.field('month') <= end.strftime('%Y-%m')
+            expression &= ds.field('timestamp') <= pa.scalar(end.to_pydatetime(),
+                                                             pa.timestamp('ms', tz='UTC'))
+        return expression
+
+    def load_table(self, symbols: Optional[List[str]] = None, interval: str = '1d',
+                   start=None, end=None, columns: Optional[List[str]] = None):
+        """Filtered pyarrow Table, see load"""
+        return self.dataset.to_table(columns=columns,
+                                     filter=self.build_filter(symbols, interval, start, end))
+
+    def load(self, symbols: Optional[List[str]] = None, interval: str = '1d',
+             start=None, end=None, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Load candles as a DataFrame sorted by symbol and timestamp
+
+        Args:
+            symbols: Symbols to load, defaults to all
+            interval: Interval to load
+            start: Optional earliest timestamp (date string or datetime, UTC)
+            end: Optional latest timestamp
+            columns: Optional subset of columns to read
+        """
+        df = self.load_table(symbols, interval, start, end, columns).to_pandas()
+        sort_by = [column for column in ('symbol', 'timestamp') if column in df.columns]
+        if sort_by:
+            df = df.sort_values(sort_by, ignore_index=True)
+        return df
+
+def main():
+    parser = argparse.ArgumentParser(description="Export OHLCV data to a partitioned Parquet dataset")
+    parser.add_argument('--symbols', nargs='+', help="Defaults to every symbol")
+    parser.add_argument('--interval', default='1d')
+    parser.add_argument('--start', help="YYYY-MM-DD")
+    parser.add_argument('--end', help="YYYY-MM-DD")
+    parser.add_argument('--dataset-dir', default=DEFAULT_DATASET_DIR)
+    args = parser.parse_args()
+
+    exporter = ParquetExporter(dataset_dir=args.dataset_dir)
+    exporter.export(args.symbols, args.interval, args.start, args.end)
+
+if __name__ == "__main__":
+    with instrumented():
+        main()
@@ -0,0 +1,129 @@
+import cProfile
+import io
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Optional
+
+from src.config import METRICS_PORT, PROFILE, PROFILE_OUTPUT
+from src.utils.metrics import start_metrics_server
+
+class SamplingProfiler:
+    """
+    Low overhead profiler sampling the stacks of every thread
+
+    Unlike cProfile, which only sees the thread that enabled it and slows
+    every call down, this wakes up every `interval` seconds and records
+    where each thread is, so it also shows the fetch and writer threads of
+    the pipeline at close to full speed. Stacks are written in the collapsed
+    format read by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self) -> None:
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            self.stacks[';'.join(reversed(stack))] += 1
+        self.samples += 1
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path: str) -> None:
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def top(self, limit: int = 20) -> str:
+        """Functions most often on top of a stack, i.e. where time is spent"""
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        total = sum(leaves.values()) or 1
+        return '\n'.join(f"{count / total:>7.1%}  {name}"
+                         for name, count in leaves.most_common(limit))
+
+@contextmanager
+def profiled(mode: Optional[str] = None, output: Optional[str] = None, top: int = 20):
+    """
+    Profile the enclosed code
+
+    Args:
+        mode: 'cprofile' for deterministic profiling of the calling thread,
+            'sample' for stack sampling of all threads, None to do nothing
+        output: File for the pstats dump or collapsed stacks, defaults to
+            profile.prof / profile.folded
+        top: Entries of the summary printed at the end
+    """
+    if not mode:
+        yield
+        return
+    if mode not in ('cprofile', 'sample'):
+        raise ValueError(f"Unknown profile mode: {mode}")
+
+    start = time.perf_counter()
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            output = output or 'profile.prof'
+            profiler.dump_stats(output)
+            summary = io.StringIO()
+            pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(top)
+            print(summary.getvalue())
+    else:
+        profiler = SamplingProfiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            output = output or 'profile.folded'
+            profiler.write(output)
+            print(f"{profiler.samples} samples over {time.perf_counter() - start:.1f}s\n"
+                  f"{profiler.top(top)}")
+    print(f"Profile written to {output}")
+
+@contextmanager
+def instrumented():
+    """
+    Run an entry point with the observability configured for this run
+
+    Serves metrics when METRICS_PORT is set and profiles the run when
+    PROFILE is 'cprofile' or 'sample', e.g.
+
+        METRICS_PORT=9108 PROFILE=sample python -m src.data.pipeline ...
+    """
+    start_metrics_server(METRICS_PORT)
+    with profiled(PROFILE, PROFILE_OUTPUT):
+        yield
@@ -0,0 +1,130 @@
+import copy
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+class QueryCache:
+    """
+    Bounded LRU cache for query results, validated against ingest watermarks
+
+    Every entry remembers the watermark it was computed at. A lookup only
+    hits when the caller's current watermark is identical, so results are
+    invalidated exactly when new data for their symbols arrives and never
+    merely because time has passed.
+
+    An optional on-disk tier keeps entries evicted from memory, and entries
+    across restarts, as pickles in `disk_dir`.
+    """
+
+    def __init__(self, max_entries: int = 256, disk_dir: Optional[str] = None,
+                 max_disk_entries: int = 4096):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.max_disk_entries = max_disk_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.metrics = {
+            'hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stale': 0,
+            'evictions': 0
+        }
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _disk_path(self, key: Hashable) -> str:
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.disk_dir, f"{digest}.pkl")
+
+    def _read_disk(self, key: Hashable):
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                stored_key, watermark, value = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            return None
+        # Guard against digest collisions
+        return (watermark, value) if stored_key == key else None
+
+    def _write_disk(self, key: Hashable, watermark, value) -> None:
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((key, watermark, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+        files = [os.path.join(self.disk_dir, name) for name in os.listdir(self.disk_dir)
+                 if name.endswith('.pkl')]
+        if len(files) > self.max_disk_entries:
+            files.sort(key=os.path.getmtime)
+            for stale_path in files[:len(files) - self.max_disk_entries]:
+                try:
+                    os.remove(stale_path)
+                except OSError:
+                    pass
+
+    def get(self, key: Hashable, watermark) -> Any:
+        """Cached value for `key` at `watermark`, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] == watermark:
+                    self._entries.move_to_end(key)
+                    self.metrics['hits'] += 1
+                    return copy.copy(entry[1])
+                del self._entries[key]
+                self.metrics['stale'] += 1
+
+        if self.disk_dir:
+            entry = self._read_disk(key)
+            if entry is not None and entry[0] == watermark:
+                with self._lock:
+                    self.metrics['disk_hits'] += 1
+                    self._store(key, watermark, entry[1])
+                return copy.copy(entry[1])
+
+        with self._lock:
+            self.metrics['misses'] += 1
+        return None
+
+    def _store(self, key: Hashable, watermark, value) -> None:
+        self._entries[key] = (watermark, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.metrics['evictions'] += 1
+
+    def put(self, key: Hashable, watermark, value) -> None:
+        with self._lock:
+            self._store(key, watermark, value)
+        if self.disk_dir:
+            self._write_disk(key, watermark, value)
+
+    def get_or_load(self, key: Hashable, watermark, loader: Callable[[], Any]) -> Any:
+        """Read-through lookup: call `loader` and cache its result on a miss"""
+        value = self.get(key, watermark)
+        if value is None:
+            value = loader()
+            self.put(key, watermark, value)
+            value = copy.copy(value)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        if self.disk_dir:
+            for name in os.listdir(self.disk_dir):
+                if name.endswith('.pkl'):
+                    os.remove(os.path.join(self.disk_dir, name))
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters plus the current size and hit ratio"""
+        with self._lock:
+            stats = dict(self.metrics)
+            stats['entries'] = len(self._entries)
+        lookups = stats['hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_ratio'] = (stats['hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        return stats
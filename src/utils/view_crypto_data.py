@@ -1,103 +1,114 @@
-import psycopg2
 import pandas as pd
 from datetime import datetime, timedelta
 import pytz
 from tabulate import tabulate
 
+from src.config import QUERY_CACHE_DIR, QUERY_CACHE_SIZE
+from src.database.connection import get_database
+from src.database.watermarks import get_global_watermark, get_watermarks
+from src.utils.downsample import RangeDownsampler
+from src.utils.metrics import track_query
+from src.utils.profiling import instrumented
+from src.utils.query_cache import QueryCache
+
 class CryptoDataViewer:
-    def __init__(self):
-        self.conn_params = {
-            'dbname': 'crypto_market_data',
-            'user': 'username',
-            'password': 'password',
-            'host': 'localhost',
-            'port': '5432'
-        }
+    def __init__(self, db=None, cache=None):
+        """
+        Args:
+            db: Shared Database, defaults to get_database()
+            cache: QueryCache for query results, defaults to one sized by
+                QUERY_CACHE_SIZE / QUERY_CACHE_DIR. Pass False to disable.
+        """
+        self.db = db or get_database()
+        if cache is None:
+            cache = QueryCache(QUERY_CACHE_SIZE, QUERY_CACHE_DIR)
+        self.cache = cache or None
+        self.downsampler = RangeDownsampler(self.db)
     
-    def get_available_symbols(self):
-        """List all symbols in the database"""
-        query = """
-        SELECT DISTINCT symbol 
-        FROM ohlc_data 
-        ORDER BY symbol;
+    def _watermark(self, symbol=None):
+        """
+        Ingest watermark of `symbol`, or of the whole database
+
+        The table is created with the database (create_crypto_database,
+        migrate_schema or the embedded backends), never on this read path.
         """
+        with self.db.cursor() as cur:
+            if symbol is None:
+                return get_global_watermark(cur)
+            return get_watermarks(cur, [symbol])[symbol]
+    
+    def _cached(self, key, symbol, loader):
+        """Serve `loader`'s result from the cache while `symbol` is unchanged"""
+        def timed_loader():
+            with track_query('viewer', key[0]) as observation:
+                result = loader()
+                observation.rows = len(result) if isinstance(result, (pd.DataFrame, list)) else 1
+            return result
         
-        with psycopg2.connect(**self.conn_params) as conn:
-            df = pd.read_sql_query(query, conn)
+        if self.cache is None:
+            return timed_loader()
+        return self.cache.get_or_load(key, self._watermark(symbol), timed_loader)
+    
+    def get_available_symbols(self):
+        """List all symbols in the database"""
+        def load():
+            df = self.db.query_prepared('available_symbols')
             return df['symbol'].tolist()
+        
+        return self._cached(('available_symbols',), None, load)
     
-    def get_date_range(self, symbol):
+    def get_date_range(self, symbol, interval='1d'):
         """Get the date range for a specific symbol"""
-        query = """
-        SELECT 
-            MIN(timestamp) as earliest_date,
-            MAX(timestamp) as latest_date,
-            COUNT(*) as total_records
-        FROM ohlc_data
-        WHERE symbol = %s;
-        """
-        
-        with psycopg2.connect(**self.conn_params) as conn:
-            df = pd.read_sql_query(query, conn, params=[symbol])
+        def load():
+            df = self.db.query_prepared('date_range', [symbol, interval])
             return df.iloc[0]
+        
+        return self._cached(('date_range', symbol, interval), symbol, load)
     
-    def view_recent_data(self, symbol, limit=10):
+    def view_recent_data(self, symbol, limit=10, interval='1d'):
         """View most recent data for a symbol"""
-        query = """
-        SELECT 
-            timestamp,
-            open,
-            high,
-            low,
-            close,
-            volume
-        FROM ohlc_data
-        WHERE symbol = %s
-        ORDER BY timestamp DESC
-        LIMIT %s;
-        """
-        
-        with psycopg2.connect(**self.conn_params) as conn:
-            df = pd.read_sql_query(query, conn, params=[symbol, limit])
+        def load():
+            df = self.db.query_prepared('recent_data', [symbol, limit, interval])
             # Format timestamp
             df['timestamp'] = df['timestamp'].dt.strftime('%Y-%m-%d %H:%M:%S')
             return df
+        
+        return self._cached(('recent_data', symbol, limit, interval), symbol, load)
     
-    def get_data_by_daterange(self, symbol, start_date, end_date):
+    def get_data_by_daterange(self, symbol, start_date, end_date, interval='1d'):
         """Get data for a specific date range"""
-        query = """
-        SELECT 
-            timestamp,
-            open,
-            high,
-            low,
-            close,
-            volume
-        FROM ohlc_data
-        WHERE symbol = %s
-        AND timestamp BETWEEN %s AND %s
-        ORDER BY timestamp DESC;
-        """
+        def load():
+            return self.db.query_prepared('range_data', [symbol, start_date, end_date, interval])
         
-        with psycopg2.connect(**self.conn_params) as conn:
-            return pd.read_sql_query(query, conn, params=[symbol, start_date, end_date])
+        key = ('range_data', symbol, str(start_date), str(end_date), interval)
+        return self._cached(key, symbol, load)
+    
+    def get_bucketed_ohlc(self, symbol, start, end=None, interval='1m', points=1500):
+        """
+        Candles of [start, end) aggregated into at most `points` time buckets
+
+        Leave `end` None for the latest candles: the range then ends at the
+        last stored candle, so the cached result stays valid until the next
+        ingest instead of being keyed on the current time.
+        """
+        key = ('bucketed_ohlc', symbol, str(start), str(end), interval, points)
+        return self._cached(key, symbol, lambda: self.downsampler.ohlc(
+            symbol, interval, start, end, points)[1])
+    
+    def get_downsampled_close(self, symbol, start, end=None, interval='1m', points=1500):
+        """Close series of [start, end) downsampled to `points` with LTTB, see get_bucketed_ohlc"""
+        key = ('downsampled_close', symbol, str(start), str(end), interval, points)
+        return self._cached(key, symbol, lambda: self.downsampler.close(
+            symbol, interval, start, end, points)[1])
     
     def get_database_stats(self):
         """Get general statistics about the database"""
-        query = """
-        SELECT 
-            symbol,
-            COUNT(*) as record_count,
-            MIN(timestamp) as earliest_date,
-            MAX(timestamp) as latest_date,
-            ROUND(AVG(volume), 2) as avg_volume
-        FROM ohlc_data
-        GROUP BY symbol
-        ORDER BY record_count DESC;
-        """
-        
-        with psycopg2.connect(**self.conn_params) as conn:
-            return pd.read_sql_query(query, conn)
+        return self._cached(('database_stats',), None,
+                            lambda: self.db.query_prepared('database_stats'))
+    
+    def get_cache_stats(self):
+        """Hit/miss metrics of the query cache"""
+        return self.cache.stats() if self.cache is not None else {}
 
 def main():
     viewer = CryptoDataViewer()
@@ -147,6 +158,10 @@ def main():
             stats = viewer.get_database_stats()
             print("\nDatabase Statistics:")
             print(tabulate(stats, headers='keys', tablefmt='psql', floatfmt=".2f"))
+            cache_stats = viewer.get_cache_stats()
+            if cache_stats:
+                print(f"\nQuery cache: {cache_stats['hits'] + cache_stats['disk_hits']} hits, "
+                      f"{cache_stats['misses']} misses ({cache_stats['hit_ratio']:.0%} hit ratio)")
         
         elif choice == '6':
             print("Goodbye!")
@@ -158,4 +173,5 @@ def main():
         input("\nPress Enter to continue...")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with instrumented():
+        main()
\ No newline at end of file